@@ -0,0 +1,308 @@
+"""Warm Stable Diffusion pipelines and the job queue that runs them"""
+import io
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from metrics import observe, timed
+
+MODEL_ID = 'runwayml/stable-diffusion-v1-5'  # lighter model
+
+# output formats for generated images: PIL format name and mimetype
+IMAGE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def load_stable_diffusion(model_id=MODEL_ID):
+    """Load a Stable Diffusion pipeline onto the CPU"""
+    import torch
+    from diffusers import StableDiffusionPipeline  # regular SD pipeline
+
+    pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=torch.float32)
+
+    # force CPU usage
+    return pipe.to('cpu')
+
+
+def seeded_generator(seed):
+    """torch random generator for reproducible (and therefore cacheable) images"""
+    import torch
+
+    return torch.Generator('cpu').manual_seed(seed)
+
+
+def step_timer():
+    """callback_on_step_end for one pipeline call, observing each denoising step
+
+    The clock starts when the timer is made, so the first step also counts
+    the prompt encoding that precedes it.
+    """
+    last = [time.perf_counter()]
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        observe('diffusion_step', now - last[0])
+        last[0] = now
+        return callback_kwargs
+
+    return on_step_end
+
+
+def encode_image(image, image_format='png', quality=85):
+    """Encode a PIL image in memory, returning (bytes, mimetype)
+
+    quality only applies to the lossy formats (WebP and JPEG).
+    """
+    pil_format, mimetype = IMAGE_FORMATS[image_format]
+    buffer = io.BytesIO()
+    if pil_format == 'PNG':
+        image.save(buffer, format=pil_format)
+    else:
+        image.convert('RGB').save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue(), mimetype
+
+
+class PipelinePool:
+    """Fixed number of warm pipelines handed out to one request at a time
+
+    Pipelines are loaded once in a background thread and then reused for the
+    life of the process. A pipeline is not safe to call from two threads at
+    once, so each request checks one out exclusively and returns it when done.
+    """
+
+    def __init__(self, size=1, loader=load_stable_diffusion):
+        self.size = size
+        self.loader = loader
+        self.loaded = 0
+        self.error = None
+        self.load_seconds = None
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Begin loading the pipelines in the background, once per process"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._load_all, name='pipeline-loader', daemon=True).start()
+
+    def _load_all(self):
+        start = time.perf_counter()
+        try:
+            for _ in range(self.size):
+                with timed('model_load'):
+                    pipe = self.loader()
+                self._idle.put(pipe)
+                self.loaded += 1
+                print(f"Loaded Stable Diffusion pipeline {self.loaded}/{self.size}")
+        except Exception as e:
+            self.error = str(e)
+            print(f"Error loading Stable Diffusion pipeline: {self.error}")
+        self.load_seconds = time.perf_counter() - start
+
+    @property
+    def ready(self):
+        """True once at least one pipeline is resident"""
+        return self.loaded > 0
+
+    @contextmanager
+    def acquire(self):
+        """Check out an idle pipeline, waiting until one is free"""
+        pipe = self._idle.get()
+        try:
+            yield pipe
+        finally:
+            self._idle.put(pipe)
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'size': self.size,
+            'loaded': self.loaded,
+            'idle': self._idle.qsize(),
+            'error': self.error,
+            'load_seconds': self.load_seconds,
+        }
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+    def __init__(self, retry_after):
+        super().__init__('Too many AI art requests are queued, please try again later')
+        self.retry_after = retry_after
+
+
+class ArtJob:
+    """One queued AI art generation and, once finished, its result
+
+    Followers are jobs for the same key submitted while this one was queued
+    or running; they finish with it instead of running again.
+    """
+
+    def __init__(self, params, key=None):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.key = key
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.followers = []
+
+    def to_dict(self):
+        job = {'job_id': self.id, 'status': self.status}
+        if self.error:
+            job['error'] = self.error
+        return job
+
+
+class ArtJobQueue:
+    """Bounded queue of AI art jobs, run by worker threads that own the pipelines
+
+    submit() returns immediately with a job; each worker checks a pipeline out
+    of the pool, runs render(pipe, params) and stores what it returns as the
+    job result. A job submitted with the key of one still queued or running
+    follows that job rather than taking a queue slot and a run of its own.
+    Finished jobs are forgotten after result_ttl seconds, and the oldest
+    finished ones earlier once more than max_jobs are kept.
+    """
+
+    def __init__(self, pool, render, workers=1, max_pending=8, result_ttl=600, max_jobs=10000):
+        self.pool = pool
+        self.render = render
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.max_jobs = max_jobs
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        # key -> the queued or running job generating it
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._running = 0
+        self._avg_seconds = None
+
+    def start(self):
+        """Start the worker threads, once per process"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'art-worker-{i}', daemon=True).start()
+
+    def submit(self, params, key=None):
+        """Queue a job and return it, or raise QueueFull when at capacity
+
+        If a job with the same key is queued or running, the new job follows
+        it and is not queued.
+        """
+        self._prune()
+        job = ArtJob(params, key)
+        with self._lock:
+            leader = self._in_flight.get(key) if key is not None else None
+            if leader is not None:
+                job.status = leader.status
+                leader.followers.append(job)
+            else:
+                try:
+                    self._pending.put_nowait(job)
+                except queue.Full:
+                    raise QueueFull(self.retry_after())
+                if key is not None:
+                    self._in_flight[key] = job
+            self._remember(job)
+        return job
+
+    def add_finished(self, params, result=None):
+        """Record a job that needs no generation, e.g. served from a cache"""
+        self._prune()
+        job = ArtJob(params)
+        job.result = result
+        job.status = 'done'
+        job.finished = time.time()
+        with self._lock:
+            self._remember(job)
+        return job
+
+    def _remember(self, job):
+        # called with the lock held; queued and running jobs are never
+        # dropped, and there are at most max_pending + workers of them
+        self._jobs[job.id] = job
+        if len(self._jobs) > self.max_jobs:
+            finished = [job_id for job_id, kept in self._jobs.items() if kept.finished is not None]
+            for job_id in finished[:len(self._jobs) - self.max_jobs]:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Look up a job by id, None if unknown or expired"""
+        self._prune()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def retry_after(self):
+        """Rough number of seconds until a queue slot frees up"""
+        avg_seconds = self._avg_seconds or 30
+        return max(1, round(avg_seconds * (self._pending.qsize() + 1) / self.workers))
+
+    def _work(self):
+        while True:
+            job = self._pending.get()
+            with self._lock:
+                for each in [job] + job.followers:
+                    each.status = 'running'
+                self._running += 1
+            start = time.perf_counter()
+            result = error = None
+            try:
+                with self.pool.acquire() as pipe:
+                    result = self.render(pipe, job.params)
+                status = 'done'
+            except Exception as e:
+                print(f"Error generating AI art for job {job.id}: {str(e)}")
+                error = str(e)
+                status = 'failed'
+            finished = time.time()
+
+            # moving average of generation time, used for retry hints
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                if job.key is not None:
+                    del self._in_flight[job.key]
+                # the result is in place before the status says done
+                for each in [job] + job.followers:
+                    each.result = result
+                    each.error = error
+                    each.status = status
+                    each.finished = finished
+                self._running -= 1
+                if self._avg_seconds is None:
+                    self._avg_seconds = elapsed
+                else:
+                    self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def status(self):
+        return {
+            'queued': self._pending.qsize(),
+            'running': self._running,
+            'max_pending': self._pending.maxsize,
+            'workers': self.workers,
+            'avg_seconds': self._avg_seconds,
+        }
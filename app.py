@@ -1,18 +1,130 @@
-from flask import Flask, request, jsonify, render_template_string
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import torch
-from diffusers import StableDiffusionXLPipeline
+import time
+BOOT_START = time.perf_counter()
+
+from flask import Flask, Response, g, request, jsonify, render_template_string
+from PIL import Image
 import base64 
+import functools
+import hmac
+import io
 import os
+from ai_art import MODEL_ID, IMAGE_FORMATS, ArtJobQueue, PipelinePool, QueueFull, encode_image, seeded_generator, step_timer
+from catalog import RECORD_KEYS, RECORD_TEXT, Catalog, CatalogReloader, ChangeLog
+from emotion_index import EMOTION_FAMILIES, EmotionIndex
+from image_cache import ImageCache, cache_key
+from metrics import CONTENT_TYPE, METRICS_ENABLED, REGISTRY, callback, histogram, observe, timed
+from pairing_table import PAIRING_TABLE_DIR, load_pairing_table
+from ranking import fuse_scores, top_k
+from record_store import FOOD_CATEGORICAL_FIELDS, FOOD_RECORD_FIELDS, RecordStore
+from result_cache import ResultCache, normalize_text
+from snapshot import (ART_COLUMNS, ART_VECTOR_INDEX, FOOD_COLUMNS, FOOD_FEATURIZER, FOOD_HASHING_FEATURES, SNAPSHOT_DIR,
+                      SnapshotPublisher, dataset_fingerprint, ensure_snapshot, load_snapshot, read_csv_projected,
+                      snapshot_is_current, snapshot_version)
+from text_index import SCORES_MANY_CELLS, ArtIndex, FoodIndex
 
 app = Flask(__name__)
 
 # Paths to CSV dataset files
-FOOD_CSV_PATH = '/Users/sianna/Downloads/cpsc490/fooddataset490.csv'
-ART_CSV_PATH = '/Users/sianna/Downloads/cpsc490/artdataset490.csv'
+FOOD_CSV_PATH = os.environ.get('FOOD_CSV_PATH', '/Users/sianna/Downloads/cpsc490/fooddataset490.csv')
+ART_CSV_PATH = os.environ.get('ART_CSV_PATH', '/Users/sianna/Downloads/cpsc490/artdataset490.csv')
+
+# worker roles: 'all' serves everything, 'pairing' never loads the ML stack
+# and 'ai-art' skips the datasets. torch and diffusers are only imported when
+# the pipelines load, at startup or, with AI_ART_PRELOAD=0, on first use
+APP_ROLE = os.environ.get('APP_ROLE', 'all')
+SERVES_PAIRING = APP_ROLE in ('all', 'pairing')
+SERVES_AI_ART = APP_ROLE in ('all', 'ai-art')
+AI_ART_PRELOAD = os.environ.get('AI_ART_PRELOAD', '1') == '1'
+
+# workers build the binary snapshot once if it is missing or stale, then
+# memory-map its arrays so every worker process shares one copy of them
+SNAPSHOT_AUTO_BUILD = os.environ.get('SNAPSHOT_AUTO_BUILD', '1') == '1'
+SNAPSHOT_MMAP = os.environ.get('SNAPSHOT_MMAP', '1') == '1'
+
+# number of artworks returned per pairing, and the most a client may ask for
+DEFAULT_NUM_MATCHES = 3
+MAX_NUM_MATCHES = 50
+
+# how artworks are ranked: title TF-IDF similarity, similarity in the
+# 20-emotion space using one of the emotion families in the art dataset, or
+# a weighted blend of the two
+PAIRING_MODES = ('text', 'emotion', 'hybrid')
+DEFAULT_EMOTION_FAMILY = 'art'
+DEFAULT_HYBRID_WEIGHTS = {'text': 0.7, 'emotion': 0.3}
+
+# optional request filters on the art metadata, e.g. {"style": "Baroque"};
+# a list accepts any of its values and combined filters must all match
+ART_FILTERS = {'style': 'Style', 'category': 'Category', 'artist': 'Artist'}
+
+# buckets probed per emotion-mode search when ART_VECTOR_INDEX is 'ivf'; the
+# featurizer and vector index settings live in snapshot.py
+ART_VECTOR_PROBES = int(os.environ.get('ART_VECTOR_PROBES', 8))
+
+# pairing results are cached per normalized input until the datasets change
+PAIRING_CACHE_SIZE = int(os.environ.get('PAIRING_CACHE_SIZE', 10000))
+PAIRING_CACHE_TTL = int(os.environ.get('PAIRING_CACHE_TTL', 3600))
+
+pairing_cache = ResultCache(max_entries=PAIRING_CACHE_SIZE, ttl=PAIRING_CACHE_TTL)
+
+# datasets can be reloaded without a restart through POST /admin/reload-datasets
+# or, when DATASET_WATCH_INTERVAL is set, whenever the CSV files change. A
+# reload request also touches DATASET_RELOAD_TRIGGER, which the watchers poll
+# along with the CSVs, so with watching on every worker reloads; without it
+# only the worker that received the request does
+DATASET_WATCH_INTERVAL = float(os.environ.get('DATASET_WATCH_INTERVAL', 0))
+DATASET_RELOAD_TRIGGER = os.environ.get('DATASET_RELOAD_TRIGGER', f'{SNAPSHOT_DIR}.reload')
+
+# the admin endpoints need this token in the X-Admin-Token header, and answer
+# 404 when it is not set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# records added or deleted through /admin/records are indexed incrementally
+# and folded into refitted indexes every CATALOG_COMPACT_INTERVAL seconds.
+# Each change is appended to a log in CATALOG_CHANGES_DIR, one file per
+# dataset version, which every worker replays when it loads the datasets and
+# polls every CATALOG_CHANGES_POLL_INTERVAL seconds for the others' changes.
+# One worker at a time compacts, writing a new snapshot that every worker
+# then reloads and starting a new log, so startup replays only later changes
+CATALOG_COMPACT_INTERVAL = float(os.environ.get('CATALOG_COMPACT_INTERVAL', 300))
+CATALOG_CHANGES_DIR = os.environ.get('CATALOG_CHANGES_DIR', f'{SNAPSHOT_DIR}.changes')
+CATALOG_CHANGES_POLL_INTERVAL = float(os.environ.get('CATALOG_CHANGES_POLL_INTERVAL', 1))
+
+# batch pairing: most inputs per request, and how many are scored per matrix
+# product; large catalogs get smaller chunks, see SCORES_MANY_CELLS
+MAX_BATCH_SIZE = 5000
+BATCH_CHUNK_SIZE = 256
+
+# warm Stable Diffusion pipelines kept resident, one worker thread each, and
+# how many jobs may wait for them before new requests get a 429
+AI_ART_POOL_SIZE = int(os.environ.get('AI_ART_POOL_SIZE', 1))
+AI_ART_MAX_PENDING = int(os.environ.get('AI_ART_MAX_PENDING', 8))
+AI_ART_RESULT_TTL = 600
+AI_ART_MAX_JOBS = int(os.environ.get('AI_ART_MAX_JOBS', 10000))
+AI_ART_RETRY_AFTER = 30
+
+# how finished images are handed back: a base64 data URI inside the JSON,
+# the raw image bytes, or a URL that stays valid until the job expires
+AI_ART_RESPONSE_MODES = ('data_uri', 'binary', 'url')
+
+# diffusion settings; a fixed default seed makes repeated prompts cacheable
+AI_ART_STEPS = 15  # fewer steps for faster generation
+AI_ART_GUIDANCE_SCALE = 7.0
+AI_ART_DEFAULT_SEED = 0
+
+# generated images are cached by prompt and settings, in memory and on disk
+AI_ART_CACHE_DIR = os.environ.get('AI_ART_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai_art_cache'))
+AI_ART_CACHE_MEMORY_MB = int(os.environ.get('AI_ART_CACHE_MEMORY_MB', 64))
+AI_ART_CACHE_DISK_MB = int(os.environ.get('AI_ART_CACHE_DISK_MB', 1024))
+
+image_cache = ImageCache(
+    AI_ART_CACHE_DIR,
+    max_memory_bytes=AI_ART_CACHE_MEMORY_MB * 1024 ** 2,
+    max_disk_bytes=AI_ART_CACHE_DISK_MB * 1024 ** 2
+)
+
+pipeline_pool = PipelinePool(size=AI_ART_POOL_SIZE)
+boot_seconds = None
+boot_rss_mb = None
 
 # HTML 
 HTML_TEMPLATE = '''
@@ -526,6 +638,7 @@ HTML_TEMPLATE = '''
     <script>
         let currentSlide = 0;
         let totalSlides = 0;
+        const AI_ART_POLL_INTERVAL_MS = 2000;
 
         function toggleTheme() {
             document.body.classList.toggle('classic-theme');
@@ -715,18 +828,23 @@ HTML_TEMPLATE = '''
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ input: userInput })
+                    body: JSON.stringify({ input: userInput, response: 'url' })
                 });
 
                 console.log("Response received"); // Debug log
-                const data = await response.json();
+                const job = await response.json();
 
+                if (response.status === 429) {
+                    throw new Error(`${job.error} (retry in about ${job.retry_after} seconds)`);
+                }
                 if (!response.ok) {
-                    throw new Error(data.error || 'Failed to generate AI art');
+                    throw new Error(job.error || 'Failed to generate AI art');
                 }
 
+                const data = await waitForAIArt(job);
+
                 console.log("Processing response data"); // Debug log
-                if (data.success && data.image_data) {
+                if (data.success && data.image_url) {
                     contentWrapper.classList.remove('centered');
                     contentWrapper.classList.add('split');
                     
@@ -737,7 +855,7 @@ HTML_TEMPLATE = '''
                     artMatch.className = 'art-match active';
                     artMatch.innerHTML = `
                         <div class="art-display">
-                            <img src="${data.image_data}" alt="AI Generated Art">
+                            <img src="${data.image_url}" alt="AI Generated Art">
                         </div>
                         <div class="art-info">
                             <p><strong>Title:</strong> AI Interpretation</p>
@@ -758,6 +876,31 @@ HTML_TEMPLATE = '''
             }
         }
 
+        // poll a queued AI art job until it finishes, then fetch the image
+        async function waitForAIArt(job) {
+            let status = job;
+            while (status.status === 'queued' || status.status === 'running') {
+                await new Promise(resolve => setTimeout(resolve, AI_ART_POLL_INTERVAL_MS));
+                const response = await fetch(job.status_url);
+                status = await response.json();
+                if (!response.ok) {
+                    throw new Error(status.error || 'Failed to generate AI art');
+                }
+                console.log("AI art job status:", status.status); // Debug log
+            }
+
+            if (status.status !== 'done') {
+                throw new Error(status.error || 'Failed to generate AI art');
+            }
+
+            const response = await fetch(status.result_url);
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Failed to generate AI art');
+            }
+            return data;
+        }
+
         // update button creation func + debuggingg 
         function addGenerateOriginalArtButton() {
             console.log("Adding AI Art button"); // Debug log
@@ -815,93 +958,281 @@ HTML_TEMPLATE = '''
 '''
 
 # load datasets
-def load_datasets():
-    """Load and prepare the food and art datasets"""
-    global food_df, art_df
-    try:
-        food_df = pd.read_csv(FOOD_CSV_PATH)
-        art_df = pd.read_csv(ART_CSV_PATH)
-        print(f"Loaded {len(food_df)} food entries and {len(art_df)} art entries")
-        return True
-    except Exception as e:
-        print(f"Error loading datasets: {str(e)}")
-        return False
-
-def find_matching_food(input_text):
-    """Find the most similar food item to input text"""
-    # intialize and fit TF-IDF vectorizer on food descriptions
-    food_vectorizer = TfidfVectorizer(stop_words='english')
-    food_tfidf_matrix = food_vectorizer.fit_transform(food_df['description'].fillna(''))
+def load_catalog():
+    """Load and prepare the food and art datasets as a new Catalog"""
+    start = time.perf_counter()
+    if SNAPSHOT_AUTO_BUILD:
+        try:
+            ensure_snapshot(SNAPSHOT_DIR, FOOD_CSV_PATH, ART_CSV_PATH, FOOD_FEATURIZER, FOOD_HASHING_FEATURES,
+                            ART_VECTOR_INDEX)
+        except Exception as e:
+            print(f"Could not build snapshot, loading the CSVs instead: {str(e)}")
+    
+    index_params = {'n_probe': ART_VECTOR_PROBES} if ART_VECTOR_INDEX == 'ivf' else {}
     
-    # trabsform input text
-    input_vector = food_vectorizer.transform([input_text])
+    # a current binary snapshot skips CSV parsing and index fitting
+    if snapshot_is_current(SNAPSHOT_DIR, FOOD_CSV_PATH, ART_CSV_PATH, FOOD_FEATURIZER, FOOD_HASHING_FEATURES,
+                           ART_VECTOR_INDEX):
+        food_records, art_records, food_index, art_index, emotion_index, manifest = load_snapshot(
+            SNAPSHOT_DIR, SNAPSHOT_MMAP, ART_VECTOR_INDEX, **index_params
+        )
+        version = snapshot_version(manifest)
+        print(f"Loaded snapshot {version} from {SNAPSHOT_DIR}")
+    else:
+        # only the columns the app uses, streamed in chunks with float32 scores
+        food_df = read_csv_projected(FOOD_CSV_PATH, FOOD_COLUMNS)
+        art_df = read_csv_projected(ART_CSV_PATH, ART_COLUMNS)
+        version = dataset_fingerprint([FOOD_CSV_PATH, ART_CSV_PATH])
+        
+        # fit the indexes once so requests only transform their input
+        food_index = FoodIndex(food_df, FOOD_FEATURIZER, FOOD_HASHING_FEATURES)
+        art_index = ArtIndex(art_df)
+        emotion_index = EmotionIndex(art_df, art_index, ART_VECTOR_INDEX, **index_params)
+        # the scores now live in the emotion index, only the metadata is kept
+        art_records = RecordStore.from_frame(art_df)
+        food_records = RecordStore.from_frame(food_df, FOOD_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS)
+    print(f"Loaded {len(food_records)} food entries and {len(art_records)} art entries")
     
-    # calculate similarities
-    similarities = cosine_similarity(input_vector, food_tfidf_matrix).flatten()
+    # text-mode rankings precomputed for this version by `python pairing_table.py build`
+    pairings = load_pairing_table(PAIRING_TABLE_DIR, version, len(food_records), len(art_records), SNAPSHOT_MMAP)
+    if pairings is not None:
+        print(f"Loaded pairing table with the top {pairings.k} artworks per food")
     
-    # best match
-    best_match_idx = similarities.argmax()
-    best_match = food_df.iloc[best_match_idx]
+    observe('dataset_load', time.perf_counter() - start)
+    return Catalog(food_records, art_records, food_index, art_index, emotion_index, version, pairings)
+
+def catalog_swapped(previous, catalog):
+    """Drop cached pairings computed from a previous dataset version"""
+    if previous is None or previous.version != catalog.version:
+        pairing_cache.clear()
+
+def datasets_fingerprint():
+    """Fingerprint of the dataset files together with the time a reload was last requested"""
+    try:
+        requested = os.stat(DATASET_RELOAD_TRIGGER).st_mtime_ns
+    except FileNotFoundError:
+        requested = None
+    return (dataset_fingerprint([FOOD_CSV_PATH, ART_CSV_PATH]), requested)
+
+def request_reload():
+    """Touch the reload trigger, so the watchers of every worker reload"""
+    os.makedirs(os.path.dirname(os.path.abspath(DATASET_RELOAD_TRIGGER)), exist_ok=True)
+    with open(DATASET_RELOAD_TRIGGER, 'a'):
+        pass
+    os.utime(DATASET_RELOAD_TRIGGER)
+
+catalogs = CatalogReloader(
+    load_catalog,
+    fingerprint=datasets_fingerprint,
+    on_swap=catalog_swapped,
+    change_log=ChangeLog(CATALOG_CHANGES_DIR),
+    publisher=SnapshotPublisher(SNAPSHOT_DIR)
+)
+
+def find_matching_food(catalog, input_text):
+    """Find the most similar food item to input text"""
+    best_match_idx, similarity = catalog.food_index.query(input_text)
+    best_match = catalog.food_row(best_match_idx)
     
     return {
         'match': {
             'name': best_match['name'],
             'description': best_match['description']
         },
-        'similarity': float(similarities[best_match_idx])
+        'similarity': similarity,
+        'index': best_match_idx
     }
 
-def find_matching_art(food_description, num_matches=3):
-    """Find top 3 most similar artworks based on the food description"""
-    art_vectorizer = TfidfVectorizer(stop_words='english')
-    art_titles = art_df['Title'].fillna('')
-    art_tfidf_matrix = art_vectorizer.fit_transform(art_titles)
+def find_matching_art(catalog, food_description, num_matches=DEFAULT_NUM_MATCHES, mode='text',
+                      emotion_family=DEFAULT_EMOTION_FAMILY, weights=None, food_idx=None, filters=None):
+    """Find the most similar artworks based on the food description
+
+    In hybrid mode each match also reports its per-component scores. In text
+    mode, with the food row known, the ranking is read from the catalog's
+    pairing table when it has one. With filters, a dict of art field to
+    accepted values, only the matching artworks are scored.
+    """
+    if not filters:
+        if mode == 'text' and food_idx is not None and catalog.pairings is not None:
+            with timed('pairing_table'):
+                precomputed = catalog.pairings.lookup(food_idx, num_matches)
+            if precomputed is not None:
+                return build_art_matches(catalog, *precomputed)
+        
+        if mode == 'emotion':
+            top_indices, top_scores = catalog.emotion_index.search(food_description, emotion_family, num_matches)
+            return build_art_matches(catalog, top_indices, top_scores)
+        elif mode == 'text':
+            # only titles sharing a term with the description are scored
+            top_indices, top_scores = catalog.art_index.search(food_description, num_matches)
+            return build_art_matches(catalog, top_indices, top_scores)
     
-    food_vector = art_vectorizer.transform([food_description])
-    similarities = cosine_similarity(food_vector, art_tfidf_matrix).flatten()
+    # the precomputed facet ids pick the rows to score, None scores them all
+    ids = catalog.art_ids(filters) if filters else None
+    components = None
+    if mode == 'hybrid':
+        components = {
+            'text': catalog.art_index.scores(food_description, ids),
+            'emotion': catalog.emotion_index.scores(food_description, emotion_family, ids)
+        }
+        similarities = fuse_scores(components, weights or DEFAULT_HYBRID_WEIGHTS)
+    elif mode == 'emotion':
+        similarities = catalog.emotion_index.scores(food_description, emotion_family, ids)
+    else:
+        similarities = catalog.art_index.scores(food_description, ids)
     
-    # Get indices of top 3 matches
-    top_indices = similarities.argsort()[-num_matches:][::-1]
+    # partial selection of the top matches, no full sort of the catalog
+    with timed('top_k'):
+        top = top_k(similarities, num_matches)
+    top_indices = top if ids is None else ids[top]
+    if components:
+        components = {name: scores[top] for name, scores in components.items()}
     
-    matches = []
-    for idx in top_indices:
-        art_piece = art_df.iloc[idx]
-        matches.append({
-            'match': {
-                'Title': art_piece['Title'],
-                'Artist': art_piece['Artist'],
-                'Style': art_piece['Style'],
-                'Category': art_piece['Category'],
-                'Image URL': art_piece['Image URL']
-            },
-            'similarity': float(similarities[idx])
-        })
+    return build_art_matches(catalog, top_indices, similarities[top], components)
+
+def build_art_matches(catalog, top_indices, top_scores, components=None):
+    """Build the art_matches response entries for ranked art rows
+
+    components maps a score name to an array of scores in the same order as
+    top_indices.
+    """
+    with timed('metadata'):
+        matches = []
+        # one batched lookup in the record store, missing fields come back as None
+        records = catalog.art_rows(top_indices)
+        for i, (record, score) in enumerate(zip(records, top_scores)):
+            match = {
+                'match': record,
+                'similarity': float(score)
+            }
+            if components:
+                match['scores'] = {name: float(scores[i]) for name, scores in components.items()}
+            matches.append(match)
     
     return matches
 
+def pairing_cache_key(input_text, num_matches, mode='text', emotion_family=DEFAULT_EMOTION_FAMILY, weights=None,
+                      filters=None):
+    """Key of a pairing result in pairing_cache"""
+    weights = tuple(sorted((weights or DEFAULT_HYBRID_WEIGHTS).items())) if mode == 'hybrid' else None
+    filters = tuple(sorted(
+        (field, tuple(sorted({value.strip().casefold() for value in values})))
+        for field, values in (filters or {}).items()
+    ))
+    return (normalize_text(input_text), num_matches, mode, emotion_family, weights, filters)
+
+def find_matching_pairings(catalog, input_texts, num_matches=DEFAULT_NUM_MATCHES):
+    """Pair many food descriptions with artworks, one art_matches list per input
+
+    Each chunk of inputs is matched to foods with one matrix product, and the
+    matched descriptions are scored against every artwork with another. The
+    larger catalog bounds the chunk size, so the dense score matrices stay
+    under SCORES_MANY_CELLS.
+    """
+    catalog_rows = max(len(catalog.food_index), len(catalog.art_index), 1)
+    chunk_size = max(1, min(BATCH_CHUNK_SIZE, SCORES_MANY_CELLS // catalog_rows))
+    results = []
+    for start in range(0, len(input_texts), chunk_size):
+        chunk = input_texts[start:start + chunk_size]
+        
+        food_similarities = catalog.food_index.scores_many(chunk)
+        food_indices = food_similarities.argmax(axis=1)
+        
+        # rankings precomputed per food row only need a table read
+        with timed('pairing_table'):
+            precomputed = catalog.pairings.lookup(food_indices, num_matches) if catalog.pairings is not None else None
+        if precomputed is not None:
+            results.extend(build_art_matches(catalog, top_indices, top_scores)
+                           for top_indices, top_scores in zip(*precomputed))
+            continue
+        
+        descriptions = catalog.food_descriptions(food_indices)
+        
+        art_similarities = catalog.art_index.scores_many(descriptions)
+        for similarities in art_similarities:
+            with timed('top_k'):
+                top_indices = top_k(similarities, num_matches)
+            results.append(build_art_matches(catalog, top_indices, similarities[top_indices]))
+    
+    return results
+
 @app.route('/')
 def home():
     return render_template_string(HTML_TEMPLATE)
 
 @app.route('/generate-pairing', methods=['POST'])
 def generate_pairing():
+    # one catalog for the whole request, even if a reload swaps it meanwhile
+    catalog = catalogs.current
+    if catalog is None:
+        return jsonify({'error': 'Pairing datasets are not loaded on this worker'}), 503
     try:
         data = request.get_json()
         user_input = data.get('input', '')
+        num_matches = data.get('num_matches', DEFAULT_NUM_MATCHES)
         
         if not user_input.strip():
             return jsonify({'error': 'Please enter a food description'}), 400
         
-        food_match = find_matching_food(user_input)
+        if not isinstance(num_matches, int) or isinstance(num_matches, bool) or not 1 <= num_matches <= MAX_NUM_MATCHES:
+            return jsonify({'error': f'num_matches must be an integer between 1 and {MAX_NUM_MATCHES}'}), 400
         
-        if food_match['match']:
-            art_matches = find_matching_art(food_match['match']['description'])
-            
-            if art_matches:
+        mode = data.get('mode', 'text')
+        emotion_family = data.get('emotion_family', DEFAULT_EMOTION_FAMILY)
+        
+        if mode not in PAIRING_MODES:
+            return jsonify({'error': f'mode must be one of {", ".join(PAIRING_MODES)}'}), 400
+        
+        if emotion_family not in EMOTION_FAMILIES:
+            return jsonify({'error': f'emotion_family must be one of {", ".join(EMOTION_FAMILIES)}'}), 400
+        
+        weights = data.get('weights', {})
+        if isinstance(weights, dict):
+            weights = {**DEFAULT_HYBRID_WEIGHTS, **weights}
+        if not isinstance(weights, dict) or set(weights) != set(DEFAULT_HYBRID_WEIGHTS) or not all(
+                isinstance(weight, (int, float)) and not isinstance(weight, bool) and weight >= 0
+                for weight in weights.values()):
+            return jsonify({'error': f'weights must map {", ".join(DEFAULT_HYBRID_WEIGHTS)} to non-negative numbers'}), 400
+        # all-zero weights would rank every artwork at 0
+        if sum(weights.values()) <= 0:
+            return jsonify({'error': 'weights must not all be zero'}), 400
+        
+        filters = {}
+        for name, field in ART_FILTERS.items():
+            values = data.get(name)
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            if not isinstance(values, list) or not values or not all(
+                    isinstance(value, str) and value.strip() for value in values):
+                return jsonify({'error': f'{name} must be a non-empty string or list of strings'}), 400
+            filters[field] = values
+        
+        cache_key = pairing_cache_key(user_input, num_matches, mode, emotion_family, weights, filters)
+        art_matches = pairing_cache.get(cache_key, catalog.version)
+        if art_matches is not None:
+            with timed('serialize'):
                 return jsonify({
                     'success': True,
-                    'art_matches': art_matches
+                    'art_matches': art_matches,
+                    'dataset_version': catalog.version
                 })
+        
+        food_match = find_matching_food(catalog, user_input)
+        
+        if food_match['match']:
+            art_matches = find_matching_art(catalog, food_match['match']['description'], num_matches, mode, emotion_family,
+                                            weights, food_match['index'], filters)
+            
+            if art_matches:
+                pairing_cache.put(cache_key, catalog.version, art_matches)
+                with timed('serialize'):
+                    return jsonify({
+                        'success': True,
+                        'art_matches': art_matches,
+                        'dataset_version': catalog.version
+                    })
             else:
                 return jsonify({'error': 'No matching artwork found'}), 404
         else:
@@ -911,9 +1242,125 @@ def generate_pairing():
         print(f"Error: {str(e)}")  # debugging
         return jsonify({'error': str(e)}), 500
     
+@app.route('/generate-pairing/batch', methods=['POST'])
+def generate_pairing_batch():
+    catalog = catalogs.current
+    if catalog is None:
+        return jsonify({'error': 'Pairing datasets are not loaded on this worker'}), 503
+    try:
+        data = request.get_json()
+        inputs = data.get('inputs', [])
+        num_matches = data.get('num_matches', DEFAULT_NUM_MATCHES)
+        
+        if not isinstance(inputs, list) or not all(isinstance(text, str) for text in inputs):
+            return jsonify({'error': 'inputs must be a list of food descriptions'}), 400
+        
+        if not inputs or len(inputs) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'inputs must contain between 1 and {MAX_BATCH_SIZE} descriptions'}), 400
+        
+        if not isinstance(num_matches, int) or isinstance(num_matches, bool) or not 1 <= num_matches <= MAX_NUM_MATCHES:
+            return jsonify({'error': f'num_matches must be an integer between 1 and {MAX_NUM_MATCHES}'}), 400
+        
+        # blank inputs get an error entry, cached inputs are answered from the
+        # cache, and the rest are paired in one pass
+        version = catalog.version
+        cached = {}
+        uncached = []
+        for text in inputs:
+            if text.strip():
+                key = pairing_cache_key(text, num_matches)
+                if key not in cached:
+                    cached[key] = pairing_cache.get(key, version)
+                    if cached[key] is None:
+                        uncached.append(text)
+        
+        for text, art_matches in zip(uncached, find_matching_pairings(catalog, uncached, num_matches)):
+            key = pairing_cache_key(text, num_matches)
+            cached[key] = art_matches
+            pairing_cache.put(key, version, art_matches)
+        
+        results = []
+        for text in inputs:
+            if text.strip():
+                results.append({'input': text, 'art_matches': cached[pairing_cache_key(text, num_matches)]})
+            else:
+                results.append({'input': text, 'error': 'Please enter a food description'})
+        
+        with timed('serialize'):
+            return jsonify({
+                'success': True,
+                'results': results,
+                'dataset_version': version
+            })
+            
+    except Exception as e:
+        print(f"Error: {str(e)}")  # debugging
+        return jsonify({'error': str(e)}), 500
+    
+def ai_art_prompt(food_description):
+    """Stable Diffusion prompt for a food description"""
+    return f"A beautiful photograph of {food_description}, food photography"
+
+def render_ai_art(pipe, params):
+    """Run one diffusion job and cache the image, where its result is read from"""
+    food_description = params['input']
+    
+    # Generate image
+    print(f"Generating image for: {food_description}")
+    # per-step timings only when metrics are on, so the pipeline call is unchanged otherwise
+    step_callback = {'callback_on_step_end': step_timer()} if METRICS_ENABLED else {}
+    with timed('diffusion'):
+        image = pipe(
+            prompt=ai_art_prompt(food_description),
+            num_inference_steps=AI_ART_STEPS,
+            guidance_scale=AI_ART_GUIDANCE_SCALE,
+            generator=seeded_generator(params['seed']),
+            **step_callback
+        ).images[0]
+    
+    print("Image generated successfully")
+    
+    # the cache keeps a lossless copy, re-encoded per request on a hit
+    with timed('image_encode'):
+        png_bytes, _ = encode_image(image, 'png')
+    image_cache.put(params['cache_key'], png_bytes)
+
+def encode_cached_art(png_bytes, params):
+    """Encode a cached PNG in the format a job asked for"""
+    if params['format'] == 'png':
+        return {'image': png_bytes, 'mimetype': IMAGE_FORMATS['png'][1]}
+    
+    # encode in memory, no temp file shared between concurrent jobs
+    with timed('image_encode'):
+        image = Image.open(io.BytesIO(png_bytes))
+        image_bytes, mimetype = encode_image(image, params['format'], params['quality'])
+    return {'image': image_bytes, 'mimetype': mimetype}
+
+def job_image(job):
+    """Image of a finished job in the format it asked for, or None once evicted from the cache
+
+    Jobs keep only the cache key, so finished jobs hold no image bytes.
+    """
+    png_bytes = image_cache.get(job.params['cache_key'], count=False)
+    if png_bytes is None:
+        return None
+    return encode_cached_art(png_bytes, job.params)
+
+art_jobs = ArtJobQueue(
+    pipeline_pool,
+    render_ai_art,
+    workers=AI_ART_POOL_SIZE,
+    max_pending=AI_ART_MAX_PENDING,
+    result_ttl=AI_ART_RESULT_TTL,
+    max_jobs=AI_ART_MAX_JOBS
+)
+
 @app.route('/generate-ai-art', methods=['POST'])
 def generate_ai_art():
+    """Queue an AI art job and return its id straight away"""
     print("Received AI art generation request")
+    if not SERVES_AI_ART:
+        return jsonify({'error': 'AI art is not served by this worker'}), 503
     try:
         data = request.get_json()
         food_description = data.get('input', '')
@@ -922,50 +1369,341 @@ def generate_ai_art():
         if not food_description.strip():
             return jsonify({'error': 'Please enter a food description'}), 400
 
-        print("Initializing Stable Diffusion pipeline")
-        from diffusers import StableDiffusionPipeline  # regular SD pipeline
+        image_format = data.get('format', 'png')
+        quality = data.get('quality', 85)
+        response_mode = data.get('response', 'data_uri')
+        seed = data.get('seed', AI_ART_DEFAULT_SEED)
         
-        pipe = StableDiffusionPipeline.from_pretrained(
-            "runwayml/stable-diffusion-v1-5",  # lighter model
-            torch_dtype=torch.float32
-        )
+        if image_format not in IMAGE_FORMATS:
+            return jsonify({'error': f'format must be one of {", ".join(IMAGE_FORMATS)}'}), 400
         
-        # force CPU usage
-        pipe = pipe.to("cpu")
+        if not isinstance(quality, int) or not 1 <= quality <= 95:
+            return jsonify({'error': 'quality must be an integer between 1 and 95'}), 400
         
-        # Generate image
-        print("Generating image...")
-        prompt = f"A beautiful photograph of {food_description}, food photography"
+        if response_mode not in AI_ART_RESPONSE_MODES:
+            return jsonify({'error': f'response must be one of {", ".join(AI_ART_RESPONSE_MODES)}'}), 400
         
-        image = pipe(
-            prompt=prompt,
-            num_inference_steps=15,  # fewer steps for faster generation
-            guidance_scale=7.0,
-        ).images[0]
+        if not isinstance(seed, int):
+            return jsonify({'error': 'seed must be an integer'}), 400
         
-        print("Image generated successfully")
+        params = {
+            'input': food_description,
+            'format': image_format,
+            'quality': quality,
+            'response': response_mode,
+            'seed': seed,
+            # normalized before the template adds punctuation, so 'Pizza ' and 'pizza' share a key
+            'cache_key': cache_key(ai_art_prompt(normalize_text(food_description)), MODEL_ID, AI_ART_STEPS,
+                                   AI_ART_GUIDANCE_SCALE, seed)
+        }
         
-        # save and convert image
-        temp_path = "temp_generated_art.png"
-        image.save(temp_path)
+        # repeated prompts skip the queue and the diffusion run entirely
+        if image_cache.get(params['cache_key']) is not None:
+            job = art_jobs.add_finished(params)
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/generate-ai-art/jobs/{job.id}',
+                'result_url': f'/generate-ai-art/jobs/{job.id}/result'
+            })
         
-        with open(temp_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+        # without AI_ART_PRELOAD the first request that needs the model starts loading it
+        pipeline_pool.start()
+        art_jobs.start()
+        if not pipeline_pool.ready:
+            if pipeline_pool.error:
+                return jsonify({'error': f'AI art model failed to load: {pipeline_pool.error}'}), 503
+            response = jsonify({'error': 'AI art model is still loading, please try again shortly'})
+            response.headers['Retry-After'] = str(AI_ART_RETRY_AFTER)
+            return response, 503
         
-        os.remove(temp_path)
+        # identical prompts already queued or running share that diffusion run
+        job = art_jobs.submit(params, key=params['cache_key'])
         
         return jsonify({
             'success': True,
-            'image_data': f"data:image/png;base64,{encoded_string}"
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/generate-ai-art/jobs/{job.id}'
+        }), 202
+
+    except QueueFull as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    except Exception as e:
+        print(f"Error queueing AI art: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/generate-ai-art/jobs/<job_id>')
+def ai_art_job_status(job_id):
+    """Report whether an AI art job is queued, running, done or failed"""
+    job = art_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    status = job.to_dict()
+    if job.status == 'done':
+        status['result_url'] = f'/generate-ai-art/jobs/{job.id}/result'
+    return jsonify(status)
+
+@app.route('/generate-ai-art/jobs/<job_id>/result')
+def ai_art_job_result(job_id):
+    """Fetch the generated image of a finished AI art job
+
+    The response mode chosen when the job was queued can be overridden with
+    a ?response= query parameter.
+    """
+    job = art_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify({'error': 'Job has not finished yet', 'status': job.status}), 409
+    
+    response_mode = request.args.get('response', job.params['response'])
+    if response_mode not in AI_ART_RESPONSE_MODES:
+        return jsonify({'error': f'response must be one of {", ".join(AI_ART_RESPONSE_MODES)}'}), 400
+    
+    if response_mode == 'url':
+        return jsonify({
+            'success': True,
+            'image_url': f'/generate-ai-art/jobs/{job.id}/image',
+            'expires_in': max(0, round(job.finished + AI_ART_RESULT_TTL - time.time()))
+        })
+    
+    result = job_image(job)
+    if result is None:
+        return jsonify({'error': 'Image is no longer cached, please generate it again'}), 410
+    
+    if response_mode == 'binary':
+        return Response(result['image'], mimetype=result['mimetype'])
+    
+    encoded_string = base64.b64encode(result['image']).decode('utf-8')
+    return jsonify({
+        'success': True,
+        'image_data': f"data:{result['mimetype']};base64,{encoded_string}"
+    })
+
+@app.route('/generate-ai-art/jobs/<job_id>/image')
+def ai_art_job_image(job_id):
+    """Serve the raw image bytes of a finished job until it expires"""
+    job = art_jobs.get(job_id)
+    result = job_image(job) if job is not None and job.status == 'done' else None
+    if result is None:
+        return jsonify({'error': 'Unknown, unfinished or expired job'}), 404
+    
+    response = Response(result['image'], mimetype=result['mimetype'])
+    response.headers['Cache-Control'] = f'private, max-age={AI_ART_RESULT_TTL}'
+    return response
+
+def admin_only(view):
+    """Refuse requests without the admin token, and hide the endpoint when none is configured"""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        # behind a local proxy every client looks local, so only the token counts
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Not found'}), 404
+        token = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+@app.route('/admin/reload-datasets', methods=['POST'])
+@admin_only
+def reload_datasets():
+    """Rebuild the catalog in the background and swap it in once loaded
+
+    The other workers reload too when they watch the datasets, since the
+    reload trigger they poll is touched first.
+    """
+    if not SERVES_PAIRING:
+        return jsonify({'error': 'Pairing datasets are not served by this worker'}), 503
+    request_reload()
+    started = catalogs.reload()
+    return jsonify({
+        'success': True,
+        'started': started,
+        'all_workers': DATASET_WATCH_INTERVAL > 0,
+        'datasets': catalogs.status()
+    }), 202
+
+@app.route('/admin/datasets')
+@admin_only
+def datasets_status():
+    """Current dataset version and the state of the last reload"""
+    return jsonify(catalogs.status())
+
+@app.route('/admin/records/<table>', methods=['POST', 'DELETE'])
+@admin_only
+def update_records(table):
+    """Add records to, or delete them from, the food or art table without a rebuild"""
+    if catalogs.current is None:
+        return jsonify({'error': 'Pairing datasets are not loaded on this worker'}), 503
+    if table not in RECORD_KEYS:
+        return jsonify({'error': f'table must be one of {", ".join(RECORD_KEYS)}'}), 400
+    try:
+        data = request.get_json()
+        key = RECORD_KEYS[table]
+        start = time.perf_counter()
+        
+        if request.method == 'DELETE':
+            keys = data.get('keys', [])
+            if not isinstance(keys, list) or not keys or not all(isinstance(value, str) for value in keys):
+                return jsonify({'error': f'keys must be a non-empty list of {key} values'}), 400
+            changed = catalogs.update(lambda catalog: catalog.without_records(table, keys))
+            result = {'deleted': changed}
+        else:
+            records = data.get('records', [])
+            if not isinstance(records, list) or not 1 <= len(records) <= MAX_BATCH_SIZE:
+                return jsonify({'error': f'records must be a list of 1 to {MAX_BATCH_SIZE} records'}), 400
+            required = (key, RECORD_TEXT[table])
+            if not all(isinstance(record, dict) and all(isinstance(record.get(field), str) for field in required)
+                       for record in records):
+                return jsonify({'error': f'every record needs string {" and ".join(required)} fields'}), 400
+            changed = catalogs.update(lambda catalog: (catalog.with_records(table, records), len(records)))
+            result = {'added': changed}
+        
+        seconds = time.perf_counter() - start
+        return jsonify({
+            'success': True,
+            **result,
+            'seconds': seconds,
+            'records_per_second': changed / seconds if seconds else None,
+            'dataset_version': catalogs.current.version
+        })
+    
     except Exception as e:
-        print(f"Error generating AI art: {str(e)}")
+        print(f"Error updating {table} records: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/compact', methods=['POST'])
+@admin_only
+def compact_datasets():
+    """Refit the indexes on the live records in the background"""
+    if catalogs.current is None:
+        return jsonify({'error': 'Pairing datasets are not loaded on this worker'}), 503
+    started = catalogs.compact()
+    return jsonify({
+        'success': True,
+        'started': started,
+        'datasets': catalogs.status()
+    }), 202
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # no /proc on macOS, where ru_maxrss is the peak RSS in bytes
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+
+request_seconds = histogram(
+    'app_request_seconds', 'Seconds from receiving a request to returning its response',
+    ('endpoint', 'method', 'status')
+)
+
+def cache_counts(stats, names):
+    """Label values to counts for the named cache statistics"""
+    return {(name,): stats[name] for name in names}
+
+callback('app_resident_memory_bytes', 'Resident set size of the worker in bytes', lambda: current_rss_mb() * 1024 ** 2)
+callback('pairing_cache_lookups_total', 'Pairing cache lookups by result',
+         lambda: cache_counts(pairing_cache.stats(), ('hits', 'misses')), 'counter', ('result',))
+callback('pairing_cache_hit_ratio', 'Share of pairing cache lookups that hit', lambda: pairing_cache.stats()['hit_ratio'])
+callback('ai_art_cache_lookups_total', 'AI art image cache lookups by result',
+         lambda: cache_counts(image_cache.stats(), ('memory_hits', 'disk_hits', 'misses')), 'counter', ('result',))
+callback('ai_art_cache_hit_ratio', 'Share of AI art cache lookups that hit', lambda: image_cache.stats()['hit_ratio'])
+callback('ai_art_jobs', 'AI art jobs waiting in the queue and running',
+         lambda: {('queued',): art_jobs.status()['queued'], ('running',): art_jobs.status()['running']},
+         labels=('state',))
+callback('ai_art_pipelines', 'Stable Diffusion pipelines loaded and idle',
+         lambda: {('loaded',): pipeline_pool.status()['loaded'], ('idle',): pipeline_pool.status()['idle']},
+         labels=('state',))
+# info-style series, always 1, so a scrape shows which catalog each worker serves
+callback('catalog_info', 'Dataset version of the catalog this worker serves',
+         lambda: {(catalogs.current.version,): 1} if catalogs.current else {}, labels=('version',))
+callback('catalog_pending_changes', 'Runtime record changes not yet compacted',
+         lambda: len(catalogs.current.changes) if catalogs.current else None)
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+    
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            request_seconds.observe(time.perf_counter() - start, request.endpoint or 'unknown', request.method,
+                                    str(response.status_code))
+        return response
+
+@app.route('/metrics')
+def metrics():
+    """Stage latency histograms, cache and queue statistics in the Prometheus text format"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled on this worker'}), 404
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/health')
+def health():
+    """Liveness check with the state of the datasets and the model pool"""
+    return jsonify({
+        'status': 'ok',
+        'role': APP_ROLE,
+        'startup': {'seconds': boot_seconds, 'rss_mb': boot_rss_mb},
+        'rss_mb': current_rss_mb(),
+        'datasets_loaded': catalogs.current is not None,
+        'datasets': catalogs.status(),
+        'ai_art_pool': pipeline_pool.status(),
+        'ai_art_jobs': art_jobs.status(),
+        'ai_art_cache': image_cache.stats(),
+        'pairing_cache': pairing_cache.stats()
+    })
+
+@app.route('/ready')
+def ready():
+    """Readiness check, 503 until everything this worker's role serves is resident"""
+    # a lazily loaded model is not waited for; its endpoint answers 503 until warm
+    datasets_loaded = catalogs.current is not None
+    pairing_ready = datasets_loaded or not SERVES_PAIRING
+    ai_art_ready = pipeline_pool.ready or not (SERVES_AI_ART and AI_ART_PRELOAD)
+    is_ready = pairing_ready and ai_art_ready
+    return jsonify({
+        'ready': is_ready,
+        'role': APP_ROLE,
+        'datasets_loaded': datasets_loaded,
+        'ai_art_ready': pipeline_pool.ready
+    }), 200 if is_ready else 503
     
-print("Loading datasets...")
-if not load_datasets():
-    print("Failed to load datasets. Please check the file paths and data format.")
+if SERVES_PAIRING:
+    print("Loading datasets...")
+    if not catalogs.load():
+        print("Failed to load datasets. Please check the file paths and data format.")
+    if DATASET_WATCH_INTERVAL > 0:
+        catalogs.watch(DATASET_WATCH_INTERVAL)
+    if CATALOG_COMPACT_INTERVAL > 0:
+        catalogs.compact_every(CATALOG_COMPACT_INTERVAL)
+    if CATALOG_CHANGES_POLL_INTERVAL > 0:
+        catalogs.follow_changes(CATALOG_CHANGES_POLL_INTERVAL)
+
+# load the Stable Diffusion pipelines in the background so startup isn't blocked
+if SERVES_AI_ART and AI_ART_PRELOAD:
+    pipeline_pool.start()
+    art_jobs.start()
+
+boot_seconds = time.perf_counter() - BOOT_START
+boot_rss_mb = current_rss_mb()
+print(f"Started {APP_ROLE} worker in {boot_seconds:.2f} s, RSS {boot_rss_mb:.0f} MB")
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
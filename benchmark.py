@@ -0,0 +1,576 @@
+"""Latency benchmarks for the pairing hot paths
+
+Usage:
+    python benchmark.py food-index --food-csv fooddataset490.csv
+    python benchmark.py art-index
+    python benchmark.py top-k
+    python benchmark.py vector-index --rows 200000
+    python benchmark.py imports
+    python benchmark.py ingest --records 2000 --batch-size 100
+    python benchmark.py featurizer --rows 200000 --vocabulary 500000
+    python benchmark.py snapshot-build --rows 2000000
+    python benchmark.py records --copies 50
+    python benchmark.py text-search --rows 1000000
+    python benchmark.py filters --copies 50 --category Baroque
+    python benchmark.py metrics
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from catalog import Catalog
+from emotion_index import EmotionIndex, emotion_columns, normalize_rows
+from ranking import top_k
+from record_store import ART_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS, FOOD_RECORD_FIELDS, FacetIndex, RecordStore
+from text_index import ArtIndex, FoodIndex, TfidfIndex
+from vector_index import IVF_ARRAYS, ExactIndex, IVFIndex
+
+ART_CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artdataset490.csv')
+FOOD_CSV_PATH = os.environ.get('FOOD_CSV_PATH', 'fooddataset490.csv')
+
+SAMPLE_QUERIES = [
+    'margherita pizza with fresh basil and tomato',
+    'dark chocolate cake with raspberries',
+    'spicy ramen with pork belly and soft egg',
+    'lemon tart',
+    'grilled salmon over wild rice',
+    'a warm bowl of mushroom soup on a rainy day',
+]
+
+
+def time_calls(fn, queries, repeat):
+    """Call fn on every query repeat times and return per-call latencies in ms"""
+    latencies = []
+    for _ in range(repeat):
+        for text in queries:
+            start = time.perf_counter()
+            fn(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def report(name, latencies):
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f"{name:<28} p50 {p50:9.3f} ms   p99 {p99:9.3f} ms   ({len(latencies)} calls)")
+
+
+def bench_food_index(args):
+    """Per-request refit (previous behaviour) against the prebuilt FoodIndex"""
+    food_df = pd.read_csv(args.food_csv)
+    descriptions = food_df['description'].fillna('')
+    print(f"{len(food_df)} food descriptions")
+
+    def refit(text):
+        vectorizer = TfidfVectorizer(stop_words='english')
+        matrix = vectorizer.fit_transform(descriptions)
+        similarities = cosine_similarity(vectorizer.transform([text]), matrix).flatten()
+        return similarities.argmax()
+
+    start = time.perf_counter()
+    index = FoodIndex(food_df)
+    print(f"index build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    report('refit per request', time_calls(refit, SAMPLE_QUERIES, args.repeat))
+    report('FoodIndex.query', time_calls(index.query, SAMPLE_QUERIES, args.repeat * 20))
+
+
+def bench_art_index(args):
+    """Per-request refit (previous behaviour) against the prebuilt ArtIndex"""
+    art_df = pd.read_csv(args.art_csv)
+    titles = art_df['Title'].fillna('')
+    print(f"{len(art_df)} art titles")
+
+    def refit(text):
+        vectorizer = TfidfVectorizer(stop_words='english')
+        matrix = vectorizer.fit_transform(titles)
+        return cosine_similarity(vectorizer.transform([text]), matrix).flatten()
+
+    start = time.perf_counter()
+    index = ArtIndex(art_df)
+    print(f"index build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    report('refit per request', time_calls(refit, SAMPLE_QUERIES, args.repeat))
+    report('ArtIndex.scores', time_calls(index.scores, SAMPLE_QUERIES, args.repeat * 20))
+
+
+def bench_top_k(args):
+    """Full argsort (previous behaviour) against partial top-k selection"""
+    rng = np.random.default_rng(0)
+    for n in args.sizes:
+        # mostly-zero scores, like title similarities where few terms overlap,
+        # and fully dense scores, like emotion-space similarities
+        sparse_scores = np.zeros(n)
+        hits = rng.choice(n, size=max(1, n // 50), replace=False)
+        sparse_scores[hits] = rng.random(len(hits))
+        dense_scores = rng.random(n)
+        for label, scores in (('sparse', sparse_scores), ('dense', dense_scores)):
+            queries = [scores] * 5
+            print(f"{n} rows, {label} scores, k={args.k}")
+            report('  argsort', time_calls(lambda s: s.argsort()[-args.k:][::-1], queries, args.repeat))
+            report('  top_k', time_calls(lambda s: top_k(s, args.k), queries, args.repeat))
+
+
+def scaled_emotion_matrix(art_csv, rows, seed=0):
+    """Centred unit emotion rows from the art dataset, jittered up to rows rows"""
+    scores = pd.read_csv(art_csv)[emotion_columns('art')].to_numpy(dtype=np.float32)
+    scores -= scores.mean(axis=0)
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(scores), rows)
+    noise = rng.normal(scale=0.05, size=(rows, scores.shape[1])).astype(np.float32)
+    return normalize_rows(scores[picks] + noise).astype(np.float32)
+
+
+def bench_vector_index(args):
+    """Recall@k and latency of the IVF backend against exact search"""
+    vectors = scaled_emotion_matrix(args.art_csv, args.rows)
+    rng = np.random.default_rng(1)
+    queries = normalize_rows(vectors[rng.integers(0, len(vectors), args.queries)]
+                             + rng.normal(scale=0.1, size=(args.queries, vectors.shape[1])).astype(np.float32))
+    print(f"{len(vectors)} rows, {args.queries} queries, k={args.k}")
+
+    exact = ExactIndex(vectors)
+    truth = [set(exact.search(query, args.k)[0]) for query in queries]
+    report('exact', time_calls(lambda q: exact.search(q, args.k), queries, 1))
+
+    start = time.perf_counter()
+    ivf = IVFIndex(vectors, n_lists=args.lists)
+    print(f"ivf build ({len(ivf.centroids)} lists): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # the saved index must answer exactly like the one it was saved from
+    prefix = os.path.join(args.tmp_dir, 'ivf_benchmark')
+    ivf.save(prefix)
+    loaded = IVFIndex.load(prefix, 'r')
+    assert all(np.array_equal(ivf.search(q, args.k)[0], loaded.search(q, args.k)[0]) for q in queries[:10])
+    del loaded
+    for name in IVF_ARRAYS:
+        os.remove(f'{prefix}.{name}.npy')
+
+    for n_probe in args.probes:
+        found = [set(ivf.search(query, args.k, n_probe)[0]) for query in queries]
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        latencies = time_calls(lambda q: ivf.search(q, args.k, n_probe), queries, 1)
+        report(f'ivf n_probe={n_probe:<4} recall {recall:.3f}', latencies)
+
+
+def bench_ingest(args):
+    """Records per second added incrementally, against refitting for every batch"""
+    art_df = pd.read_csv(args.art_csv)
+    art_index = ArtIndex(art_df)
+    food_df = pd.DataFrame({'name': ['placeholder'], 'description': ['placeholder']})
+    catalog = Catalog(RecordStore.from_frame(food_df, FOOD_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS),
+                      RecordStore.from_frame(art_df), FoodIndex(food_df), art_index,
+                      EmotionIndex(art_df, art_index), 'benchmark')
+
+    # new artworks are existing ones under new keys, so titles and scores are realistic
+    rng = np.random.default_rng(0)
+    sample = art_df.iloc[rng.integers(0, len(art_df), args.records)].reset_index(drop=True)
+    sample['Image URL'] = [f'benchmark://{i}' for i in range(len(sample))]
+    records = sample.to_dict('records')
+    batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+
+    start = time.perf_counter()
+    for batch in batches:
+        catalog = catalog.with_records('art', batch)
+    seconds = time.perf_counter() - start
+    print(f"incremental: {len(records)} records in {seconds:.2f} s, {len(records) / seconds:,.0f} records/s")
+
+    latencies = time_calls(lambda q: catalog.art_index.scores(q), SAMPLE_QUERIES, args.repeat)
+    report(f'art scores, {len(batches)} delta batches', latencies)
+
+    start = time.perf_counter()
+    catalog = catalog.compacted()
+    print(f"compaction: {(time.perf_counter() - start) * 1000:.1f} ms for {catalog.live_rows('art')} rows")
+    report('art scores, compacted', time_calls(lambda q: catalog.art_index.scores(q), SAMPLE_QUERIES, args.repeat))
+
+    # what adding each batch costs when the indexes are refitted every time
+    refit_batches = batches[:args.refit_batches]
+    refit_df = art_df
+    start = time.perf_counter()
+    for batch in refit_batches:
+        refit_df = pd.concat([refit_df, pd.DataFrame(batch)], ignore_index=True)
+        refit_index = ArtIndex(refit_df)
+        EmotionIndex(refit_df, refit_index)
+    seconds = time.perf_counter() - start
+    refit_records = sum(len(batch) for batch in refit_batches)
+    print(f"refit per batch: {refit_records} records in {seconds:.2f} s, {refit_records / seconds:,.0f} records/s")
+
+
+def synthetic_texts(rows, vocabulary, words_per_text=12, seed=0):
+    """Random texts over a Zipf-distributed vocabulary of made-up words"""
+    rng = np.random.default_rng(seed)
+    ids = np.minimum(rng.zipf(1.2, size=(rows, words_per_text)), vocabulary)
+    return [' '.join(f'w{i}' for i in row) for row in ids]
+
+
+def bench_featurizer(args):
+    """Fit memory, fit time and query latency of the vocabulary and hashing featurizers
+
+    Peak memory includes the corpus text, which the chunked fit generates
+    one chunk at a time, as when reading a CSV with chunksize.
+    """
+    queries = synthetic_texts(50, args.vocabulary, seed=1)
+    print(f"{args.rows} texts, up to {args.vocabulary} distinct terms")
+
+    def fit_vocabulary():
+        return TfidfIndex(synthetic_texts(args.rows, args.vocabulary))
+
+    def fit_hashing():
+        return TfidfIndex(synthetic_texts(args.rows, args.vocabulary), 'hashing', args.features)
+
+    def fit_hashing_chunks():
+        chunks = (synthetic_texts(min(args.chunk_rows, args.rows - start), args.vocabulary, seed=start)
+                  for start in range(0, args.rows, args.chunk_rows))
+        return TfidfIndex.from_text_chunks(chunks, args.features)
+
+    indexes = {}
+    for name, fit in (('vocabulary', fit_vocabulary), ('hashing', fit_hashing), ('hashing, chunked', fit_hashing_chunks)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        indexes[name] = fit()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:<18} fit {seconds:.2f} s  peak {peak / 1024 ** 2:,.0f} MB  "
+              f"{indexes[name].matrix.shape[1]:,} columns")
+
+    for name, index in indexes.items():
+        report(f'{name} scores', time_calls(index.scores, queries, args.repeat))
+
+    # hashing only differs where unrelated terms share a column
+    agree = np.mean([indexes['vocabulary'].query(q)[0] == indexes['hashing'].query(q)[0] for q in queries])
+    print(f"top-1 agreement, vocabulary vs hashing: {agree:.3f}")
+
+
+# words the synthetic recipes are made of; the art titles' own words are
+# mixed in so text-mode matching has overlapping terms to rank
+FOOD_ADJECTIVES = ['sweet', 'bitter', 'fresh', 'warm', 'smoky', 'spicy', 'creamy', 'crisp', 'tangy', 'rich',
+                   'light', 'golden', 'dark', 'silky', 'charred', 'bright']
+FOOD_DISHES = ['soup', 'risotto', 'roast', 'tart', 'salad', 'stew', 'curry', 'pie', 'noodles', 'cake',
+               'dumplings', 'gratin', 'sorbet', 'bread', 'omelette', 'ramen']
+FOOD_INGREDIENTS = ['onion', 'chocolate', 'apple', 'mango', 'strawberry', 'tomato', 'lemon', 'basil', 'salmon',
+                    'mushroom', 'pork', 'rice', 'egg', 'honey', 'fig', 'garlic', 'ginger', 'pear', 'cheese', 'saffron']
+FOOD_SCENES = ['a garden landscape at night', 'a village street in spring', 'a still life with flowers',
+               'a portrait of the sea', 'a winter morning', 'a crowded market', 'the last supper',
+               'a house of cards']
+
+
+def synthetic_food_frame(rows, art_words, seed=0):
+    """Made-up recipes: templated descriptions with art title words and a long tail of rare words"""
+    rng = np.random.default_rng(seed)
+
+    def pick(words, size):
+        return np.asarray(words, dtype=object)[rng.integers(0, len(words), size)]
+
+    adjectives = pick(FOOD_ADJECTIVES, (rows, 2))
+    dishes = pick(FOOD_DISHES, rows)
+    ingredients = pick(FOOD_INGREDIENTS, (rows, 3))
+    scenes = pick(FOOD_SCENES, rows)
+    motifs = pick(art_words, (rows, 2))
+    # the vocabulary grows with the corpus, as real recipe collections do
+    rare = np.minimum(rng.zipf(1.3, rows), 100_000)
+    descriptions = [
+        f'A {a[0]} and {a[1]} {dish} with {i[0]}, {i[1]} and {i[2]}, served like {scene}, '
+        f'with hints of {m[0]} and {m[1]} and a touch of w{r}.'
+        for a, dish, i, scene, m, r in zip(adjectives, dishes, ingredients, scenes, motifs, rare)
+    ]
+    names = [f'{a[0]} {dish} {row}' for row, (a, dish) in enumerate(zip(adjectives, dishes))]
+    return pd.DataFrame({'name': names, 'description': descriptions})
+
+
+def title_words(art_df):
+    """Distinct lowercase words of three or more letters in the art titles"""
+    words = set()
+    for title in art_df['Title'].dropna():
+        words.update(word for word in title.lower().split() if word.isalpha() and len(word) > 2)
+    return sorted(words)
+
+
+def write_synthetic_food_csv(path, rows, art_words, chunk_rows=100_000):
+    """A food CSV of synthetic_food_frame recipes, written in chunks"""
+    for start in range(0, rows, chunk_rows):
+        chunk = synthetic_food_frame(min(chunk_rows, rows - start), art_words, seed=start)
+        chunk.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+# each runs in a fresh interpreter that reports its own peak RSS
+SNAPSHOT_BUILD_PROBES = {
+    'whole-file load and fit': "import pandas as pd; from text_index import ArtIndex, FoodIndex; "
+                               "FoodIndex(pd.read_csv(FOOD_CSV), FEATURIZER); ArtIndex(pd.read_csv(ART_CSV))",
+    'streamed snapshot build': "from snapshot import build_snapshot; "
+                               "build_snapshot(OUT, FOOD_CSV, ART_CSV, FEATURIZER, chunk_rows=CHUNK_ROWS)",
+}
+
+
+def bench_snapshot_build(args):
+    """Peak RSS of loading the CSVs whole and fitting, against streaming them into a snapshot"""
+    food_csv = os.path.join(args.tmp_dir, 'benchmark_food.csv')
+    out = os.path.join(args.tmp_dir, 'benchmark_snapshot')
+    write_synthetic_food_csv(food_csv, args.rows, title_words(pd.read_csv(args.art_csv, usecols=['Title'])))
+    print(f"food CSV: {args.rows} rows, {os.path.getsize(food_csv) / 1024 ** 2:,.0f} MB")
+
+    for name, probe in SNAPSHOT_BUILD_PROBES.items():
+        code = (f"FOOD_CSV, ART_CSV, OUT = {food_csv!r}, {args.art_csv!r}, {out!r}\n"
+                f"FEATURIZER, CHUNK_ROWS = {args.featurizer!r}, {args.chunk_rows}\n"
+                f"import resource, time\nstart = time.perf_counter()\n{probe}\n"
+                "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        seconds, peak = output.strip().splitlines()[-1].split()
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        peak_mb = int(peak) / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+        print(f"{name:<24} {float(seconds):.2f} s  peak RSS {peak_mb:,.0f} MB")
+
+    shutil.rmtree(out, ignore_errors=True)
+    os.remove(food_csv)
+
+
+def bench_records(args):
+    """Memory of the art metadata as a DataFrame against a RecordStore, and match building latency"""
+    art_df = pd.read_csv(args.art_csv, usecols=ART_RECORD_FIELDS, dtype=str)
+    art_df = pd.concat([art_df] * args.copies, ignore_index=True)
+    start = time.perf_counter()
+    store = RecordStore.from_frame(art_df)
+    print(f"{len(art_df)} art records, store built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    frame_usage = art_df.memory_usage(deep=True, index=False)
+    store_usage = store.memory_usage()
+    for field in ART_RECORD_FIELDS:
+        print(f"{field:<12} DataFrame {frame_usage[field] / 1024 ** 2:8.2f} MB   "
+              f"store {store_usage[field] / 1024 ** 2:8.2f} MB")
+    frame_total = frame_usage.sum()
+    store_total = sum(store_usage.values())
+    print(f"{'total':<12} DataFrame {frame_total / 1024 ** 2:8.2f} MB   store {store_total / 1024 ** 2:8.2f} MB   "
+          f"({frame_total / store_total:.1f}x smaller)")
+
+    rng = np.random.default_rng(0)
+    batches = [rng.integers(0, len(art_df), args.k) for _ in range(args.queries)]
+
+    def from_frame(ids):
+        rows = [art_df.iloc[idx] for idx in ids]
+        return [{field: row[field] for field in ART_RECORD_FIELDS} for row in rows]
+
+    report(f'DataFrame rows, k={args.k}', time_calls(from_frame, batches, 1))
+    report(f'RecordStore.get_many, k={args.k}', time_calls(store.get_many, batches, 1))
+
+
+def bench_text_search(args):
+    """Full scan plus top-k against inverted-index search with MaxScore pruning"""
+    corpora = {'art titles': (ArtIndex(pd.read_csv(args.art_csv)), SAMPLE_QUERIES)}
+    if args.rows:
+        start = time.perf_counter()
+        index = TfidfIndex(synthetic_texts(args.rows, args.vocabulary))
+        print(f"{args.rows} synthetic texts indexed in {time.perf_counter() - start:.2f} s")
+        corpora['synthetic'] = (index, synthetic_texts(50, args.vocabulary, words_per_text=8, seed=1))
+
+    for name, (index, queries) in corpora.items():
+        # share of the rows a query's postings lists hold, before pruning
+        read = [index.postings.indptr[terms + 1].sum() - index.postings.indptr[terms].sum()
+                for terms in (index.vectorizer.transform([q]).indices for q in queries)]
+        same = np.mean([np.array_equal(top_k(index.scores(q), args.k), index.search(q, args.k)[0]) for q in queries])
+        print(f"{name}: {len(index)} rows, postings hold {np.mean(read) / len(index):.1%} of the rows per query, "
+              f"same top {args.k}: {same:.3f}")
+        report(f'{name} full scan', time_calls(lambda q: top_k(index.scores(q), args.k), queries, args.repeat))
+        report(f'{name} inverted', time_calls(lambda q: index.search(q, args.k), queries, args.repeat))
+
+
+def bench_filters(args):
+    """Scoring only the rows a filter selects, against scoring every row and filtering after"""
+    art_df = pd.concat([pd.read_csv(args.art_csv)] * args.copies, ignore_index=True)
+    index = ArtIndex(art_df)
+    store = RecordStore.from_frame(art_df)
+    start = time.perf_counter()
+    facets = FacetIndex(store)
+    print(f"{len(art_df)} artworks, facets built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    filters = {field: [value] for field, value in (('Style', args.style), ('Category', args.category)) if value}
+    ids = facets.matching(filters).astype(np.int64)
+    print(f"{filters} selects {len(ids)} rows ({len(ids) / len(art_df):.1%})")
+
+    # the baseline gets its mask for free, so only the scoring differs
+    candidates = ids.copy()
+
+    def post_filter(text):
+        scores = index.scores(text)[candidates]
+        return candidates[top_k(scores, args.k)]
+
+    def pre_filter(text):
+        selected = facets.matching(filters).astype(np.int64)
+        return selected[top_k(index.scores(text, selected), args.k)]
+
+    same = np.mean([np.array_equal(post_filter(q), pre_filter(q)) for q in SAMPLE_QUERIES])
+    print(f"same top {args.k}: {same:.3f}")
+    report('score all, filter after', time_calls(post_filter, SAMPLE_QUERIES, args.repeat))
+    report('facet ids, score subset', time_calls(pre_filter, SAMPLE_QUERIES, args.repeat))
+
+
+# times an empty timed() block with metrics on and off, in fresh interpreters
+METRICS_PROBE = """
+import time
+from metrics import timed
+start = time.perf_counter()
+for _ in range(CALLS):
+    with timed('benchmark'):
+        pass
+print((time.perf_counter() - start) / CALLS * 1e9)
+"""
+
+
+def bench_metrics(args):
+    """Cost per timed() block with metrics enabled and disabled"""
+    for enabled in ('1', '0'):
+        output = subprocess.run(
+            [sys.executable, '-c', f'CALLS = {args.calls}\n{METRICS_PROBE}'],
+            env=dict(os.environ, METRICS_ENABLED=enabled), capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        print(f"METRICS_ENABLED={enabled}: {float(output.strip().splitlines()[-1]):.0f} ns per timed block")
+
+
+# run in a fresh interpreter so nothing is already imported; the app reports
+# its own boot time and RSS, then the AI stack is imported on top of it
+IMPORT_PROBE = """
+import json, time
+import app
+result = {'boot_seconds': app.boot_seconds, 'rss_mb': app.boot_rss_mb}
+if IMPORT_AI_STACK:
+    start = time.perf_counter()
+    try:
+        import torch
+        from diffusers import StableDiffusionPipeline
+    except ImportError as e:
+        result['ai_stack_error'] = str(e)
+    else:
+        result['ai_stack_seconds'] = time.perf_counter() - start
+        result['ai_stack_rss_mb'] = app.current_rss_mb()
+print(json.dumps(result))
+"""
+
+
+def bench_imports(args):
+    """Cold `import app` for a pairing worker, with and without the AI stack"""
+    env = dict(os.environ, APP_ROLE='pairing')
+    for label, with_ai in (('pairing only', False), ('plus torch + diffusers', True)):
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run(
+                [sys.executable, '-c', f'IMPORT_AI_STACK = {with_ai}\n{IMPORT_PROBE}'],
+                env=env, capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        boot = np.median([run['boot_seconds'] for run in runs])
+        rss = np.median([run['rss_mb'] for run in runs])
+        line = f"{label:<24} boot {boot:.2f} s  rss {rss:.0f} MB"
+        if with_ai:
+            if 'ai_stack_error' in runs[0]:
+                line += f"  (AI stack not installed: {runs[0]['ai_stack_error']})"
+            else:
+                ai = np.median([run['ai_stack_seconds'] for run in runs])
+                ai_rss = np.median([run['ai_stack_rss_mb'] for run in runs])
+                line += f"  + import {ai:.2f} s  rss {ai_rss:.0f} MB"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    food = subparsers.add_parser('food-index', help='refit-per-request vs prebuilt food index')
+    food.add_argument('--food-csv', default=FOOD_CSV_PATH)
+    food.add_argument('--repeat', type=int, default=5)
+    food.set_defaults(func=bench_food_index)
+
+    art = subparsers.add_parser('art-index', help='refit-per-request vs prebuilt art index')
+    art.add_argument('--art-csv', default=ART_CSV_PATH)
+    art.add_argument('--repeat', type=int, default=5)
+    art.set_defaults(func=bench_art_index)
+
+    topk = subparsers.add_parser('top-k', help='full argsort vs partial top-k selection')
+    topk.add_argument('--sizes', type=int, nargs='+', default=[4_000, 100_000, 1_000_000])
+    topk.add_argument('-k', type=int, default=3)
+    topk.add_argument('--repeat', type=int, default=5)
+    topk.set_defaults(func=bench_top_k)
+
+    vector = subparsers.add_parser('vector-index', help='recall@k and latency of IVF vs exact emotion search')
+    vector.add_argument('--art-csv', default=ART_CSV_PATH)
+    vector.add_argument('--rows', type=int, default=200_000)
+    vector.add_argument('--queries', type=int, default=200)
+    vector.add_argument('--lists', type=int, default=None)
+    vector.add_argument('--probes', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    vector.add_argument('-k', type=int, default=10)
+    vector.add_argument('--tmp-dir', default=tempfile.gettempdir())
+    vector.set_defaults(func=bench_vector_index)
+
+    imports = subparsers.add_parser('imports', help='cold start of a pairing worker with and without the AI stack')
+    imports.add_argument('--repeat', type=int, default=3)
+    imports.set_defaults(func=bench_imports)
+
+    ingest = subparsers.add_parser('ingest', help='incremental record ingestion vs refitting per batch')
+    ingest.add_argument('--art-csv', default=ART_CSV_PATH)
+    ingest.add_argument('--records', type=int, default=2000)
+    ingest.add_argument('--batch-size', type=int, default=100)
+    ingest.add_argument('--refit-batches', type=int, default=5)
+    ingest.add_argument('--repeat', type=int, default=20)
+    ingest.set_defaults(func=bench_ingest)
+
+    featurizer = subparsers.add_parser('featurizer', help='vocabulary vs hashing TF-IDF fit memory and latency')
+    featurizer.add_argument('--rows', type=int, default=200_000)
+    featurizer.add_argument('--vocabulary', type=int, default=500_000)
+    featurizer.add_argument('--features', type=int, default=2 ** 20)
+    featurizer.add_argument('--chunk-rows', type=int, default=20_000)
+    featurizer.add_argument('--repeat', type=int, default=3)
+    featurizer.set_defaults(func=bench_featurizer)
+
+    build = subparsers.add_parser('snapshot-build', help='peak memory of streaming a large food CSV into a snapshot')
+    build.add_argument('--art-csv', default=ART_CSV_PATH)
+    build.add_argument('--rows', type=int, default=2_000_000)
+    build.add_argument('--featurizer', choices=['vocabulary', 'hashing'], default='hashing')
+    build.add_argument('--chunk-rows', type=int, default=100_000)
+    build.add_argument('--tmp-dir', default=tempfile.gettempdir())
+    build.set_defaults(func=bench_snapshot_build)
+
+    records = subparsers.add_parser('records', help='art metadata memory and lookup, DataFrame vs RecordStore')
+    records.add_argument('--art-csv', default=ART_CSV_PATH)
+    records.add_argument('--copies', type=int, default=1)
+    records.add_argument('--queries', type=int, default=1000)
+    records.add_argument('-k', type=int, default=10)
+    records.set_defaults(func=bench_records)
+
+    search = subparsers.add_parser('text-search', help='full-scan vs inverted-index top-k text search')
+    search.add_argument('--art-csv', default=ART_CSV_PATH)
+    search.add_argument('--rows', type=int, default=200_000)
+    search.add_argument('--vocabulary', type=int, default=500_000)
+    search.add_argument('-k', type=int, default=10)
+    search.add_argument('--repeat', type=int, default=5)
+    search.set_defaults(func=bench_text_search)
+
+    facet = subparsers.add_parser('filters', help='pre-filtering by facet ids vs filtering after scoring')
+    facet.add_argument('--art-csv', default=ART_CSV_PATH)
+    facet.add_argument('--copies', type=int, default=50)
+    facet.add_argument('--style', default=None)
+    facet.add_argument('--category', default='Baroque')
+    facet.add_argument('-k', type=int, default=10)
+    facet.add_argument('--repeat', type=int, default=5)
+    facet.set_defaults(func=bench_filters)
+
+    overhead = subparsers.add_parser('metrics', help='overhead of the stage timers, enabled and disabled')
+    overhead.add_argument('--calls', type=int, default=1_000_000)
+    overhead.set_defaults(func=bench_metrics)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
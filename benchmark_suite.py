@@ -0,0 +1,572 @@
+"""Reproducible benchmark suite for the pairing and AI art paths
+
+Generates a synthetic food corpus and scales the art dataset up by
+resampling it, builds a snapshot of both, then measures:
+
+- function level: find_matching_food, find_matching_art in every mode and
+  with a filter, and batch pairing, called in a fresh interpreter that
+  imports the app
+- HTTP: the pairing, batch pairing and AI art endpoints of a local server,
+  driven at a fixed concurrency by a thread-per-client load generator. The
+  server runs a fake diffusion pipeline that sleeps per step and returns
+  noise, so no model is needed
+
+Each function scenario runs a warmup and then --repeats timed runs, and
+its p50 is the median of the per-repeat p50s. Results are written as JSON.
+Given a baseline recorded with the same configuration, the run fails
+(exit 1) when a p50 latency, or an HTTP throughput, has regressed by more
+than the threshold. A threshold given while recording is stored with the
+results and used by later comparisons against them.
+
+Usage:
+    python benchmark_suite.py run --food-rows 50000 --art-rows 1000000 --out results.json
+    python benchmark_suite.py run --baseline baseline.json --threshold 0.2
+    python benchmark_suite.py compare results.json baseline.json
+
+benchmark_baseline.json, kept with the code, was recorded with this small
+configuration, which runs in well under a minute:
+
+    python benchmark_suite.py run --food-rows 5000 --art-rows 20000 --calls 100 --requests 200 \
+        --ai-art-requests 10 --baseline benchmark_baseline.json
+
+and stores a 0.5 threshold, as a few hundred HTTP requests on a shared
+machine vary by more than the default between runs. Its numbers come from
+one machine, so record a new baseline with --out (and --threshold 0.5)
+before comparing on different hardware.
+
+Corpora and snapshots are kept in --work-dir and reused by later runs of
+the same size. The server is Flask's threaded development server in one
+process, so HTTP numbers compare runs with each other rather than predict
+a production deployment.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from benchmark import ART_CSV_PATH, SAMPLE_QUERIES, synthetic_food_frame, title_words, write_synthetic_food_csv
+from snapshot import ensure_snapshot
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = os.path.join(tempfile.gettempdir(), 'pairing-benchmark')
+
+# lower is better for latencies, higher for throughput; tail latencies are
+# only compared on request, as a few hundred calls leave p99 noisy
+METRIC_DIRECTIONS = {'p50_ms': 'lower', 'p95_ms': 'lower', 'p99_ms': 'lower', 'mean_ms': 'lower',
+                     'throughput_per_s': 'higher'}
+COMPARED_METRICS = ['p50_ms', 'throughput_per_s']
+# a function scenario's throughput is just calls over their summed latency,
+# so comparing it as well would count one slowdown twice
+FUNCTION_METRICS = ['p50_ms', 'p95_ms', 'p99_ms', 'mean_ms']
+REGRESSION_THRESHOLD = 0.2
+REPEATS = 5
+BATCH_CALLS = 30
+
+
+def write_scaled_art_csv(path, art_df, rows, chunk_rows=100_000, seed=0):
+    """The art dataset resampled up to rows rows, written in chunks
+
+    The original rows come first and unchanged. Each extra row copies a
+    random original, adds a rare word to its title so titles stay distinct,
+    and jitters its emotion scores within the column's observed range.
+    """
+    rng = np.random.default_rng(seed)
+    scores = [column for column in art_df.columns if pd.api.types.is_float_dtype(art_df[column])]
+    low, high = art_df[scores].min(), art_df[scores].max()
+    art_df.head(rows).to_csv(path, index=False)
+    for start in range(len(art_df), rows, chunk_rows):
+        count = min(chunk_rows, rows - start)
+        chunk = art_df.iloc[rng.integers(0, len(art_df), count)].reset_index(drop=True)
+        chunk['Title'] = chunk['Title'].fillna('') + [f' w{word}' for word in np.minimum(rng.zipf(1.3, count), 100_000)]
+        noise = rng.normal(scale=0.02, size=(count, len(scores)))
+        chunk[scores] = (chunk[scores] + noise).clip(low, high, axis=1)
+        chunk.to_csv(path, mode='a', header=False, index=False)
+
+
+def prepare_corpora(args):
+    """(food CSV, art CSV, snapshot dir) for the configured sizes, generated once per work dir"""
+    os.makedirs(args.work_dir, exist_ok=True)
+    art_df = pd.read_csv(args.art_csv)
+    food_csv = os.path.join(args.work_dir, f'food-{args.food_rows}.csv')
+    art_csv = os.path.join(args.work_dir, f'art-{args.art_rows}.csv')
+    if not os.path.exists(food_csv):
+        start = time.perf_counter()
+        write_synthetic_food_csv(f'{food_csv}.tmp', args.food_rows, title_words(art_df))
+        os.rename(f'{food_csv}.tmp', food_csv)
+        print(f"Wrote {args.food_rows} synthetic food rows in {time.perf_counter() - start:.1f} s")
+    if not os.path.exists(art_csv):
+        start = time.perf_counter()
+        write_scaled_art_csv(f'{art_csv}.tmp', art_df, args.art_rows)
+        os.rename(f'{art_csv}.tmp', art_csv)
+        print(f"Wrote {args.art_rows} art rows in {time.perf_counter() - start:.1f} s")
+
+    snapshot_dir = os.path.join(args.work_dir, f'snapshot-{args.food_rows}-{args.art_rows}')
+    start = time.perf_counter()
+    ensure_snapshot(snapshot_dir, food_csv, art_csv)
+    print(f"Snapshot ready in {time.perf_counter() - start:.1f} s")
+    return food_csv, art_csv, snapshot_dir
+
+
+def query_texts(count, seed):
+    """Food descriptions for requests, distinct from the corpus rows"""
+    art_words = title_words(pd.read_csv(ART_CSV_PATH, usecols=['Title']))
+    return SAMPLE_QUERIES + synthetic_food_frame(count, art_words, seed=seed)['description'].tolist()
+
+
+def summarize(latencies, seconds, items=None, errors=0):
+    """Latency percentiles in ms and throughput per second of one scenario
+
+    items counts the units of work done, e.g. inputs of batch calls, and
+    defaults to one per call.
+    """
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (None, None, None)
+    return {
+        'calls': len(latencies),
+        'errors': errors,
+        'p50_ms': float(p50) if p50 is not None else None,
+        'p95_ms': float(p95) if p95 is not None else None,
+        'p99_ms': float(p99) if p99 is not None else None,
+        'mean_ms': float(latencies.mean()) if len(latencies) else None,
+        'throughput_per_s': (len(latencies) if items is None else items) / seconds if seconds else None,
+    }
+
+
+def run_calls(fn, inputs, calls, warmup=10):
+    """Call fn over inputs, cycling, and return the latencies of the timed calls and their total seconds"""
+    for text in inputs[:warmup]:
+        fn(text)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(calls):
+        call_start = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    return latencies, time.perf_counter() - start
+
+
+def run_repeats(fn, inputs, calls, repeats, warmup=10, items_per_call=1):
+    """Summary of repeats runs of calls timed calls each, after one warmup
+
+    p50_ms is the median of the per-repeat medians, which a slow spell
+    during one repeat barely moves; the other figures pool every call.
+    """
+    for text in inputs[:warmup]:
+        fn(text)
+    runs = [run_calls(fn, inputs, calls, warmup=0) for _ in range(repeats)]
+    latencies = [latency for run_latencies, _ in runs for latency in run_latencies]
+    summary = summarize(latencies, sum(seconds for _, seconds in runs), len(latencies) * items_per_call)
+    summary['repeat_p50_ms'] = [float(np.percentile(run_latencies, 50)) for run_latencies, _ in runs]
+    summary['p50_ms'] = float(np.median(summary['repeat_p50_ms']))
+    return summary
+
+
+def bench_functions(app, calls, batch_size, num_matches, repeats=1):
+    """Scenario name -> summary for the pairing functions of an imported app module"""
+    catalog = app.catalogs.current
+    queries = query_texts(max(200, calls), seed=1_000_003)
+    food_matches = [app.find_matching_food(catalog, text) for text in queries[:calls]]
+    descriptions = [match['match']['description'] for match in food_matches]
+    # the most common style, so the filter keeps enough rows to rank
+    style, _ = max(catalog.art_facets.ids['Style'].items(), key=lambda item: len(item[1]))
+
+    scenarios = {
+        'find_matching_food': (lambda text: app.find_matching_food(catalog, text), queries),
+        'find_matching_art text': (
+            lambda text: app.find_matching_art(catalog, text, num_matches), descriptions),
+        'find_matching_art emotion': (
+            lambda text: app.find_matching_art(catalog, text, num_matches, 'emotion'), descriptions),
+        'find_matching_art hybrid': (
+            lambda text: app.find_matching_art(catalog, text, num_matches, 'hybrid'), descriptions),
+        f'find_matching_art text style={style}': (
+            lambda text: app.find_matching_art(catalog, text, num_matches, filters={'Style': [style]}), descriptions),
+    }
+    if catalog.pairings is not None:
+        indices = [match['index'] for match in food_matches]
+        scenarios['find_matching_art pairing table'] = (
+            lambda i: app.find_matching_art(catalog, descriptions[i], num_matches, food_idx=indices[i]),
+            list(range(len(indices)))
+        )
+
+    results = {}
+    for name, (fn, inputs) in scenarios.items():
+        results[f'function/{name}'] = run_repeats(fn, inputs, calls, repeats)
+
+    batches = [queries[start:start + batch_size] for start in range(0, len(queries) - batch_size + 1, batch_size)]
+    # enough batches per repeat that their median is not one slow call
+    batch_calls = max(BATCH_CALLS, calls // batch_size)
+    results[f'function/find_matching_pairings x{batch_size}'] = run_repeats(
+        lambda batch: app.find_matching_pairings(catalog, batch, num_matches),
+        batches, batch_calls, repeats, warmup=1, items_per_call=batch_size)
+    return results
+
+
+class FakePipeline:
+    """Stands in for a Stable Diffusion pipeline: sleeps per step and returns seeded noise
+
+    Honours callback_on_step_end like the real pipeline, so per-step
+    metrics and the job queue behave as in production.
+    """
+
+    def __init__(self, step_seconds=0.02, size=512):
+        self.step_seconds = step_seconds
+        self.size = size
+
+    @staticmethod
+    def generator(seed):
+        return np.random.default_rng(seed)
+
+    def __call__(self, prompt, num_inference_steps=50, guidance_scale=7.5, generator=None,
+                 callback_on_step_end=None):
+        from PIL import Image
+
+        for step in range(num_inference_steps):
+            time.sleep(self.step_seconds)
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, step, {})
+        rng = generator if generator is not None else np.random.default_rng()
+        pixels = rng.integers(0, 256, (self.size, self.size, 3), dtype=np.uint8)
+        return SimpleNamespace(images=[Image.fromarray(pixels)])
+
+
+# imports the app in a fresh interpreter and prints the function-level results
+FUNCTIONS_PROBE = """
+import json
+import app
+from benchmark_suite import bench_functions
+print(json.dumps(bench_functions(app, CALLS, BATCH_SIZE, NUM_MATCHES, REPEATS)))
+"""
+
+# serves the app with the fake pipeline until terminated
+SERVER_PROBE = """
+import app
+from benchmark_suite import FakePipeline
+from werkzeug.serving import make_server
+app.seeded_generator = FakePipeline.generator
+app.pipeline_pool.loader = lambda: FakePipeline(STEP_SECONDS)
+app.pipeline_pool.start()
+app.art_jobs.start()
+make_server('127.0.0.1', PORT, app.app, threaded=True).serve_forever()
+"""
+
+
+def app_env(args, food_csv, art_csv, snapshot_dir, **overrides):
+    env = dict(
+        os.environ,
+        FOOD_CSV_PATH=food_csv,
+        ART_CSV_PATH=art_csv,
+        SNAPSHOT_DIR=snapshot_dir,
+        PAIRING_TABLE_DIR=f'{snapshot_dir}.pairings',
+        DATASET_WATCH_INTERVAL='0',
+        CATALOG_COMPACT_INTERVAL='0',
+    )
+    env.update(overrides)
+    return env
+
+
+def run_function_benchmarks(args, env):
+    code = (f'CALLS, BATCH_SIZE, NUM_MATCHES, REPEATS = '
+            f'{args.calls}, {args.batch_size}, {args.num_matches}, {args.repeats}\n{FUNCTIONS_PROBE}')
+    output = subprocess.run([sys.executable, '-c', code], env=dict(env, APP_ROLE='pairing'),
+                            capture_output=True, text=True, check=True, cwd=REPO_DIR).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request_json(url, payload=None, timeout=60):
+    """(status, decoded JSON body) of a GET, or a POST when payload is given"""
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(url, data, {'Content-Type': 'application/json'} if data else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def wait_until_ready(base_url, server, timeout):
+    """Block until the server has its datasets and a pipeline loaded"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'server exited with {server.returncode} before becoming ready')
+        try:
+            status, health = request_json(f'{base_url}/health', timeout=5)
+        except OSError:
+            status = None
+        if status == 200 and health['datasets_loaded'] and health['ai_art_pool']['ready']:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f'server was not ready within {timeout} s')
+
+
+def drive(send, requests, concurrency, items_per_request=1):
+    """Send requests from concurrency client threads and summarize them
+
+    send(i) performs request i and returns whether it succeeded. Each
+    client sends its next request as soon as the previous one completes.
+    """
+    next_request = iter(range(requests))
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def client():
+        while True:
+            with lock:
+                i = next(next_request, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = send(i)
+            except OSError:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, len(latencies) * items_per_request, errors[0])
+
+
+def run_http_benchmarks(args, env):
+    """Scenario name -> summary for the HTTP endpoints of a local server"""
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    cache_dir = os.path.join(args.work_dir, 'ai_art_cache')
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    env = dict(
+        env,
+        APP_ROLE='all',
+        AI_ART_PRELOAD='0',
+        AI_ART_CACHE_DIR=cache_dir,
+        # every client can have a job queued, so none is turned away
+        AI_ART_MAX_PENDING=str(max(8, args.concurrency)),
+    )
+    code = f'PORT, STEP_SECONDS = {port}, {args.step_seconds}\n{SERVER_PROBE}'
+    log_path = os.path.join(args.work_dir, 'server.log')
+    with open(log_path, 'w') as log:
+        server = subprocess.Popen([sys.executable, '-c', code], env=env, stdout=log, stderr=subprocess.STDOUT,
+                                  cwd=REPO_DIR)
+    try:
+        wait_until_ready(base_url, server, args.ready_timeout)
+        queries = query_texts(args.requests, seed=2_000_003)
+        # a pool of its own, so batches are not answered from the cache the single requests filled
+        batch_queries = query_texts(args.requests, seed=3_000_003)
+
+        def pairing(i):
+            status, _ = request_json(f'{base_url}/generate-pairing',
+                                     {'input': queries[i % len(queries)], 'num_matches': args.num_matches})
+            return status == 200
+
+        def batch(i):
+            start = i * args.batch_size % len(batch_queries)
+            status, _ = request_json(f'{base_url}/generate-pairing/batch',
+                                     {'inputs': batch_queries[start:start + args.batch_size],
+                                      'num_matches': args.num_matches})
+            return status == 200
+
+        def ai_art(i):
+            # a new seed per request, so every job runs the pipeline
+            status, job = request_json(f'{base_url}/generate-ai-art',
+                                       {'input': queries[i % len(queries)], 'seed': i, 'response': 'binary'})
+            if status not in (200, 202):
+                return False
+            job_url = f"{base_url}/generate-ai-art/jobs/{job['job_id']}"
+            while job['status'] not in ('done', 'failed'):
+                time.sleep(0.01)
+                status, job = request_json(job_url)
+                if status != 200:
+                    return False
+            if job['status'] == 'failed':
+                return False
+            # the image bytes, as a client would download them
+            with urllib.request.urlopen(f'{job_url}/result') as response:
+                response.read()
+                return response.status == 200
+
+        # batch throughput counts inputs, like the function-level batch scenario; each
+        # client sends several batches, so one slow batch does not decide the median
+        scenarios = (
+            ('POST /generate-pairing', pairing, args.requests, 1),
+            (f'POST /generate-pairing/batch x{args.batch_size}', batch,
+             max(4 * args.concurrency, args.requests // args.batch_size), args.batch_size),
+            ('POST /generate-ai-art', ai_art, args.ai_art_requests, 1),
+        )
+        return {f'http/{name} c={args.concurrency}': drive(send, requests, args.concurrency, items)
+                for name, send, requests, items in scenarios}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=REPO_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, baseline, threshold=REGRESSION_THRESHOLD, metrics=COMPARED_METRICS):
+    """Regressions of results against baseline as lines of text, empty if there are none"""
+    regressions = []
+    for name, base in baseline['results'].items():
+        current = results['results'].get(name)
+        if current is None:
+            continue
+        for metric in metrics:
+            if name.startswith('function/') and metric not in FUNCTION_METRICS:
+                continue
+            better = METRIC_DIRECTIONS[metric]
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if better == 'lower' else change < -threshold
+            print(f"{name:<56} {metric:<16} {old:12.3f} -> {new:12.3f}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(f'{name} {metric} {old:.3f} -> {new:.3f} ({change:+.1%})')
+    return regressions
+
+
+def check_baseline(results, baseline_path, threshold=None, metrics=COMPARED_METRICS):
+    """Exit status of comparing results to the baseline file: 0 ok, 1 regressed, 2 not comparable
+
+    threshold defaults to the one recorded with the baseline, if any.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if threshold is None:
+        threshold = baseline.get('threshold') or REGRESSION_THRESHOLD
+    if baseline['config'] != results['config']:
+        print(f"Baseline {baseline_path} was recorded with a different configuration:\n"
+              f"  baseline {baseline['config']}\n  current  {results['config']}")
+        return 2
+    regressions = compare_results(results, baseline, threshold, metrics)
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions beyond {threshold:.0%} against {baseline_path}")
+    return 0
+
+
+def run(args):
+    food_csv, art_csv, snapshot_dir = prepare_corpora(args)
+    env = app_env(args, food_csv, art_csv, snapshot_dir)
+    if args.pairing_table:
+        subprocess.run([sys.executable, 'pairing_table.py', 'build', '--snapshot-dir', snapshot_dir],
+                       env=env, check=True, cwd=REPO_DIR)
+
+    results = {}
+    if not args.skip_functions:
+        results.update(run_function_benchmarks(args, env))
+    if not args.skip_http:
+        results.update(run_http_benchmarks(args, env))
+    for name, summary in results.items():
+        print(f"{name:<56} p50 {summary['p50_ms'] or 0:9.3f} ms   p99 {summary['p99_ms'] or 0:9.3f} ms   "
+              f"{summary['throughput_per_s'] or 0:10.1f}/s   ({summary['calls']} ok, {summary['errors']} errors)")
+
+    output = {
+        # runs are only compared when every setting that shapes the numbers matches
+        'config': {name: getattr(args, name) for name in (
+            'food_rows', 'art_rows', 'calls', 'repeats', 'batch_size', 'num_matches', 'requests', 'ai_art_requests',
+            'concurrency', 'step_seconds', 'pairing_table', 'skip_functions', 'skip_http')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'git_revision': git_revision(),
+            'recorded_at': time.time(),
+        },
+        'results': results,
+    }
+    if args.threshold is not None:
+        # later comparisons against this file default to it
+        output['threshold'] = args.threshold
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Wrote {args.out}")
+    if args.baseline:
+        sys.exit(check_baseline(output, args.baseline, args.threshold, args.metrics))
+
+
+def compare(args):
+    with open(args.results) as f:
+        results = json.load(f)
+    sys.exit(check_baseline(results, args.baseline, args.threshold, args.metrics))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    suite = subparsers.add_parser('run', help='generate the corpora and run the benchmarks')
+    suite.add_argument('--art-csv', default=ART_CSV_PATH)
+    suite.add_argument('--work-dir', default=WORK_DIR)
+    suite.add_argument('--food-rows', type=int, default=50_000)
+    suite.add_argument('--art-rows', type=int, default=1_000_000)
+    suite.add_argument('--calls', type=int, default=500, help='timed calls per function scenario and repeat')
+    suite.add_argument('--repeats', type=int, default=REPEATS,
+                       help='timed runs per function scenario, compared by their median p50')
+    suite.add_argument('--batch-size', type=int, default=64)
+    suite.add_argument('--num-matches', type=int, default=3)
+    suite.add_argument('--requests', type=int, default=1000, help='pairing requests per HTTP scenario')
+    suite.add_argument('--ai-art-requests', type=int, default=40)
+    suite.add_argument('--concurrency', type=int, default=8)
+    suite.add_argument('--step-seconds', type=float, default=0.02, help='sleep per fake diffusion step')
+    suite.add_argument('--ready-timeout', type=float, default=600)
+    suite.add_argument('--pairing-table', action='store_true', help='build the pairing table and bench its lookups')
+    suite.add_argument('--skip-functions', action='store_true')
+    suite.add_argument('--skip-http', action='store_true')
+    suite.add_argument('--out', help='write the results here as JSON')
+    suite.add_argument('--baseline', help='results JSON to compare against')
+    suite.set_defaults(func=run)
+
+    check = subparsers.add_parser('compare', help='compare saved results against a baseline')
+    check.add_argument('results')
+    check.add_argument('baseline')
+    check.set_defaults(func=compare)
+
+    for command in (suite, check):
+        command.add_argument('--threshold', type=float,
+                             help='relative change that counts as a regression; defaults to the one recorded '
+                                  f'with the baseline, else {REGRESSION_THRESHOLD}')
+        command.add_argument('--metrics', nargs='+', choices=list(METRIC_DIRECTIONS), default=COMPARED_METRICS)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
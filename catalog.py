@@ -0,0 +1,619 @@
+"""Versioned dataset catalogs and the background reloader that swaps them"""
+import copy
+import fcntl
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from emotion_index import EMOTION_FAMILIES, EmotionIndex, emotion_columns
+from record_store import FOOD_CATEGORICAL_FIELDS, FOOD_RECORD_FIELDS, FacetIndex, RecordStore, facet_mask
+from text_index import ArtIndex, FoodIndex
+
+# column that identifies records of each table for deletion, and the column
+# each table's TF-IDF index is built on
+RECORD_KEYS = {'food': 'name', 'art': 'Image URL'}
+RECORD_TEXT = {'food': 'description', 'art': 'Title'}
+
+
+class Catalog:
+    """One loaded version of the datasets and the indexes fitted on them
+
+    A catalog is never modified after it is built. Reloading builds a new one
+    and swaps the reference, so a request that picked up the old catalog
+    keeps a consistent view of it until it finishes.
+
+    Records added at runtime are kept after the loaded rows and indexed
+    against the fitted vocabularies; deleted records are masked out. Row ids
+    stay stable until compacted() refits everything on the live records.
+    Every change bumps the revision and every refit the generation, so the
+    version changes whenever results may.
+
+    The food records and the art metadata are each held in a RecordStore;
+    added records are kept as a DataFrame of its fields until compaction
+    folds them into a new store. A FacetIndex over the art store resolves
+    Style, Category and Artist filters.
+
+    pairings, a PairingTable built from the same version, answers text-mode
+    art rankings per food row. Any change or refit drops it, since the
+    rankings it holds no longer apply.
+    """
+
+    def __init__(self, food_records, art_records, food_index, art_index, emotion_index, version, pairings=None):
+        self.food_records = food_records
+        self.art_records = art_records
+        self.art_facets = FacetIndex(art_records)
+        self.food_index = food_index
+        self.art_index = art_index
+        self.emotion_index = emotion_index
+        self.pairings = pairings
+        self.base_version = version
+        self.version = version
+        self.generation = 0
+        self.revision = 0
+        self.changes = ()
+        self.added = {'food': None, 'art': None}
+        self.lineage = object()
+        self.loaded_at = time.time()
+
+    def _table(self, table):
+        return self.food_records if table == 'food' else self.art_records
+
+    def _deleted(self, table):
+        index = self.food_index if table == 'food' else self.art_index
+        return index.deleted
+
+    def food_row(self, idx):
+        """Food record idx as a dict, added records included, None where a field is missing"""
+        if idx < len(self.food_records):
+            return self.food_records.get_many([idx])[0]
+        row = self.added['food'].iloc[idx - len(self.food_records)].astype(object)
+        return row.where(row.notna(), None).to_dict()
+
+    def food_descriptions(self, indices):
+        """Descriptions of the given food rows, '' where missing"""
+        indices = np.asarray(indices, dtype=np.int64)
+        n_base = len(self.food_records)
+        if self.added['food'] is None or not (indices >= n_base).any():
+            return [description or '' for description in self.food_records.field_values('description', indices)]
+        return [self.food_row(idx)['description'] or '' for idx in indices.tolist()]
+
+    def art_rows(self, ids):
+        """Art records for row ids as dicts, None where a field is missing"""
+        ids = np.asarray(ids, dtype=np.int64)
+        n_base = len(self.art_records)
+        added = ids >= n_base
+        if not added.any():
+            return self.art_records.get_many(ids)
+        rows = self.added['art'].iloc[ids[added] - n_base].astype(object)
+        added_rows = iter(rows.where(rows.notna(), None).to_dict('records'))
+        base_rows = iter(self.art_records.get_many(ids[~added]))
+        return [next(added_rows) if is_added else next(base_rows) for is_added in added]
+
+    def art_ids(self, filters):
+        """Sorted ids of the live artworks matching filters, a dict of field to accepted values"""
+        ids = self.art_facets.matching(filters).astype(np.int64)
+        if self.added['art'] is not None:
+            added = np.flatnonzero(facet_mask(self.added['art'], filters)) + len(self.art_records)
+            ids = np.concatenate([ids, added])
+        deleted = self._deleted('art')
+        if deleted is not None:
+            ids = ids[~deleted[ids]]
+        return ids
+
+    def live_rows(self, table):
+        """Number of records in table that are not deleted"""
+        added = self.added[table]
+        rows = len(self._table(table)) + (len(added) if added is not None else 0)
+        deleted = self._deleted(table)
+        return rows - (int(deleted.sum()) if deleted is not None else 0)
+
+    def _changed(self, change):
+        catalog = copy.copy(self)
+        catalog.added = dict(self.added)
+        catalog.pairings = None
+        catalog.revision = self.revision + 1
+        catalog.version = f'{self.base_version}.{self.generation}.{catalog.revision}'
+        catalog.changes = self.changes + (change,)
+        return catalog
+
+    def with_records(self, table, records):
+        """A new catalog with records, a list of dicts, appended to table"""
+        rows = pd.DataFrame.from_records(records)
+        catalog = self._changed(('append', table, records))
+        added = rows.reindex(columns=self._table(table).fields)
+        catalog.added[table] = added if self.added[table] is None else pd.concat(
+            [self.added[table], added], ignore_index=True)
+
+        texts = rows.reindex(columns=[RECORD_TEXT[table]])[RECORD_TEXT[table]].fillna('')
+        if table == 'food':
+            catalog.food_index = self.food_index.appended(texts)
+        else:
+            catalog.art_index = self.art_index.appended(texts)
+            scores = {
+                family: rows.reindex(columns=emotion_columns(family)).fillna(0).to_numpy(dtype=np.float32)
+                for family in EMOTION_FAMILIES
+            }
+            catalog.emotion_index = self.emotion_index.appended(scores)
+        return catalog
+
+    def without_records(self, table, keys):
+        """(new catalog, number deleted) with the records of table whose key is in keys removed"""
+        key = RECORD_KEYS[table]
+        matches = self._table(table).isin(key, keys)
+        if self.added[table] is not None:
+            matches = np.concatenate([matches, self.added[table][key].isin(keys).to_numpy()])
+        if self._deleted(table) is not None:
+            matches &= ~self._deleted(table)
+        rows = np.flatnonzero(matches)
+        if len(rows) == 0:
+            return self, 0
+
+        catalog = self._changed(('delete', table, keys))
+        if table == 'food':
+            catalog.food_index = self.food_index.without(rows)
+        else:
+            catalog.art_index = self.art_index.without(rows)
+            catalog.emotion_index = self.emotion_index.without(rows)
+        return catalog, len(rows)
+
+    def replayed(self, changes):
+        """A new catalog with changes, as recorded in Catalog.changes, applied in order
+
+        Consecutive changes of the same op to the same table are applied as
+        one, so a long log costs an index update per run of changes rather
+        than per change.
+        """
+        catalog = self
+        for (op, table), run in itertools.groupby(changes, key=lambda change: tuple(change[:2])):
+            payload = [item for _, _, items in run for item in items]
+            if op == 'append':
+                catalog = catalog.with_records(table, payload)
+            else:
+                catalog, _ = catalog.without_records(table, payload)
+        return catalog
+
+    def _live_frame(self, table):
+        df = self._table(table).to_frame()
+        if self.added[table] is not None:
+            df = pd.concat([df, self.added[table]], ignore_index=True)
+        deleted = self._deleted(table)
+        if deleted is not None:
+            df = df[~deleted].reset_index(drop=True)
+        return df
+
+    def compacted(self):
+        """A new catalog with the same records, every index refitted from scratch
+
+        Added records join the fitted vocabularies and idf weights, and
+        deleted ones are dropped for good, so row ids change.
+        """
+        food_df = self._live_frame('food')
+        art_df = self._live_frame('art')
+        scores = self.emotion_index.all_scores()
+        deleted = self._deleted('art')
+        if deleted is not None:
+            scores = {family: family_scores[~deleted] for family, family_scores in scores.items()}
+
+        art_index = ArtIndex(art_df)
+        emotion_index = EmotionIndex.from_scores(
+            art_index, scores, self.emotion_index.vector_index, **self.emotion_index.index_params
+        )
+        food_index = FoodIndex(food_df, self.food_index.featurizer, self.food_index.matrix.shape[1])
+        catalog = Catalog(RecordStore.from_frame(food_df, FOOD_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS),
+                          RecordStore.from_frame(art_df), food_index, art_index, emotion_index, self.base_version)
+        catalog.generation = self.generation + 1
+        catalog.revision = self.revision
+        catalog.version = f'{self.base_version}.{catalog.generation}.{catalog.revision}'
+        catalog.lineage = self.lineage
+        return catalog
+
+    def status(self):
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'food_rows': self.live_rows('food'),
+            'art_rows': self.live_rows('art'),
+            'food_records_bytes': sum(self.food_records.memory_usage().values()),
+            'art_records_bytes': sum(self.art_records.memory_usage().values()),
+            'pairing_table_k': self.pairings.k if self.pairings is not None else None,
+            'pending_changes': len(self.changes),
+        }
+
+
+# op of the last line of a change log that compaction has closed; its payload
+# is the base version whose log holds the changes that follow
+COMPACTED = 'compacted'
+
+
+def split_compacted(changes):
+    """(changes, base version the log continues in) of a log's changes, the version None while it is open"""
+    if changes and changes[-1][0] == COMPACTED:
+        return changes[:-1], changes[-1][2]
+    return changes, None
+
+
+def parse_changes(data):
+    """(changes, bytes consumed) of the complete JSON lines at the start of data
+
+    A line left unfinished, e.g. by a crash mid-write, is not consumed, and
+    one that does not parse is skipped.
+    """
+    end = data.rfind(b'\n') + 1
+    changes = []
+    for line in data[:end].splitlines():
+        try:
+            op, table, payload = json.loads(line)
+        except ValueError:
+            print(f"Skipping unreadable catalog change: {line[:80]!r}")
+            continue
+        changes.append((op, table, payload))
+    return changes, end
+
+
+class ChangeLog:
+    """Append-only files of the runtime record changes, shared by every worker
+
+    There is one file per base dataset version, holding one JSON line per
+    change as recorded in Catalog.changes. A worker that loads a version
+    replays its file, so changes survive restarts and reloads, and a worker
+    that polls the file picks up the changes the others made. Appends hold
+    an exclusive lock on the file, so each sees every earlier change.
+
+    Persistent compaction closes a file with a COMPACTED line naming the
+    base version of the new snapshot, whose file holds every later change.
+    follow() reads on across such lines, so a catalog loaded from an older
+    snapshot still sees every change.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, version):
+        return os.path.join(self.directory, f'{version}.jsonl')
+
+    def read(self, version, offset=0):
+        """(changes to version after byte offset, offset past the last one)"""
+        try:
+            with open(self.path(version), 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                f.seek(offset)
+                changes, consumed = parse_changes(f.read())
+        except FileNotFoundError:
+            return [], offset
+        return changes, offset + consumed
+
+    def follow(self, version, offset=0):
+        """(changes, log version, offset) after byte offset of version's log and the logs it continues in"""
+        changes = []
+        while True:
+            read, offset = self.read(version, offset)
+            read, next_version = split_compacted(read)
+            changes += read
+            if next_version is None:
+                return changes, version, offset
+            version, offset = next_version, 0
+
+    @contextmanager
+    def locked(self, version):
+        """Hold the file of version exclusively; yields a LockedChangeLog to read and append with"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(version), 'ab+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield LockedChangeLog(f)
+
+
+class LockedChangeLog:
+    """A change log file held exclusively, see ChangeLog.locked"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def read(self, offset):
+        self.file.seek(offset)
+        data = self.file.read()
+        changes, consumed = parse_changes(data)
+        if consumed < len(data):
+            # end an unfinished line, so the next change starts on its own
+            self.file.write(b'\n')
+        return changes, offset + len(data) + (consumed < len(data))
+
+    def append(self, change):
+        """Write change durably and return the offset after it"""
+        self.file.write(json.dumps(list(change)).encode('utf-8') + b'\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close_for(self, version):
+        """Mark the log as continued in the log of version, see ChangeLog"""
+        return self.append((COMPACTED, None, version))
+
+
+class CatalogReloader:
+    """Holds the current catalog and replaces it with freshly loaded ones
+
+    loader() builds a new Catalog. Reloads run in a background thread, one at
+    a time, and the current catalog is only replaced once the new one is
+    fully built; a failed reload keeps serving the old one. With watch(),
+    fingerprint() is polled and a change, such as a rewritten dataset file,
+    triggers a reload.
+
+    update() applies runtime changes, one at a time, and compact() refits
+    the current catalog in the background, replaying any changes made while
+    it ran. With a change_log, every change is also appended to it: loaded
+    catalogs replay the log of their version, and follow_changes() polls it
+    for changes made by other processes. Without one, runtime changes only
+    live in this process and a reload drops them.
+
+    With a publisher as well, such as a SnapshotPublisher, compaction is
+    shared: the one process holding the publisher's lock writes the
+    refitted catalog as a new snapshot, moves the change log on to its base
+    version and closes the old log. Every worker then reloads the new
+    snapshot, memory-mapped, and replays only the changes made since.
+    """
+
+    def __init__(self, loader, fingerprint=None, on_swap=None, change_log=None, publisher=None):
+        self.loader = loader
+        self.fingerprint = fingerprint
+        self.on_swap = on_swap
+        self.change_log = change_log
+        self.publisher = publisher
+        self.current = None
+        self.reloads = 0
+        self.reloading = False
+        self.last_error = None
+        self.last_reload_seconds = None
+        self.compacting = False
+        self.compactions = 0
+        self.last_compaction_seconds = None
+        self._watched = None
+        # the change log the current catalog follows, and the bytes of it
+        # already applied
+        self._log_version = None
+        self._log_offset = 0
+        self._lock = threading.Lock()
+        # serializes swaps, so an update is never applied to a catalog that a
+        # reload or compaction has already replaced
+        self._swap_lock = threading.Lock()
+
+    def load(self):
+        """Load a catalog in the calling thread, returning whether it succeeded"""
+        self._watched = self._fingerprint()
+        try:
+            catalog = self.loader()
+            with self._swap_lock:
+                self._swap_with_logged_changes(catalog)
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error loading datasets: {str(e)}")
+            return False
+
+    def reload(self):
+        """Start a background reload, returning False if one is already running"""
+        with self._lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+        threading.Thread(target=self._reload, name='catalog-reload', daemon=True).start()
+        return True
+
+    def _reload(self):
+        start = time.perf_counter()
+        # remembered even if loading fails, so the watcher only retries once
+        # the files change again
+        self._watched = self._fingerprint()
+        try:
+            catalog = self.loader()
+            with self._swap_lock:
+                self._swap_with_logged_changes(catalog)
+            self.reloads += 1
+            self.last_error = None
+            self.last_reload_seconds = time.perf_counter() - start
+            print(f"Reloaded datasets {catalog.version} in {self.last_reload_seconds:.2f} s")
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error reloading datasets, still serving the previous version: {str(e)}")
+        finally:
+            with self._lock:
+                self.reloading = False
+
+    def update(self, change):
+        """Swap in change(current), which returns (new catalog, result), and return result
+
+        With a change log, changes other processes logged are applied first
+        and the new change is logged before it is swapped in.
+        """
+        with self._swap_lock:
+            if self.change_log is None:
+                catalog, result = change(self.current)
+                if catalog is not self.current:
+                    self._swap(catalog)
+                return result
+            log_version = self._log_version
+            while True:
+                with self.change_log.locked(self._log_version) as log:
+                    changes, self._log_offset = log.read(self._log_offset)
+                    changes, next_version = split_compacted(changes)
+                    if changes:
+                        self._swap(self.current.replayed(changes))
+                    if next_version is None:
+                        catalog, result = change(self.current)
+                        if catalog is not self.current:
+                            self._log_offset = log.append(catalog.changes[-1])
+                            self._swap(catalog)
+                        break
+                self._log_version, self._log_offset = next_version, 0
+        self._reload_if_compacted(log_version)
+        return result
+
+    def _reload_if_compacted(self, log_version):
+        if self._log_version != log_version:
+            print(f"Datasets were compacted into {self._log_version}, reloading")
+            self.reload()
+
+    def _swap_with_logged_changes(self, catalog):
+        """Swap in a freshly loaded catalog with the logged changes to its version replayed"""
+        if self.change_log is not None:
+            changes, self._log_version, self._log_offset = self.change_log.follow(catalog.base_version)
+            if changes:
+                catalog = catalog.replayed(changes)
+                print(f"Replayed {len(changes)} logged changes onto datasets {catalog.base_version}")
+        self._swap(catalog)
+
+    def follow_changes(self, interval):
+        """Poll the change log every interval seconds and apply changes other processes made"""
+        threading.Thread(target=self._follow_changes, args=(interval,), name='catalog-changes', daemon=True).start()
+
+    def _follow_changes(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.apply_logged_changes()
+            except Exception as e:
+                print(f"Error applying logged catalog changes: {str(e)}")
+
+    def apply_logged_changes(self):
+        """Apply the changes logged since the last read, returning how many there were"""
+        with self._swap_lock:
+            if self.current is None:
+                return 0
+            log_version = self._log_version
+            changes, self._log_version, self._log_offset = self.change_log.follow(log_version, self._log_offset)
+            if changes:
+                self._swap(self.current.replayed(changes))
+        # another process compacted the datasets into a new snapshot
+        self._reload_if_compacted(log_version)
+        return len(changes)
+
+    def compact(self):
+        """Start a background compaction, returning False if one is already running"""
+        with self._lock:
+            if self.compacting:
+                return False
+            self.compacting = True
+        threading.Thread(target=self._compact, name='catalog-compact', daemon=True).start()
+        return True
+
+    def _compact(self):
+        start = time.perf_counter()
+        try:
+            if self.change_log is not None and self.publisher is not None:
+                with self.publisher.locked() as locked:
+                    if not locked:
+                        print("Another process is compacting or building the snapshot, skipping compaction")
+                        return
+                    # changes other processes made are compacted too
+                    log_version = self._log_version
+                    self.apply_logged_changes()
+                    with self._swap_lock:
+                        source, offset = self.current, self._log_offset
+                    if self._log_version != log_version:
+                        # another process just compacted and this one is reloading its snapshot
+                        return
+                    # a catalog not loaded from the snapshot, e.g. from the CSVs, is compacted in memory
+                    if self.publisher.base_version() == source.base_version:
+                        self._publish(source, log_version, offset)
+                        self._finish_compaction(source, start)
+                        return
+            self._compact_in_memory(start)
+        except Exception as e:
+            print(f"Error compacting datasets: {str(e)}")
+        finally:
+            with self._lock:
+                self.compacting = False
+
+    def _publish(self, source, log_version, offset):
+        """Publish source, compacted, as the snapshot, continuing log_version past offset in its log"""
+        staged, version = self.publisher.stage(source.compacted())
+        try:
+            with self.change_log.locked(log_version) as log:
+                # changes logged while the refit ran start the new log
+                changes, _ = log.read(offset)
+                with self.change_log.locked(version) as new_log:
+                    for change in changes:
+                        new_log.append(change)
+                # closed before the snapshot moves, so a catalog loaded from
+                # either snapshot finds every change
+                log.close_for(version)
+                self.publisher.install(staged)
+        except BaseException:
+            self.publisher.discard(staged)
+            raise
+        # follows the log to its new version, which reloads the snapshot
+        self.apply_logged_changes()
+
+    def _finish_compaction(self, source, start):
+        self.compactions += 1
+        self.last_compaction_seconds = time.perf_counter() - start
+        print(f"Compacted datasets {source.version} in {self.last_compaction_seconds:.2f} s")
+
+    def _compact_in_memory(self, start):
+        source = self.current
+        compacted = source.compacted()
+        with self._swap_lock:
+            current = self.current
+            if current.lineage is not source.lineage:
+                print("Datasets were reloaded during compaction, discarding it")
+                return
+            # changes applied while the refit ran are replayed on top of it
+            self._swap(compacted.replayed(current.changes[len(source.changes):]))
+        self._finish_compaction(source, start)
+
+    def compact_every(self, interval):
+        """Compact every interval seconds while there are pending changes"""
+        threading.Thread(target=self._compact_every, args=(interval,), name='catalog-compact-timer', daemon=True).start()
+
+    def _compact_every(self, interval):
+        while True:
+            time.sleep(interval)
+            if self.current is not None and self.current.changes:
+                self.compact()
+
+    def _swap(self, catalog):
+        previous = self.current
+        self.current = catalog
+        if self.on_swap:
+            self.on_swap(previous, catalog)
+
+    def _fingerprint(self):
+        if self.fingerprint is None:
+            return None
+        try:
+            return self.fingerprint()
+        except OSError:
+            return None
+
+    def watch(self, interval):
+        """Poll the fingerprint every interval seconds and reload when it changes"""
+        threading.Thread(target=self._watch, args=(interval,), name='catalog-watch', daemon=True).start()
+
+    def _watch(self, interval):
+        previous = self._watched
+        while True:
+            time.sleep(interval)
+            fingerprint = self._fingerprint()
+            # wait for a change to hold for two polls, so a file still being
+            # written is not loaded half-finished
+            settled = fingerprint == previous
+            previous = fingerprint
+            if fingerprint is not None and settled and fingerprint != self._watched and self.reload():
+                print("Dataset files changed or a reload was requested, reloading")
+
+    def status(self):
+        return {
+            'current': self.current.status() if self.current else None,
+            'reloading': self.reloading,
+            'reloads': self.reloads,
+            'last_reload_seconds': self.last_reload_seconds,
+            'last_error': self.last_error,
+            'compacting': self.compacting,
+            'compactions': self.compactions,
+            'last_compaction_seconds': self.last_compaction_seconds,
+        }
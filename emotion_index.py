@@ -0,0 +1,207 @@
+"""Dense emotion-space index over the art catalog"""
+import copy
+
+import numpy as np
+
+from metrics import timed
+from ranking import top_k
+from vector_index import build_vector_index
+
+EMOTIONS = [
+    'agreeableness', 'anger', 'anticipation', 'arrogance', 'disagreeableness',
+    'disgust', 'fear', 'gratitude', 'happiness', 'humility', 'love', 'optimism',
+    'pessimism', 'regret', 'sadness', 'shame', 'shyness', 'surprise', 'trust',
+    'neutral',
+]
+
+# emotion families in artdataset490.csv, keyed by the name clients pass in
+EMOTION_FAMILIES = {
+    'art': 'Art (image+title)',
+    'image': 'ImageOnly',
+    'title': 'TitleOnly',
+}
+
+
+def emotion_columns(family):
+    """Column names of one emotion family, in EMOTIONS order"""
+    prefix = EMOTION_FAMILIES[family]
+    return [f'{prefix}: {emotion}' for emotion in EMOTIONS]
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row, leaving all-zero rows at zero"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class EmotionIndex:
+    """Artworks as unit vectors in the 20-emotion space, one matrix per family
+
+    Food descriptions carry no emotion scores, so text is mapped into the
+    same space through the art titles: every title term gets the TF-IDF
+    weighted average of the emotion scores of the titles it appears in, and
+    a text's profile is the weighted average over its terms. Both sides are
+    centred on the catalog mean before normalizing, so cosine similarity
+    compares how a text and an artwork deviate from the typical artwork.
+
+    Artworks added later are centred on the fitted means and searched
+    exactly in a small delta matrix, and deleted rows are dropped from
+    scores and search results, until the index is refitted.
+    """
+
+    def __init__(self, art_df, art_index, vector_index='exact', **index_params):
+        scores = {
+            family: art_df[emotion_columns(family)].fillna(0).to_numpy(dtype=np.float32)
+            for family in EMOTION_FAMILIES
+        }
+        self._fit(art_index, scores, vector_index, index_params)
+
+    @classmethod
+    def from_scores(cls, art_index, scores, vector_index='exact', **index_params):
+        """Fit an index from raw per-family emotion scores, one row per title"""
+        index = cls.__new__(cls)
+        index._fit(art_index, scores, vector_index, index_params)
+        return index
+
+    def _fit(self, art_index, scores, vector_index, index_params):
+        self.art_index = art_index
+        self.scores_by_family = scores
+        self.matrices = {}
+        self.projections = {}
+        self.means = {}
+
+        # total TF-IDF weight of each term across the titles, for averaging
+        term_weights = np.asarray(art_index.matrix.sum(axis=0), dtype=np.float32).T
+        term_weights[term_weights == 0] = 1
+
+        for family in EMOTION_FAMILIES:
+            mean = scores[family].mean(axis=0)
+            self.means[family] = mean
+            self.matrices[family] = np.ascontiguousarray(normalize_rows(scores[family] - mean), dtype=np.float32)
+            self.projections[family] = np.asarray(art_index.matrix.T @ scores[family], dtype=np.float32) / term_weights
+        self._build_vector_indexes(vector_index, index_params)
+
+    @classmethod
+    def from_arrays(cls, art_index, matrices, projections, means, scores, vector_index='exact', vector_indexes=None,
+                    **index_params):
+        """Rebuild an index from saved per-family matrices, projections, means and raw scores
+
+        vector_indexes, saved per-family vector indexes of kind vector_index,
+        are used as they are instead of being built from the matrices.
+        """
+        index = cls.__new__(cls)
+        index.art_index = art_index
+        index.scores_by_family = scores
+        index.matrices = matrices
+        index.projections = projections
+        index.means = means
+        index._build_vector_indexes(vector_index, index_params, vector_indexes)
+        return index
+
+    def _build_vector_indexes(self, vector_index, index_params, vector_indexes=None):
+        self.vector_index = vector_index
+        self.index_params = index_params
+        self.vector_indexes = vector_indexes or {
+            family: build_vector_index(matrix, vector_index, **index_params)
+            for family, matrix in self.matrices.items()
+        }
+        self.delta_scores = None
+        self.delta = None
+        self.deleted = None
+
+    def __len__(self):
+        return len(self.matrices['art']) + (len(self.delta['art']) if self.delta is not None else 0)
+
+    def appended(self, scores):
+        """A copy with artworks added after the existing rows, given their raw scores per family"""
+        index = copy.copy(self)
+        rows = {family: normalize_rows(scores[family] - self.means[family]).astype(np.float32)
+                for family in EMOTION_FAMILIES}
+        if self.delta is None:
+            index.delta_scores = scores
+            index.delta = rows
+        else:
+            index.delta_scores = {family: np.vstack([self.delta_scores[family], scores[family]])
+                                  for family in EMOTION_FAMILIES}
+            index.delta = {family: np.vstack([self.delta[family], rows[family]]) for family in EMOTION_FAMILIES}
+        if self.deleted is not None:
+            index.deleted = np.concatenate([self.deleted, np.zeros(len(scores['art']), dtype=bool)])
+        return index
+
+    def without(self, rows):
+        """A copy with rows dropped from scores and search results"""
+        index = copy.copy(self)
+        index.deleted = np.zeros(len(self), dtype=bool) if self.deleted is None else self.deleted.copy()
+        index.deleted[rows] = True
+        return index
+
+    def all_scores(self):
+        """Raw per-family emotion scores of every row, added ones included"""
+        if self.delta_scores is None:
+            return self.scores_by_family
+        return {family: np.vstack([self.scores_by_family[family], self.delta_scores[family]])
+                for family in EMOTION_FAMILIES}
+
+    def embed_many(self, texts, family='art'):
+        """Unit emotion vectors for texts, zero for texts with no known terms"""
+        with timed('transform'):
+            terms = self.art_index.vectorizer.transform(texts)
+        weights = np.asarray(terms.sum(axis=1), dtype=np.float32)
+        profiles = np.asarray(terms @ self.projections[family], dtype=np.float32)
+        has_terms = weights[:, 0] > 0
+        profiles[has_terms] = profiles[has_terms] / weights[has_terms] - self.means[family]
+        return normalize_rows(profiles)
+
+    def scores(self, text, family='art', ids=None):
+        """Cosine similarity of text against every artwork in emotion space
+
+        With ids, a sorted array of row ids, only those rows are scored and
+        the result follows their order.
+        """
+        query = self.embed_many([text], family)[0]
+        with timed('similarity'):
+            return self._scores(query, family, ids)
+
+    def _scores(self, query, family, ids):
+        if ids is not None:
+            n_base = len(self.matrices[family])
+            split = np.searchsorted(ids, n_base)
+            scores = self.matrices[family][ids[:split]] @ query
+            if split < len(ids):
+                scores = np.concatenate([scores, self.delta[family][ids[split:] - n_base] @ query])
+            if self.deleted is not None:
+                scores[self.deleted[ids]] = -np.inf
+            return scores
+        scores = self.matrices[family] @ query
+        if self.delta is not None:
+            scores = np.concatenate([scores, self.delta[family] @ query])
+        if self.deleted is not None:
+            scores[self.deleted] = -np.inf
+        return scores
+
+    def search(self, text, family='art', k=3):
+        """(row ids, scores) of the k nearest artworks through the vector index"""
+        query = self.embed_many([text], family)[0]
+        # the vector index selects the top k itself, so it counts as similarity
+        with timed('similarity'):
+            return self._search(query, family, k)
+
+    def _search(self, query, family, k):
+        if self.delta is None and self.deleted is None:
+            return self.vector_indexes[family].search(query, k)
+
+        # over-fetch by the number of deleted rows so k live ones remain,
+        # then merge with an exact search over the added rows
+        n_deleted = int(self.deleted.sum()) if self.deleted is not None else 0
+        ids, scores = self.vector_indexes[family].search(query, k + n_deleted)
+        if self.delta is not None:
+            delta_scores = self.delta[family] @ query
+            delta_ids = top_k(delta_scores, k + n_deleted)
+            ids = np.concatenate([ids, delta_ids + len(self.matrices[family])])
+            scores = np.concatenate([scores, delta_scores[delta_ids]])
+        if self.deleted is not None:
+            live = ~self.deleted[ids]
+            ids, scores = ids[live], scores[live]
+        order = np.lexsort((ids, -scores))[:k]
+        return ids[order], scores[order]
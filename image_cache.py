@@ -0,0 +1,138 @@
+"""Content-addressed cache for generated AI art"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from result_cache import normalize_text
+
+
+def cache_key(prompt, model_id, steps, guidance_scale, seed):
+    """Hash of everything that determines the generated image"""
+    payload = json.dumps([normalize_text(prompt), model_id, steps, guidance_scale, seed])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ImageCache:
+    """Two-tier image cache: an in-memory LRU in front of an on-disk store
+
+    Both tiers are bounded by total bytes. Disk entries are evicted least
+    recently used first, using file modification times that are refreshed on
+    every hit, so the order survives restarts.
+    """
+
+    def __init__(self, directory, max_memory_bytes=64 * 1024 ** 2, max_disk_bytes=1024 ** 3):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = {}
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._scan_disk()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.png')
+
+    def _scan_disk(self):
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.png'):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        # oldest first, so the dict order matches the eviction order
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def get(self, key, count=True):
+        """Return the cached image bytes for key, or None on a miss
+
+        With count=False the read is left out of the hit and miss counts,
+        e.g. when fetching an image already known to be cached.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += count
+                return data
+
+            if key not in self._disk:
+                self.misses += count
+                return None
+            try:
+                path = self._path(key)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                self._forget_disk(key)
+                self.misses += count
+                return None
+            self._disk[key] = self._disk.pop(key)
+            self.disk_hits += count
+            self._remember(key, data)
+            return data
+
+    def put(self, key, data):
+        """Store image bytes under key in both tiers"""
+        with self._lock:
+            self._remember(key, data)
+            if key in self._disk:
+                return
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # a unique temp file per write, as worker processes share the directory
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                oldest = next(iter(self._disk))
+                try:
+                    os.remove(self._path(oldest))
+                except OSError:
+                    pass
+                self._forget_disk(oldest)
+
+    def _remember(self, key, data):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _forget_disk(self, key):
+        self._disk_bytes -= self._disk.pop(key, 0)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+            'memory_entries': len(self._memory),
+            'memory_bytes': self._memory_bytes,
+            'disk_entries': len(self._disk),
+            'disk_bytes': self._disk_bytes,
+        }
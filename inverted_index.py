@@ -0,0 +1,119 @@
+"""Term -> postings index over a TF-IDF matrix, with MaxScore top-k pruning
+
+Most documents share no terms with a query and score zero, so rather than
+scoring every row, a query walks the postings of its own terms only. Terms
+are taken in order of their score upper bound (query weight times the
+largest weight in the postings list). Once the k-th best partial score
+beats the combined bound of the terms still to come, no unseen document can
+make the top k: the remaining terms only update the candidates already
+found, and candidates that can no longer reach the k-th score are dropped.
+"""
+import numpy as np
+
+from ranking import top_k
+
+# candidates are merged by sorting while they hold fewer than this share of
+# the documents, and scored in a dense accumulator past it, where sorting is
+# slower
+DENSE_MERGE_SHARE = 1 / 4
+
+
+class InvertedIndex:
+    """Postings lists of a CSR document-term matrix, one per term
+
+    The postings of term t are doc_ids[indptr[t]:indptr[t + 1]] with the
+    matching weights, sorted by document. max_weights[t] bounds what term t
+    can add to any document's score.
+    """
+
+    def __init__(self, matrix):
+        self.n_docs = matrix.shape[0]
+        postings = matrix.tocsc()
+        postings.sort_indices()
+        self.indptr = postings.indptr
+        self.doc_ids = postings.indices
+        self.weights = postings.data
+        self.max_weights = np.zeros(postings.shape[1], dtype=self.weights.dtype)
+        nonempty = np.flatnonzero(np.diff(self.indptr))
+        if len(nonempty):
+            self.max_weights[nonempty] = np.maximum.reduceat(self.weights, self.indptr[nonempty])
+
+    @classmethod
+    def from_arrays(cls, n_docs, indptr, doc_ids, weights, max_weights):
+        """Rebuild an index over n_docs documents from saved postings arrays"""
+        index = cls.__new__(cls)
+        index.n_docs = n_docs
+        index.indptr = indptr
+        index.doc_ids = doc_ids
+        index.weights = weights
+        index.max_weights = max_weights
+        return index
+
+    def postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def search(self, terms, weights, k, deleted=None, threshold=-np.inf):
+        """(doc ids, scores) of the k best documents sharing a term with the query, best first
+
+        terms and weights are the query's nonzero columns and values. Rows
+        flagged in deleted are skipped. threshold is a known lower bound on
+        the k-th best score, e.g. from documents scored elsewhere. Ties go to
+        the lower doc id, and documents scoring zero are never returned, so
+        fewer than k may come back.
+        """
+        bounds = weights * self.max_weights[terms]
+        # terms no document uses, e.g. hashed columns with zero idf, add nothing
+        useful = bounds > 0
+        terms, weights, bounds = terms[useful], weights[useful], bounds[useful]
+        order = np.argsort(-bounds, kind='stable')
+        terms, weights, bounds = terms[order], weights[order], bounds[order]
+        # rest[i] is the most that terms i onwards can still add
+        rest = np.append(np.cumsum(bounds[::-1])[::-1], 0)
+
+        docs = np.empty(0, dtype=self.doc_ids.dtype)
+        scores = np.empty(0, dtype=self.weights.dtype)
+        accumulator = None
+        accepting = True
+        for i, (term, weight) in enumerate(zip(terms, weights)):
+            term_docs, term_weights = self.postings(term)
+            if accumulator is not None:
+                accumulator[term_docs] += weight * term_weights
+                continue
+            if accepting:
+                if len(docs) + len(term_docs) > self.n_docs * DENSE_MERGE_SHARE:
+                    # too many candidates to merge by sorting: score the
+                    # remaining terms into a dense accumulator instead
+                    accumulator = np.zeros(self.n_docs, dtype=scores.dtype)
+                    accumulator[docs] = scores
+                    accumulator[term_docs] += weight * term_weights
+                    continue
+                docs, inverse = np.unique(np.concatenate([docs, term_docs]), return_inverse=True)
+                scores = np.bincount(inverse, np.concatenate([scores, weight * term_weights]), minlength=len(docs))
+                if deleted is not None:
+                    live = ~deleted[docs]
+                    docs, scores = docs[live], scores[live]
+            else:
+                positions = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+                hits = term_docs[positions] == docs
+                scores[hits] += weight * term_weights[positions[hits]]
+
+            kth = threshold
+            if len(docs) >= k:
+                kth = max(kth, np.partition(scores, len(docs) - k)[len(docs) - k])
+            # ties go to the lower doc id, so only strictly lower bounds are pruned
+            if accepting and rest[i + 1] < kth:
+                accepting = False
+            if not accepting:
+                keep = scores + rest[i + 1] >= kth
+                docs, scores = docs[keep], scores[keep]
+
+        if accumulator is not None:
+            if deleted is not None:
+                accumulator[deleted] = 0
+            docs = top_k(accumulator, k)
+            docs = docs[accumulator[docs] > 0]
+            return docs, accumulator[docs]
+        # docs are sorted, so top_k's tie-break on position is one on doc id
+        best = top_k(scores, k)
+        return docs[best], scores[best]
@@ -0,0 +1,188 @@
+"""In-process latency histograms and counters, rendered in the Prometheus text format
+
+Hot paths wrap their stages in timed('stage'), which records into the shared
+stage histogram. Observing is a bisect into fixed buckets under a lock, so
+it stays cheap enough to leave on. Values that other objects already keep,
+such as cache statistics and queue depths, are read by callbacks when
+/metrics is scraped rather than updated on every request.
+
+With METRICS_ENABLED=0 timed() returns a shared no-op and observe() returns
+straight away, so instrumented code runs as before.
+"""
+import bisect
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# upper bounds in seconds, from sub-millisecond index lookups to model loads
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300,
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum, for each set of label values"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not METRICS_ENABLED:
+            return
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # one count per bucket plus +Inf, then the sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the seconds its block takes"""
+        if not METRICS_ENABLED:
+            return NULL_TIMER
+        return Timer(self, label_values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, label_values)} {values[-1]!r}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, label_values)} {cumulative}')
+        return lines
+
+
+class Timer:
+    """Observes the duration of a with block into a histogram, unless it raised"""
+
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+class NullTimer:
+    """Stands in for Timer when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class CallbackMetric:
+    """A gauge or counter whose value is read from a callback at scrape time
+
+    fn returns a number, or a dict mapping tuples of label values to numbers.
+    """
+
+    def __init__(self, name, help_text, fn, kind='gauge', labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.kind = kind
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}')
+        return lines
+
+
+class Registry:
+    """Every metric of the process, in registration order"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # one failing callback must not take the whole scrape down
+                lines.append(f'# {metric.name} unavailable: {escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.add(Histogram(
+    'app_stage_seconds', 'Seconds spent in each stage of serving a request or loading a resource', ('stage',)
+))
+
+
+def timed(stage):
+    """Time a with block as one observation of stage"""
+    return STAGE_SECONDS.time(stage)
+
+
+def observe(stage, seconds):
+    """Record a duration measured elsewhere as one observation of stage"""
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+def histogram(name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.add(Histogram(name, help_text, labels, buckets))
+
+
+def callback(name, help_text, fn, kind='gauge', labels=()):
+    return REGISTRY.add(CallbackMetric(name, help_text, fn, kind, labels))
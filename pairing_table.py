@@ -0,0 +1,198 @@
+"""Precomputed text-mode art matches for every food row
+
+In text mode the art ranking depends only on the matched food row's
+description, not on the raw input, so it can be computed once per food row.
+The table holds the top k art row ids (int32) and similarities (float32) of
+every food row, and a request only has to resolve its food match and read a
+row of the table.
+
+The table is tied to the dataset version it was built from and is ignored
+once that changes. It is kept beside the snapshot rather than inside it, so
+rebuilding the snapshot for the same datasets keeps the table. Rebuild it
+with:
+
+    python pairing_table.py build --workers 8
+    python pairing_table.py check
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ranking import top_k
+from snapshot import (ART_VECTOR_INDEX, FOOD_FEATURIZER, FOOD_HASHING_FEATURES, SNAPSHOT_DIR, dataset_fingerprint,
+                      ensure_snapshot, load_snapshot, read_manifest, snapshot_is_current, snapshot_version)
+from text_index import SCORES_MANY_CELLS
+
+PAIRING_TABLE_DIR = os.environ.get('PAIRING_TABLE_DIR', f'{SNAPSHOT_DIR}.pairings')
+PAIRING_TABLE_K = int(os.environ.get('PAIRING_TABLE_K', 10))
+# large art catalogs get smaller chunks, see SCORES_MANY_CELLS
+PAIRING_TABLE_CHUNK_ROWS = 1024
+
+# the art index of a build, set once per worker process
+_worker_art_index = None
+
+
+def _init_worker(art_index):
+    global _worker_art_index
+    _worker_art_index = art_index
+
+
+def _rank_chunk(descriptions, k):
+    """(ids, scores) of the top k artworks for each description"""
+    similarities = _worker_art_index.scores_many(descriptions)
+    ids = np.empty((len(descriptions), k), dtype=np.int32)
+    scores = np.empty((len(descriptions), k), dtype=np.float32)
+    for row, row_similarities in enumerate(similarities):
+        top_indices = top_k(row_similarities, k)
+        ids[row] = top_indices
+        scores[row] = row_similarities[top_indices]
+    return ids, scores
+
+
+class PairingTable:
+    """Top k art matches of every food row, for one dataset version"""
+
+    def __init__(self, ids, scores, dataset_version):
+        self.ids = ids
+        self.scores = scores
+        self.dataset_version = dataset_version
+        self.k = ids.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, food_indices, num_matches):
+        """(art row ids, scores) of the best num_matches artworks per food row, or None past k"""
+        if num_matches > self.k:
+            return None
+        return self.ids[food_indices, :num_matches], self.scores[food_indices, :num_matches]
+
+
+def build_pairing_table(table_dir, descriptions, art_index, dataset_version, k=PAIRING_TABLE_K, workers=None,
+                        chunk_rows=PAIRING_TABLE_CHUNK_ROWS):
+    """Rank the artworks for every food description across worker processes and write the table
+
+    Chunks of descriptions are scored in parallel and written straight into
+    memory-mapped output files. The table is written to a temporary
+    directory and moved into place, like a snapshot.
+    """
+    start = time.perf_counter()
+    k = min(k, len(art_index))
+    chunk_rows = max(1, min(chunk_rows, SCORES_MANY_CELLS // max(1, len(art_index))))
+    descriptions = [description if isinstance(description, str) else '' for description in descriptions]
+    temp_dir = f'{table_dir}.tmp-{os.getpid()}'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    ids = np.lib.format.open_memmap(os.path.join(temp_dir, 'ids.npy'), 'w+', np.int32, (len(descriptions), k))
+    scores = np.lib.format.open_memmap(os.path.join(temp_dir, 'scores.npy'), 'w+', np.float32, (len(descriptions), k))
+    starts = range(0, len(descriptions), chunk_rows)
+    chunks = (descriptions[row:row + chunk_rows] for row in starts)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(art_index,)) as pool:
+        for row, (chunk_ids, chunk_scores) in zip(starts, pool.map(_rank_chunk, chunks, [k] * len(starts))):
+            ids[row:row + len(chunk_ids)] = chunk_ids
+            scores[row:row + len(chunk_scores)] = chunk_scores
+    ids.flush()
+    scores.flush()
+    del ids, scores
+
+    manifest = {
+        'dataset_version': dataset_version,
+        'k': k,
+        'food_rows': len(descriptions),
+        'art_rows': len(art_index),
+        'built_at': time.time(),
+    }
+    with open(os.path.join(temp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    old_dir = f'{table_dir}.old-{os.getpid()}'
+    if os.path.exists(table_dir):
+        os.rename(table_dir, old_dir)
+    os.rename(temp_dir, table_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    print(f"Built pairing table for {len(descriptions)} food rows, top {k}, "
+          f"in {time.perf_counter() - start:.2f} s")
+    return manifest
+
+
+def read_table_manifest(table_dir):
+    with open(os.path.join(table_dir, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def pairing_table_is_current(table_dir, dataset_version, food_rows=None, art_rows=None):
+    """Whether a table exists in table_dir and was built from dataset_version"""
+    try:
+        manifest = read_table_manifest(table_dir)
+    except (OSError, ValueError):
+        return False
+    return (manifest.get('dataset_version') == dataset_version
+            and food_rows in (None, manifest.get('food_rows'))
+            and art_rows in (None, manifest.get('art_rows')))
+
+
+def load_pairing_table(table_dir, dataset_version, food_rows, art_rows, mmap=True):
+    """The table in table_dir, or None if there is none or it is stale"""
+    if not os.path.exists(os.path.join(table_dir, 'manifest.json')):
+        return None
+    if not pairing_table_is_current(table_dir, dataset_version, food_rows, art_rows):
+        print(f"Pairing table in {table_dir} is stale, run `python pairing_table.py build` to rebuild it")
+        return None
+    mmap_mode = 'r' if mmap else None
+    return PairingTable(
+        np.load(os.path.join(table_dir, 'ids.npy'), mmap_mode=mmap_mode),
+        np.load(os.path.join(table_dir, 'scores.npy'), mmap_mode=mmap_mode),
+        dataset_version
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('build', 'rank the artworks for every food row from the snapshot'),
+                            ('check', 'exit with 1 if the table is missing or stale')):
+        command = subparsers.add_parser(name, help=help_text)
+        command.add_argument('--food-csv', default=os.environ.get('FOOD_CSV_PATH'),
+                             required='FOOD_CSV_PATH' not in os.environ)
+        command.add_argument('--art-csv', default=os.environ.get('ART_CSV_PATH'),
+                             required='ART_CSV_PATH' not in os.environ)
+        command.add_argument('--out', default=PAIRING_TABLE_DIR)
+        command.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+        # the app's snapshot settings, so building the table never rebuilds its snapshot
+        command.add_argument('--food-featurizer', choices=['vocabulary', 'hashing'], default=FOOD_FEATURIZER)
+        command.add_argument('--hashing-features', type=int, default=FOOD_HASHING_FEATURES)
+        command.add_argument('--vector-index', choices=['exact', 'ivf'], default=ART_VECTOR_INDEX)
+    build = subparsers.choices['build']
+    build.add_argument('-k', type=int, default=PAIRING_TABLE_K)
+    build.add_argument('--workers', type=int, default=None)
+
+    args = parser.parse_args()
+    if args.command == 'check':
+        # the version the app loads: the snapshot's, which compaction changes, or else the CSVs'
+        if snapshot_is_current(args.snapshot_dir, args.food_csv, args.art_csv, args.food_featurizer,
+                               args.hashing_features, args.vector_index):
+            version = snapshot_version(read_manifest(args.snapshot_dir))
+        else:
+            version = dataset_fingerprint([args.food_csv, args.art_csv])
+        current = pairing_table_is_current(args.out, version)
+        print(f"Pairing table in {args.out} is {'current' if current else 'missing or stale'} for {version}")
+        sys.exit(0 if current else 1)
+
+    # the table is ranked against the same fitted indexes the app loads
+    ensure_snapshot(args.snapshot_dir, args.food_csv, args.art_csv, args.food_featurizer, args.hashing_features,
+                    args.vector_index)
+    food_records, _, _, art_index, _, manifest = load_snapshot(args.snapshot_dir)
+    build_pairing_table(args.out, food_records.column('description'), art_index, snapshot_version(manifest), args.k,
+                        args.workers)
+
+
+if __name__ == '__main__':
+    main()
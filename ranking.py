@@ -0,0 +1,50 @@
+"""Ranking helpers shared by the pairing paths"""
+import numpy as np
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first
+
+    Uses partial selection, so the cost is O(n + k log k) instead of a full
+    sort. Ties are broken by the lower row index, which keeps results stable
+    when many rows share a score (e.g. every title with no shared terms).
+    """
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # rows at the minimum score (usually the zero-overlap majority) are only
+    # needed to pad the result, so partial selection runs on the rest
+    floor = scores.min()
+    candidates = np.flatnonzero(scores > floor)
+    if len(candidates) > k:
+        candidate_scores = scores[candidates]
+        cut = len(candidates) - k
+        kth_score = np.partition(candidate_scores, cut)[cut]
+        above = candidates[candidate_scores > kth_score]
+        tied = candidates[candidate_scores == kth_score][:k - len(above)]
+        candidates = np.concatenate([above, tied])
+    else:
+        padding = np.flatnonzero(scores == floor)[:k - len(candidates)]
+        candidates = np.concatenate([candidates, padding])
+
+    # sort the k survivors by score descending, then row index ascending
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def fuse_scores(components, weights):
+    """Weighted sum of per-row score arrays, e.g. {'text': ..., 'emotion': ...}
+
+    Every row is scored in the same vectorized pass; components missing from
+    weights count for nothing.
+    """
+    fused = None
+    for name, scores in components.items():
+        weight = weights.get(name, 0)
+        if weight:
+            fused = weight * scores if fused is None else fused + weight * scores
+    if fused is None:
+        return np.zeros(len(next(iter(components.values()))))
+    return fused
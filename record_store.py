@@ -0,0 +1,185 @@
+"""Compact column-oriented store for the art and food records returned in responses"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+# fields of an art match, in response order, and those with few distinct values
+ART_RECORD_FIELDS = ['Title', 'Artist', 'Style', 'Category', 'Image URL']
+ART_CATEGORICAL_FIELDS = ['Artist', 'Style', 'Category']
+# fields of a food record; none repeat often enough to be worth coding
+FOOD_RECORD_FIELDS = ['name', 'description']
+FOOD_CATEGORICAL_FIELDS = []
+# fields whose entries may list several values, e.g. 'Contemporary Art,Modern Art'
+MULTI_VALUED_FIELDS = ['Style', 'Category']
+
+
+def encode_strings(values):
+    """(UTF-8 arena, int64 end offsets, null mask) of values, nulls stored as empty"""
+    nulls = np.asarray(pd.isna(values), dtype=bool)
+    encoded = [b'' if null else str(value).encode('utf-8') for value, null in zip(values, nulls)]
+    ends = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), ends, nulls
+
+
+def encode_categories(values):
+    """(int32 codes, distinct values) of values, missing values coded -1"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    return codes.astype(np.int32), [str(value) for value in uniques]
+
+
+class RecordStore:
+    """Records as columns of codes and string arenas instead of Python objects
+
+    Holds the art metadata and the food records alike.
+
+    Categorical fields are int32 codes into a list of their distinct values,
+    so each artist or style string exists once. Other fields are UTF-8 bytes
+    in one arena per field, sliced by an offsets array, with a null mask.
+    The arrays may be memory-mapped from a snapshot. get_many builds
+    response dicts for a batch of rows without creating pandas objects.
+    """
+
+    def __init__(self, fields, categorical, strings):
+        self.fields = fields
+        self.categorical = categorical
+        self.strings = strings
+
+    @classmethod
+    def from_frame(cls, df, fields=ART_RECORD_FIELDS, categorical_fields=ART_CATEGORICAL_FIELDS):
+        """Build a store from the given columns of a DataFrame"""
+        categorical = {}
+        strings = {}
+        for field in fields:
+            values = df[field].to_numpy(dtype=object)
+            if field in categorical_fields:
+                categorical[field] = encode_categories(values)
+            else:
+                data, ends, nulls = encode_strings(values)
+                strings[field] = (data, np.concatenate([[0], ends]), nulls)
+        return cls(fields, categorical, strings)
+
+    def __len__(self):
+        if self.categorical:
+            return len(next(iter(self.categorical.values()))[0])
+        return len(next(iter(self.strings.values()))[2])
+
+    def _values(self, field, ids):
+        if field in self.categorical:
+            codes, values = self.categorical[field]
+            return [values[code] if code >= 0 else None for code in codes[ids].tolist()]
+        data, offsets, nulls = self.strings[field]
+        starts = offsets[ids].tolist()
+        ends = offsets[ids + 1].tolist()
+        return [None if null else data[start:end].tobytes().decode('utf-8')
+                for start, end, null in zip(starts, ends, nulls[ids].tolist())]
+
+    def get_many(self, ids):
+        """Records for row ids as dicts of field to value, None where missing"""
+        ids = np.asarray(ids, dtype=np.int64)
+        columns = [self._values(field, ids) for field in self.fields]
+        return [dict(zip(self.fields, values)) for values in zip(*columns)]
+
+    def field_values(self, field, ids):
+        """Values of one field for row ids, None where missing"""
+        return self._values(field, np.asarray(ids, dtype=np.int64))
+
+    def column(self, field):
+        """Every value of one field, in row order"""
+        return self._values(field, np.arange(len(self)))
+
+    def isin(self, field, values):
+        """Boolean mask of the rows whose field is one of values"""
+        values = set(values)
+        if field in self.categorical:
+            codes, distinct = self.categorical[field]
+            wanted = [code for code, value in enumerate(distinct) if value in values]
+            return np.isin(codes, wanted)
+        return np.array([value in values for value in self.column(field)], dtype=bool)
+
+    def to_frame(self):
+        """The records as a DataFrame"""
+        return pd.DataFrame({field: self.column(field) for field in self.fields})
+
+    def memory_usage(self):
+        """Bytes held per field, distinct values of categorical fields included"""
+        usage = {}
+        for field, (codes, values) in self.categorical.items():
+            usage[field] = codes.nbytes + sum(sys.getsizeof(value) for value in values)
+        for field, arrays in self.strings.items():
+            usage[field] = sum(array.nbytes for array in arrays)
+        return usage
+
+
+def facet_values(field, value):
+    """Normalized filter values of one entry of field, split if multi-valued"""
+    if pd.isna(value):
+        return []
+    parts = str(value).split(',') if field in MULTI_VALUED_FIELDS else [str(value)]
+    return [part.strip().casefold() for part in parts if part.strip()]
+
+
+def intersect_sorted(a, b):
+    """Intersection of two sorted arrays of unique ids, by binary search from the smaller"""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0 or len(b) == 0:
+        return a[:0]
+    positions = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[positions] == a]
+
+
+class FacetIndex:
+    """Sorted row ids for every value of the categorical fields of a RecordStore
+
+    Built once per store, so a filter is a dict lookup and combined filters
+    are intersections of sorted id arrays, smallest first, instead of a scan
+    over every record. Multi-valued entries list their row under each value,
+    and values match case-insensitively.
+    """
+
+    def __init__(self, store, fields=ART_CATEGORICAL_FIELDS):
+        self.ids = {}
+        for field in fields:
+            codes, values = store.categorical[field]
+            # rows grouped by code; missing values (-1) sort first and are skipped
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            parts = {}
+            for code, value in enumerate(values):
+                for facet in facet_values(field, value):
+                    parts.setdefault(facet, []).append(order[bounds[code]:bounds[code + 1]])
+            self.ids[field] = {
+                facet: rows[0] if len(rows) == 1 else np.sort(np.concatenate(rows))
+                for facet, rows in parts.items()
+            }
+
+    def values(self, field):
+        """Normalized values of field that have at least one row"""
+        return list(self.ids[field])
+
+    def matching(self, filters):
+        """Sorted ids of the rows matching filters
+
+        filters maps a field to a list of accepted values; a row must match
+        one value of every field.
+        """
+        empty = np.empty(0, dtype=np.int32)
+        selections = []
+        for field, values in filters.items():
+            rows = [self.ids[field].get(value.strip().casefold(), empty) for value in values]
+            selections.append(rows[0] if len(rows) == 1 else np.unique(np.concatenate(rows)))
+        selections.sort(key=len)
+        ids = selections[0]
+        for rows in selections[1:]:
+            ids = intersect_sorted(ids, rows)
+        return ids
+
+
+def facet_mask(df, filters):
+    """Boolean mask of the DataFrame rows matching filters, as FacetIndex.matching"""
+    mask = np.ones(len(df), dtype=bool)
+    for field, values in filters.items():
+        wanted = {value.strip().casefold() for value in values}
+        mask &= np.array([not wanted.isdisjoint(facet_values(field, value)) for value in df[field]], dtype=bool)
+    return mask
@@ -0,0 +1,63 @@
+"""Bounded LRU/TTL cache for pairing results"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so equivalent inputs and prompts share a key"""
+    return ' '.join(text.lower().split())
+
+
+class ResultCache:
+    """Least-recently-used cache whose entries also expire after ttl seconds
+
+    Entries are tagged with the dataset version they were computed from;
+    clear() drops everything when the datasets are reloaded, and a lookup
+    under a different version is always a miss.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, entry_version, expires = entry
+            if entry_version != version or expires < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+        }
@@ -0,0 +1,578 @@
+"""Versioned binary snapshot of the datasets and their fitted indexes
+
+A snapshot is a directory of .npy files plus manifest.json. The food records
+and the art metadata are stored as RecordStores, column by column: each
+string column is one UTF-8 byte arena with an offsets array and a null
+mask, and the categorical art fields are codes into their distinct values.
+Each fitted TF-IDF index stores its vocabulary (as another string arena),
+idf weights, the CSR data/indices/indptr arrays and its postings lists, and
+the emotion index stores its per-family matrices and raw scores, plus the
+trained IVF arrays when built for that backend, so loading needs neither
+CSV parsing nor refitting.
+
+Building streams the CSVs in chunks, reading only the columns the app uses
+with the emotion scores as float32. Each chunk is appended to the column
+files on disk and fed to the index fits, so peak memory depends on the
+chunk size and the fitted indexes, not on the size of the CSVs.
+
+The arrays can be opened with np.load(mmap_mode='r'): every worker process
+then maps the same files and the OS page cache holds a single copy of them.
+ensure_snapshot lets the first worker build a missing or stale snapshot
+while the others wait for it.
+
+Compaction replaces the snapshot with one written from the refitted
+catalog, see SnapshotPublisher. It keeps the dataset version of the CSVs,
+so it stays current, under a new base version that names the change log
+holding the runtime changes made since.
+
+Usage:
+    python snapshot.py build-snapshot --food-csv fooddataset490.csv --art-csv artdataset490.csv
+    python snapshot.py build-snapshot --food-csv fooddataset490.csv --art-csv artdataset490.csv --vector-index ivf
+"""
+import argparse
+import fcntl
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from emotion_index import EMOTION_FAMILIES, EmotionIndex, emotion_columns
+from inverted_index import InvertedIndex
+from record_store import (ART_CATEGORICAL_FIELDS, ART_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS, FOOD_RECORD_FIELDS,
+                          RecordStore, encode_strings)
+from text_index import HASHING_FEATURES, ArtIndex, FoodIndex
+from vector_index import IVFIndex
+
+SNAPSHOT_FORMAT = 7
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot'))
+
+# index settings of the snapshot the app builds and loads; the command line
+# tools default to them, so they accept that snapshot instead of rebuilding it
+# 'hashing' indexes food descriptions into a fixed number of hashed columns
+# instead of a vocabulary, bounding memory and fitting the CSV in chunks
+FOOD_FEATURIZER = os.environ.get('FOOD_FEATURIZER', 'vocabulary')
+FOOD_HASHING_FEATURES = int(os.environ.get('HASHING_FEATURES', HASHING_FEATURES))
+# nearest-neighbour backend for emotion mode: 'exact' scans every artwork,
+# 'ivf' only probes the closest k-means buckets, trained once into the snapshot
+ART_VECTOR_INDEX = os.environ.get('ART_VECTOR_INDEX', 'exact')
+
+# CSV rows read at a time, and the columns kept from each dataset
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 100000))
+FOOD_COLUMNS = FOOD_RECORD_FIELDS
+ART_EMOTION_COLUMNS = [column for family in EMOTION_FAMILIES for column in emotion_columns(family)]
+ART_COLUMNS = ART_RECORD_FIELDS + ART_EMOTION_COLUMNS
+POSTINGS_ARRAYS = ('indptr', 'doc_ids', 'weights', 'max_weights')
+
+
+def read_csv_chunks(path, columns, chunk_rows=CSV_CHUNK_ROWS):
+    """Iterate over a CSV in DataFrame chunks holding only columns
+
+    Text columns are read as strings, so a chunk where one is entirely
+    missing keeps its type, and the emotion columns as float32.
+    """
+    dtypes = {column: np.float32 if ':' in column else str for column in columns}
+    return pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunk_rows)
+
+
+def read_csv_projected(path, columns, chunk_rows=CSV_CHUNK_ROWS):
+    """The needed columns of a CSV as one DataFrame, read in chunks"""
+    return pd.concat(read_csv_chunks(path, columns, chunk_rows), ignore_index=True)
+
+
+def dataset_fingerprint(paths):
+    """Short hash of the dataset files' paths, sizes and modification times"""
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+class NpyWriter:
+    """Append rows to a .npy file without holding them all in memory
+
+    Rows go to a side file as they arrive; close() writes the header, which
+    needs the final row count, and copies the rows after it.
+    """
+
+    def __init__(self, path, dtype, row_shape=()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.rows = 0
+        self._part = open(f'{path}.part', 'wb')
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self._part.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        self._part.close()
+        header = {
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (self.rows,) + self.row_shape,
+        }
+        with open(self.path, 'wb') as f, open(f'{self.path}.part', 'rb') as part:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(part, f, 16 * 1024 ** 2)
+        os.remove(f'{self.path}.part')
+
+
+class StringColumnWriter:
+    """Append strings to a UTF-8 arena with int64 offsets and a null mask"""
+
+    def __init__(self, prefix):
+        self._data = NpyWriter(f'{prefix}.data.npy', np.uint8)
+        self._offsets = NpyWriter(f'{prefix}.offsets.npy', np.int64)
+        self._nulls = NpyWriter(f'{prefix}.nulls.npy', bool)
+        self._offsets.append([0])
+        self._end = 0
+
+    def append(self, values):
+        data, ends, nulls = encode_strings(values)
+        self._data.append(data)
+        self._offsets.append(ends + self._end)
+        self._nulls.append(nulls)
+        self._end += len(data)
+
+    def close(self):
+        for writer in (self._data, self._offsets, self._nulls):
+            writer.close()
+
+
+class CategoricalColumnWriter:
+    """Append values as int32 codes, writing the distinct values on close"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._codes = NpyWriter(f'{prefix}.codes.npy', np.int32)
+        self._values = {}
+
+    def append(self, values):
+        self._codes.append([-1 if pd.isna(value) else self._values.setdefault(str(value), len(self._values))
+                            for value in values])
+
+    def close(self):
+        self._codes.close()
+        write_strings(f'{self.prefix}.values', list(self._values))
+
+
+def write_strings(prefix, values):
+    """Write strings as a UTF-8 arena, int64 offsets and a null mask"""
+    writer = StringColumnWriter(prefix)
+    writer.append(values)
+    writer.close()
+
+
+def read_strings(prefix, mmap_mode=None):
+    """Read back a string column written by write_strings, nulls as None"""
+    data = np.load(f'{prefix}.data.npy', mmap_mode=mmap_mode)
+    offsets = np.load(f'{prefix}.offsets.npy', mmap_mode=mmap_mode)
+    nulls = np.load(f'{prefix}.nulls.npy', mmap_mode=mmap_mode)
+    return [None if null else data[start:end].tobytes().decode('utf-8')
+            for start, end, null in zip(offsets[:-1].tolist(), offsets[1:].tolist(), nulls.tolist())]
+
+
+class EmotionScoresWriter:
+    """Write the raw emotion scores chunk by chunk, one float32 matrix per family
+
+    Missing scores are written as 0. The files are the ones write_emotions
+    leaves the scores in, so the CSV's largest columns are stored once.
+    """
+
+    def __init__(self, directory):
+        self._writers = {
+            family: NpyWriter(os.path.join(directory, f'art.emotion.{family}.scores.npy'), np.float32,
+                              (len(emotion_columns(family)),))
+            for family in EMOTION_FAMILIES
+        }
+
+    def append(self, df):
+        for family, writer in self._writers.items():
+            writer.append(np.nan_to_num(df[emotion_columns(family)].to_numpy(dtype=np.float32)))
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+
+class RecordWriter:
+    """Write RecordStore fields chunk by chunk"""
+
+    def __init__(self, directory, name, fields=ART_RECORD_FIELDS, categorical_fields=ART_CATEGORICAL_FIELDS):
+        self.fields = fields
+        self.rows = 0
+        self._files = {field: f'{name}.records.{i}' for i, field in enumerate(fields)}
+        self._writers = {
+            field: (CategoricalColumnWriter if field in categorical_fields else StringColumnWriter)(
+                os.path.join(directory, self._files[field]))
+            for field in fields
+        }
+
+    def append(self, df):
+        for field, writer in self._writers.items():
+            writer.append(df[field].to_numpy())
+        self.rows += len(df)
+
+    def close(self):
+        """Finish the field files and return the store's manifest entry"""
+        for writer in self._writers.values():
+            writer.close()
+        return {
+            'rows': self.rows,
+            'fields': [
+                {'name': field, 'file': self._files[field],
+                 'kind': 'categorical' if isinstance(self._writers[field], CategoricalColumnWriter) else 'string'}
+                for field in self.fields
+            ],
+        }
+
+
+def read_records(directory, entry, mmap_mode=None):
+    """Rebuild a RecordStore written by RecordWriter"""
+    categorical = {}
+    strings = {}
+    for field in entry['fields']:
+        prefix = os.path.join(directory, field['file'])
+        if field['kind'] == 'categorical':
+            categorical[field['name']] = (np.load(f'{prefix}.codes.npy', mmap_mode=mmap_mode),
+                                          read_strings(f'{prefix}.values'))
+        else:
+            strings[field['name']] = tuple(np.load(f'{prefix}.{part}.npy', mmap_mode=mmap_mode)
+                                           for part in ('data', 'offsets', 'nulls'))
+    return RecordStore([field['name'] for field in entry['fields']], categorical, strings)
+
+
+def written_texts(chunks, column, writers):
+    """Write each chunk to writers and yield its column, so an index is fitted in the same pass"""
+    for chunk in chunks:
+        for writer in writers:
+            writer.append(chunk)
+        yield chunk[column].fillna('')
+
+
+def write_index(directory, name, index):
+    """Write a fitted TF-IDF index as vocabulary, idf, CSR arrays and postings
+
+    A hashing index has no vocabulary to write.
+    """
+    prefix = os.path.join(directory, f'{name}.tfidf')
+    if index.featurizer == 'vocabulary':
+        write_strings(f'{prefix}.vocabulary', index.vocabulary())
+    np.save(f'{prefix}.idf.npy', index.vectorizer.idf_)
+    np.save(f'{prefix}.data.npy', index.matrix.data)
+    np.save(f'{prefix}.indices.npy', index.matrix.indices)
+    np.save(f'{prefix}.indptr.npy', index.matrix.indptr)
+    for part in POSTINGS_ARRAYS:
+        np.save(f'{prefix}.postings.{part}.npy', getattr(index.postings, part))
+    return {'shape': list(index.matrix.shape), 'nnz': int(index.matrix.nnz), 'featurizer': index.featurizer}
+
+
+def read_index(directory, name, entry, index_class, mmap_mode=None):
+    """Rebuild a fitted TF-IDF index written by write_index"""
+    prefix = os.path.join(directory, f'{name}.tfidf')
+    matrix = csr_matrix(
+        (np.load(f'{prefix}.data.npy', mmap_mode=mmap_mode),
+         np.load(f'{prefix}.indices.npy', mmap_mode=mmap_mode),
+         np.load(f'{prefix}.indptr.npy', mmap_mode=mmap_mode)),
+        shape=tuple(entry['shape'])
+    )
+    vocabulary = None
+    if entry.get('featurizer', 'vocabulary') == 'vocabulary':
+        vocabulary = read_strings(f'{prefix}.vocabulary', mmap_mode)
+    postings = InvertedIndex.from_arrays(
+        entry['shape'][0], *(np.load(f'{prefix}.postings.{part}.npy', mmap_mode=mmap_mode) for part in POSTINGS_ARRAYS)
+    )
+    return index_class.from_arrays(vocabulary, np.load(f'{prefix}.idf.npy'), matrix, postings)
+
+
+def write_emotions(directory, emotion_index, scores=True):
+    """Write the per-family emotion matrices, projections, means and raw scores
+
+    With scores=False the raw scores are left out, for a build that already
+    wrote them with EmotionScoresWriter. The vector indexes of an IVF emotion
+    index are written too, so workers load the trained buckets instead of
+    each running k-means again.
+    """
+    for family in EMOTION_FAMILIES:
+        prefix = os.path.join(directory, f'art.emotion.{family}')
+        if scores:
+            np.save(f'{prefix}.scores.npy', emotion_index.scores_by_family[family])
+        np.save(f'{prefix}.matrix.npy', emotion_index.matrices[family])
+        np.save(f'{prefix}.projection.npy', emotion_index.projections[family])
+        np.save(f'{prefix}.mean.npy', emotion_index.means[family])
+        if emotion_index.vector_index == 'ivf':
+            emotion_index.vector_indexes[family].save(f'{prefix}.ivf')
+    return {'families': list(EMOTION_FAMILIES), 'vector_index': emotion_index.vector_index}
+
+
+def read_emotions(directory, entry, mmap_mode=None, vector_index='exact', index_params=None):
+    """Read the arrays written by write_emotions, as EmotionIndex.from_arrays kwargs
+
+    The saved IVF indexes are included when vector_index asks for them.
+    """
+    arrays = {'matrices': {}, 'projections': {}, 'means': {}, 'scores': {}}
+    for family in entry['families']:
+        prefix = os.path.join(directory, f'art.emotion.{family}')
+        arrays['scores'][family] = np.load(f'{prefix}.scores.npy', mmap_mode=mmap_mode)
+        arrays['matrices'][family] = np.load(f'{prefix}.matrix.npy', mmap_mode=mmap_mode)
+        arrays['projections'][family] = np.load(f'{prefix}.projection.npy', mmap_mode=mmap_mode)
+        arrays['means'][family] = np.load(f'{prefix}.mean.npy')
+    if vector_index == 'ivf' and entry['vector_index'] == 'ivf':
+        arrays['vector_indexes'] = {
+            family: IVFIndex.load(os.path.join(directory, f'art.emotion.{family}.ivf'), mmap_mode, **(index_params or {}))
+            for family in entry['families']
+        }
+    return arrays
+
+
+def read_manifest(snapshot_dir):
+    """The snapshot manifest, or None when there is no snapshot"""
+    try:
+        with open(os.path.join(snapshot_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def food_index_matches(entry, food_featurizer, n_features):
+    """Whether a saved food index was built with the given featurizer"""
+    if entry.get('featurizer', 'vocabulary') != food_featurizer:
+        return False
+    return food_featurizer != 'hashing' or entry['shape'][1] == n_features
+
+
+def snapshot_version(manifest):
+    """The base version catalogs loaded from a snapshot get, which names its change log"""
+    return manifest.get('base_version', manifest['dataset_version'])
+
+
+def snapshot_is_current(snapshot_dir, food_csv, art_csv, food_featurizer='vocabulary', n_features=HASHING_FEATURES,
+                        vector_index='exact'):
+    """True when the snapshot matches the CSVs, or the CSVs are not available
+
+    A snapshot without the trained vector_index is not current for it; every
+    snapshot serves exact search.
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None or manifest.get('format') != SNAPSHOT_FORMAT:
+        return False
+    if not food_index_matches(manifest['indexes']['food'], food_featurizer, n_features):
+        return False
+    if vector_index != 'exact' and manifest['indexes']['emotion']['vector_index'] != vector_index:
+        return False
+    if not (os.path.exists(food_csv) and os.path.exists(art_csv)):
+        return True
+    return manifest['dataset_version'] == dataset_fingerprint([food_csv, art_csv])
+
+
+def write_manifest(directory, manifest):
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def install_snapshot(temp_dir, snapshot_dir):
+    """Move a snapshot written to temp_dir into place, replacing any older one"""
+    old_dir = f'{snapshot_dir}.old-{os.getpid()}'
+    if os.path.exists(snapshot_dir):
+        os.rename(snapshot_dir, old_dir)
+    os.rename(temp_dir, snapshot_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+@contextmanager
+def snapshot_lock(snapshot_dir, blocking=True):
+    """Hold the lock file of snapshot_dir; yields whether it was acquired, always so when blocking"""
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_dir)), exist_ok=True)
+    with open(f'{snapshot_dir}.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def build_snapshot(snapshot_dir, food_csv, art_csv, food_featurizer='vocabulary', n_features=HASHING_FEATURES,
+                   chunk_rows=CSV_CHUNK_ROWS, vector_index='exact'):
+    """Stream both CSVs into a fresh snapshot, fitting the indexes on the way
+
+    The snapshot is written to a temporary directory first and then moved
+    into place, so readers never see a half-written snapshot.
+    """
+    start = time.perf_counter()
+    temp_dir = f'{snapshot_dir}.tmp-{os.getpid()}'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    food_writer = RecordWriter(temp_dir, 'food', FOOD_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS)
+    descriptions = written_texts(read_csv_chunks(food_csv, FOOD_COLUMNS, chunk_rows), 'description', [food_writer])
+    if food_featurizer == 'hashing':
+        food_index = FoodIndex.from_text_chunks(descriptions, n_features)
+    else:
+        food_index = FoodIndex.from_texts(itertools.chain.from_iterable(descriptions))
+    food_records = food_writer.close()
+
+    # the art metadata goes to a record store and the emotion scores straight
+    # to the emotion index's files
+    scores_writer = EmotionScoresWriter(temp_dir)
+    record_writer = RecordWriter(temp_dir, 'art')
+    titles = written_texts(read_csv_chunks(art_csv, ART_COLUMNS, chunk_rows), 'Title', [scores_writer, record_writer])
+    art_index = ArtIndex.from_texts(itertools.chain.from_iterable(titles))
+    scores_writer.close()
+    art_records = record_writer.close()
+
+    # the index is fitted on the scores just written, memory-mapped
+    scores = {
+        family: np.load(os.path.join(temp_dir, f'art.emotion.{family}.scores.npy'), mmap_mode='r')
+        for family in EMOTION_FAMILIES
+    }
+    emotion_index = EmotionIndex.from_scores(art_index, scores, vector_index)
+
+    dataset_version = dataset_fingerprint([food_csv, art_csv])
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'dataset_version': dataset_version,
+        'base_version': dataset_version,
+        'sources': {'food': os.path.abspath(food_csv), 'art': os.path.abspath(art_csv)},
+        'built_at': time.time(),
+        'records': {
+            'food': food_records,
+            'art': art_records,
+        },
+        'indexes': {
+            'food': write_index(temp_dir, 'food', food_index),
+            'art': write_index(temp_dir, 'art', art_index),
+            'emotion': write_emotions(temp_dir, emotion_index, scores=False),
+        },
+    }
+    write_manifest(temp_dir, manifest)
+    install_snapshot(temp_dir, snapshot_dir)
+
+    print(f"Built snapshot {manifest['dataset_version']} in {snapshot_dir} "
+          f"({time.perf_counter() - start:.2f} s)")
+    return manifest
+
+
+def ensure_snapshot(snapshot_dir, food_csv, art_csv, food_featurizer='vocabulary', n_features=HASHING_FEATURES,
+                    vector_index='exact'):
+    """Build the snapshot unless it is current, one process at a time
+
+    Workers starting together serialize on a lock file; the first one builds
+    and the rest find a current snapshot once they get the lock.
+    """
+    if snapshot_is_current(snapshot_dir, food_csv, art_csv, food_featurizer, n_features, vector_index):
+        return
+    with snapshot_lock(snapshot_dir):
+        if not snapshot_is_current(snapshot_dir, food_csv, art_csv, food_featurizer, n_features, vector_index):
+            build_snapshot(snapshot_dir, food_csv, art_csv, food_featurizer, n_features, vector_index=vector_index)
+
+
+class SnapshotPublisher:
+    """Replaces the snapshot in snapshot_dir with compacted catalogs, see CatalogReloader
+
+    A compacting process holds the snapshot's lock, so only one process
+    compacts at a time and none while a stale snapshot is rebuilt. The
+    refitted catalog is written next to the snapshot, then moved into place
+    once the change log has moved on to its new base version.
+    """
+
+    def __init__(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+
+    def locked(self):
+        """Try to take the snapshot's lock, without waiting; yields whether it was taken"""
+        return snapshot_lock(self.snapshot_dir, blocking=False)
+
+    def base_version(self):
+        """Base version of the snapshot on disk, None when there is none"""
+        manifest = read_manifest(self.snapshot_dir)
+        return snapshot_version(manifest) if manifest is not None else None
+
+    def stage(self, catalog):
+        """(directory, base version) of catalog, a compacted one, written next to the snapshot"""
+        previous = read_manifest(self.snapshot_dir)
+        temp_dir = f'{self.snapshot_dir}.tmp-{os.getpid()}'
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        food_writer = RecordWriter(temp_dir, 'food', FOOD_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS)
+        food_writer.append(catalog.food_records.to_frame())
+        art_writer = RecordWriter(temp_dir, 'art')
+        art_writer.append(catalog.art_records.to_frame())
+        manifest = dict(
+            previous,
+            built_at=time.time(),
+            # unique among the compactions of the dataset version, so it never names an existing change log
+            base_version=f"{previous['dataset_version']}-{time.time_ns() // 1_000_000:x}",
+            records={'food': food_writer.close(), 'art': art_writer.close()},
+            indexes={
+                'food': write_index(temp_dir, 'food', catalog.food_index),
+                'art': write_index(temp_dir, 'art', catalog.art_index),
+                'emotion': write_emotions(temp_dir, catalog.emotion_index),
+            },
+        )
+        write_manifest(temp_dir, manifest)
+        return temp_dir, manifest['base_version']
+
+    def install(self, staged):
+        install_snapshot(staged, self.snapshot_dir)
+
+    def discard(self, staged):
+        shutil.rmtree(staged, ignore_errors=True)
+
+
+def load_snapshot(snapshot_dir, mmap=True, vector_index='exact', **index_params):
+    """Load (food_records, art_records, food_index, art_index, emotion_index, manifest)
+
+    With mmap the index and record arrays stay memory-mapped, read-only. An IVF vector index saved in the
+    snapshot is loaded rather than trained.
+    """
+    mmap_mode = 'r' if mmap else None
+    manifest = read_manifest(snapshot_dir)
+    indexes = manifest['indexes']
+    food_records = read_records(snapshot_dir, manifest['records']['food'], mmap_mode)
+    art_records = read_records(snapshot_dir, manifest['records']['art'], mmap_mode)
+    food_index = read_index(snapshot_dir, 'food', indexes['food'], FoodIndex, mmap_mode)
+    art_index = read_index(snapshot_dir, 'art', indexes['art'], ArtIndex, mmap_mode)
+    emotion_index = EmotionIndex.from_arrays(
+        art_index,
+        **read_emotions(snapshot_dir, indexes['emotion'], mmap_mode, vector_index, index_params),
+        vector_index=vector_index,
+        **index_params
+    )
+    return food_records, art_records, food_index, art_index, emotion_index, manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build-snapshot', help='convert the CSVs and fitted indexes into a snapshot')
+    build.add_argument('--food-csv', default=os.environ.get('FOOD_CSV_PATH'), required='FOOD_CSV_PATH' not in os.environ)
+    build.add_argument('--art-csv', default=os.environ.get('ART_CSV_PATH'), required='ART_CSV_PATH' not in os.environ)
+    build.add_argument('--out', default=SNAPSHOT_DIR)
+    build.add_argument('--food-featurizer', choices=['vocabulary', 'hashing'], default=FOOD_FEATURIZER)
+    build.add_argument('--hashing-features', type=int, default=FOOD_HASHING_FEATURES)
+    build.add_argument('--chunk-rows', type=int, default=CSV_CHUNK_ROWS)
+    build.add_argument('--vector-index', choices=['exact', 'ivf'], default=ART_VECTOR_INDEX,
+                       help='also train and save the IVF buckets of the emotion index')
+
+    args = parser.parse_args()
+    build_snapshot(args.out, args.food_csv, args.art_csv, args.food_featurizer, args.hashing_features, args.chunk_rows,
+                   args.vector_index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# the modules live at the repository root, next to app.py
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+ART_CSV_PATH = os.path.join(REPO_DIR, 'artdataset490.csv')
+
+
+@pytest.fixture(scope='session')
+def art_df():
+    return pd.read_csv(ART_CSV_PATH)
@@ -0,0 +1,161 @@
+"""Runtime record changes reach every reloader sharing a change log, and survive reloads and compaction"""
+import time
+
+import pandas as pd
+import pytest
+
+from catalog import Catalog, CatalogReloader, ChangeLog
+from emotion_index import EmotionIndex
+from record_store import FOOD_CATEGORICAL_FIELDS, FOOD_RECORD_FIELDS, RecordStore
+from snapshot import ART_COLUMNS, SnapshotPublisher, build_snapshot, load_snapshot, snapshot_version
+from text_index import ArtIndex, FoodIndex
+
+NEW_ART = {'Title': 'Garden Cake', 'Artist': 'Mark Rothko', 'Style': 'Modern Art', 'Category': 'Cubism',
+           'Image URL': 'added-0', 'Art (image+title): happiness': 0.9}
+NEW_FOOD = {'name': 'purple broth', 'description': 'glowing purple broth'}
+
+
+@pytest.fixture
+def loader(art_df):
+    art_df = art_df.head(300)
+    food_df = pd.DataFrame({'name': ['cake', 'soup'], 'description': ['chocolate cake', 'mushroom soup']})
+
+    def load():
+        art_index = ArtIndex(art_df)
+        food_records = RecordStore.from_frame(food_df, FOOD_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS)
+        return Catalog(food_records, RecordStore.from_frame(art_df), FoodIndex(food_df), art_index,
+                       EmotionIndex(art_df, art_index), 'v1')
+    return load
+
+
+def reloader(loader, directory, publisher=None):
+    catalogs = CatalogReloader(loader, change_log=ChangeLog(directory), publisher=publisher)
+    assert catalogs.load()
+    return catalogs
+
+
+@pytest.fixture
+def snapshot_dir(art_df, tmp_path):
+    food_csv, art_csv = tmp_path / 'food.csv', tmp_path / 'art.csv'
+    pd.DataFrame({'name': ['cake', 'soup'], 'description': ['chocolate cake', 'mushroom soup']}).to_csv(food_csv)
+    art_df.head(300)[ART_COLUMNS].to_csv(art_csv)
+    build_snapshot(str(tmp_path / 'snapshot'), food_csv, art_csv)
+    return str(tmp_path / 'snapshot')
+
+
+def load_from(snapshot_dir):
+    def load():
+        food_records, art_records, food_index, art_index, emotion_index, manifest = load_snapshot(snapshot_dir)
+        return Catalog(food_records, art_records, food_index, art_index, emotion_index, snapshot_version(manifest))
+    return load
+
+
+def wait_for_reload(catalogs):
+    while catalogs.reloading:
+        time.sleep(0.01)
+
+
+def snapshot_of(catalog):
+    return catalog.live_rows('food'), catalog.live_rows('art'), catalog.art_index.search('garden cake', 3)[0].tolist()
+
+
+def test_changes_reach_other_reloaders(loader, tmp_path):
+    first, second = reloader(loader, tmp_path), reloader(loader, tmp_path)
+    first.update(lambda catalog: (catalog.with_records('art', [NEW_ART]), 1))
+    first.update(lambda catalog: (catalog.with_records('food', [NEW_FOOD]), 1))
+    assert second.apply_logged_changes() == 2
+    assert snapshot_of(second.current) == snapshot_of(first.current)
+    assert second.current.version == first.current.version
+
+    # a change made on the second is applied after the ones it had not seen
+    second.update(lambda catalog: catalog.without_records('art', ['added-0']))
+    assert first.apply_logged_changes() == 1
+    assert first.current.live_rows('art') == 300
+    assert snapshot_of(second.current) == snapshot_of(first.current)
+
+
+def test_update_applies_unseen_changes_first(loader, tmp_path):
+    first, second = reloader(loader, tmp_path), reloader(loader, tmp_path)
+    first.update(lambda catalog: (catalog.with_records('art', [NEW_ART]), 1))
+    # the delete must see the artwork added by the other reloader
+    deleted = second.update(lambda catalog: catalog.without_records('art', ['added-0']))
+    assert deleted == 1
+    assert first.apply_logged_changes() == 1
+    assert first.current.live_rows('art') == second.current.live_rows('art') == 300
+
+
+def test_changes_survive_restart_and_reload(loader, tmp_path):
+    first = reloader(loader, tmp_path)
+    first.update(lambda catalog: (catalog.with_records('art', [NEW_ART]), 1))
+    expected = snapshot_of(first.current)
+
+    assert snapshot_of(reloader(loader, tmp_path).current) == expected
+    first._reload()
+    assert snapshot_of(first.current) == expected
+    assert first.apply_logged_changes() == 0
+
+
+def test_unfinished_line_is_skipped(loader, tmp_path):
+    first = reloader(loader, tmp_path)
+    with open(ChangeLog(tmp_path).path('v1'), 'ab') as f:
+        f.write(b'["append", "art", [{"Tit')
+    first.update(lambda catalog: (catalog.with_records('art', [NEW_ART]), 1))
+    restarted = reloader(loader, tmp_path)
+    assert restarted.current.live_rows('art') == 301
+
+
+def test_replay_applies_runs_of_changes_at_once(loader, tmp_path):
+    first = reloader(loader, tmp_path)
+    for i in range(3):
+        first.update(lambda catalog: (catalog.with_records('art', [dict(NEW_ART, **{'Image URL': f'added-{i}'})]), 1))
+    first.update(lambda catalog: catalog.without_records('art', ['added-0']))
+    first.update(lambda catalog: catalog.without_records('art', ['added-1']))
+    first.update(lambda catalog: (catalog.with_records('food', [NEW_FOOD]), 1))
+
+    restarted = reloader(loader, tmp_path)
+    assert [op for op, _, _ in restarted.current.changes] == ['append', 'delete', 'append']
+    assert snapshot_of(restarted.current) == snapshot_of(first.current)
+
+
+def test_compaction_publishes_a_snapshot_and_starts_a_new_log(snapshot_dir, tmp_path):
+    load = load_from(snapshot_dir)
+    first = reloader(load, tmp_path / 'changes', SnapshotPublisher(snapshot_dir))
+    second = reloader(load, tmp_path / 'changes', SnapshotPublisher(snapshot_dir))
+    first.update(lambda catalog: (catalog.with_records('art', [NEW_ART]), 1))
+    second.update(lambda catalog: (catalog.with_records('food', [NEW_FOOD]), 1))
+    loaded_version = first.current.base_version
+
+    first._compact()
+    wait_for_reload(first)
+    assert first.compactions == 1
+    assert first.current.base_version == SnapshotPublisher(snapshot_dir).base_version() != loaded_version
+    assert first.current.changes == ()
+    assert (first.current.live_rows('food'), first.current.live_rows('art')) == (3, 301)
+
+    # the second follows the closed log into the new one before changing anything
+    assert second.update(lambda catalog: catalog.without_records('art', ['added-0'])) == 1
+    wait_for_reload(second)
+    assert second.current.base_version == first.current.base_version
+    assert first.apply_logged_changes() == 1
+    assert snapshot_of(first.current) == snapshot_of(second.current)
+
+    # a restart loads the compacted snapshot and replays only the later change
+    restarted = reloader(load, tmp_path / 'changes')
+    assert len(restarted.current.changes) == 1
+    assert snapshot_of(restarted.current) == snapshot_of(first.current)
+
+    # a catalog of the old snapshot still finds every change, across the closed log
+    changes, version, _ = ChangeLog(tmp_path / 'changes').follow(loaded_version)
+    assert [op for op, _, _ in changes] == ['append', 'append', 'delete']
+    assert version == first.current.base_version
+
+
+def test_one_process_compacts_at_a_time(snapshot_dir, tmp_path):
+    publisher = SnapshotPublisher(snapshot_dir)
+    first = reloader(load_from(snapshot_dir), tmp_path / 'changes', publisher)
+    first.update(lambda catalog: (catalog.with_records('art', [NEW_ART]), 1))
+    with publisher.locked() as locked:
+        assert locked
+        first._compact()
+    assert first.compactions == 0
+    assert publisher.base_version() == first.current.base_version
@@ -0,0 +1,89 @@
+"""Facet ids and subset scoring must select and rank like brute-force filtering"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from catalog import Catalog
+from emotion_index import EmotionIndex
+from ranking import top_k
+from record_store import (ART_CATEGORICAL_FIELDS, FOOD_CATEGORICAL_FIELDS, FOOD_RECORD_FIELDS, FacetIndex, RecordStore,
+                          facet_mask)
+from text_index import ArtIndex, FoodIndex
+
+
+@pytest.fixture(scope='module')
+def facets(art_df):
+    return FacetIndex(RecordStore.from_frame(art_df))
+
+
+def filter_cases(facets):
+    """Single values, several values, differently cased and unknown values, and combined fields"""
+    rng = np.random.default_rng(0)
+    cases = []
+    for field in ART_CATEGORICAL_FIELDS:
+        values = facets.values(field)
+        picks = [values[i] for i in rng.choice(len(values), min(5, len(values)), replace=False)]
+        cases += [{field: [value]} for value in picks]
+        cases.append({field: [picks[0].upper(), f'  {picks[1]} ']})
+        cases.append({field: ['no such value']})
+    styles, categories = facets.values('Style'), facets.values('Category')
+    cases += [{'Style': [style], 'Category': [category]} for style in styles[:4] for category in categories[:4]]
+    cases.append({'Style': styles[:3], 'Category': categories[:3], 'Artist': facets.values('Artist')[:50]})
+    return cases
+
+
+def test_matching_equals_facet_mask(art_df, facets):
+    for filters in filter_cases(facets):
+        expected = np.flatnonzero(facet_mask(art_df, filters))
+        np.testing.assert_array_equal(facets.matching(filters), expected, err_msg=str(filters))
+
+
+def test_multi_valued_entries_match_each_value():
+    df = pd.DataFrame({
+        'Title': ['a', 'b', 'c'], 'Artist': ['X', None, 'Y'],
+        'Style': ['Modern Art,Baroque', 'baroque', None], 'Category': ['Cubism', 'Cubism', 'Cubism'],
+        'Image URL': ['u0', 'u1', 'u2'],
+    })
+    facets = FacetIndex(RecordStore.from_frame(df))
+    np.testing.assert_array_equal(facets.matching({'Style': ['Baroque']}), [0, 1])
+    np.testing.assert_array_equal(facets.matching({'Style': ['modern art'], 'Category': ['cubism']}), [0])
+    assert len(facets.matching({'Artist': ['Z']})) == 0
+
+
+@pytest.fixture(scope='module')
+def catalog(art_df):
+    food_df = pd.DataFrame({'name': ['cake', 'soup'], 'description': ['chocolate cake', 'mushroom soup']})
+    art_index = ArtIndex(art_df)
+    food_records = RecordStore.from_frame(food_df, FOOD_RECORD_FIELDS, FOOD_CATEGORICAL_FIELDS)
+    return Catalog(food_records, RecordStore.from_frame(art_df), FoodIndex(food_df), art_index,
+                   EmotionIndex(art_df, art_index), 'test')
+
+
+def test_art_ids_with_added_and_deleted_rows(catalog, facets):
+    changed = catalog.with_records('art', [
+        {'Title': 'Garden Cake', 'Artist': 'Mark Rothko', 'Style': 'Modern Art,Baroque', 'Category': 'Cubism',
+         'Image URL': 'added-0'},
+        {'Title': 'Portrait at sunset', 'Artist': 'X', 'Style': 'Renaissance Art', 'Category': 'Baroque',
+         'Image URL': 'added-1'},
+    ])
+    baroque = changed.art_ids({'Category': ['Baroque']})
+    changed, deleted = changed.without_records('art', [record['Image URL'] for record in changed.art_rows(baroque[:3])])
+    assert deleted == 3
+
+    frame = pd.concat([changed.art_records.to_frame(), changed.added['art']], ignore_index=True)
+    live = ~changed.art_index.deleted
+    for filters in filter_cases(facets) + [{'Style': ['baroque']}, {'Artist': ['Mark Rothko']}]:
+        expected = np.flatnonzero(facet_mask(frame, filters) & live)
+        np.testing.assert_array_equal(changed.art_ids(filters), expected, err_msg=str(filters))
+
+
+def test_subset_scores_rank_like_filtering_after(catalog, facets):
+    for filters in filter_cases(facets)[:10]:
+        ids = catalog.art_ids(filters)
+        for text in ('a garden at sunset', 'portrait of a man', 'chocolate cake'):
+            for scores in (lambda subset: catalog.art_index.scores(text, subset),
+                           lambda subset: catalog.emotion_index.scores(text, 'art', subset)):
+                full = scores(None)
+                subset = scores(ids)
+                np.testing.assert_allclose(subset, full[ids], atol=1e-6)
+                np.testing.assert_array_equal(ids[top_k(subset, 7)], ids[top_k(full[ids], 7)])
@@ -0,0 +1,78 @@
+"""TfidfIndex.search must rank exactly like top_k over the full scan of scores()"""
+import numpy as np
+import pytest
+
+import inverted_index
+from ranking import top_k
+from text_index import ArtIndex, TfidfIndex
+
+K_VALUES = (1, 3, 10, 50)
+
+
+@pytest.fixture(scope='module')
+def queries(art_df):
+    rng = np.random.default_rng(0)
+    titles = art_df['Title'].fillna('').tolist()
+    sampled = [titles[i] for i in rng.choice(len(titles), 60, replace=False)]
+    return sampled + ['', 'zzzz qqqq', 'garden', 'the', 'a portrait of a woman in a garden at night']
+
+
+def assert_same_ranking(index, queries, k_values=K_VALUES):
+    for query in queries:
+        scores = index.scores(query)
+        for k in k_values:
+            expected = top_k(scores, k)
+            ids, found = index.search(query, k)
+            np.testing.assert_array_equal(ids, expected, err_msg=f'{query!r}, k={k}')
+            np.testing.assert_allclose(found, scores[expected], atol=1e-12, err_msg=f'{query!r}, k={k}')
+
+
+def test_search_matches_full_scan(art_df, queries):
+    assert_same_ranking(ArtIndex(art_df), queries)
+
+
+def test_search_matches_full_scan_with_hashing(art_df, queries):
+    assert_same_ranking(TfidfIndex(art_df['Title'].fillna(''), 'hashing', 2 ** 18), queries)
+
+
+def test_search_with_added_and_deleted_rows(art_df, queries):
+    index = ArtIndex(art_df).without(np.arange(0, len(art_df), 3))
+    index = index.appended(queries[:20] + ['garden garden'])
+    # deleted rows in the delta as well as in the fitted rows
+    index = index.without([len(index) - 1, len(index) - 5])
+    assert_same_ranking(index, queries)
+
+
+def test_search_with_many_added_rows(art_df, queries):
+    # enough added rows share terms with the queries that their k-th best
+    # score seeds the pruning of the fitted rows
+    rng = np.random.default_rng(1)
+    titles = art_df['Title'].fillna('').tolist()
+    index = ArtIndex(art_df).appended([titles[i] for i in rng.choice(len(titles), 1000, replace=False)])
+    assert_same_ranking(index, queries)
+
+
+def test_search_with_only_added_rows_matching(art_df):
+    index = ArtIndex(art_df).appended(['zzzz qqqq', 'qqqq'])
+    assert_same_ranking(index, ['zzzz', 'qqqq', 'zzzz qqqq'])
+
+
+@pytest.mark.parametrize('share', [0, 1], ids=['dense accumulator', 'sorted merge'])
+def test_search_merge_strategies(art_df, queries, monkeypatch, share):
+    monkeypatch.setattr(inverted_index, 'DENSE_MERGE_SHARE', share)
+    assert_same_ranking(ArtIndex(art_df).without(np.arange(0, len(art_df), 7)), queries)
+
+
+def test_search_pads_with_zero_then_deleted_rows():
+    # fewer rows share a term than k, so zero-score and deleted rows fill the result
+    index = TfidfIndex(['apple pie', 'pear tart', 'plum', 'fig']).without([0, 2])
+    assert_same_ranking(index, ['nothing', 'apple', 'pear', 'apple pear'], k_values=(1, 2, 3, 4, 10))
+
+
+def test_query_is_best_search_result(art_df, queries):
+    index = ArtIndex(art_df)
+    for query in queries:
+        scores = index.scores(query)
+        best, similarity = index.query(query)
+        assert best == top_k(scores, 1)[0]
+        assert similarity == pytest.approx(scores[best])
@@ -0,0 +1,323 @@
+"""TF-IDF indexes that are fitted once and reused across requests"""
+import copy
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from inverted_index import InvertedIndex
+from metrics import timed
+from ranking import top_k
+
+# fixed feature width of the hashing featurizer
+HASHING_FEATURES = 2 ** 20
+# callers of scores_many() chunk their texts so one call's dense result stays
+# under this many scores, 128 MB of float64, whatever the catalog size
+SCORES_MANY_CELLS = 2 ** 24
+
+
+def stack_rows(chunks, n_columns):
+    """Stack a list of CSR matrices into one, emptying the list as it goes
+
+    Each chunk is freed once copied, so peak memory is about one stacked
+    matrix rather than two.
+    """
+    nnz = sum(chunk.nnz for chunk in chunks)
+    rows = sum(chunk.shape[0] for chunk in chunks)
+    data = np.empty(nnz, dtype=chunks[0].dtype if chunks else np.float64)
+    indices = np.empty(nnz, dtype=np.int32 if nnz < 2 ** 31 else np.int64)
+    indptr = np.zeros(rows + 1, dtype=indices.dtype)
+    row = value = 0
+    while chunks:
+        chunk = chunks.pop(0)
+        data[value:value + chunk.nnz] = chunk.data
+        indices[value:value + chunk.nnz] = chunk.indices
+        indptr[row + 1:row + 1 + chunk.shape[0]] = chunk.indptr[1:] + value
+        row += chunk.shape[0]
+        value += chunk.nnz
+    return csr_matrix((data, indices, indptr), shape=(rows, n_columns))
+
+
+class HashingTfidfVectorizer:
+    """TF-IDF over hashed terms, with a fixed width and no vocabulary
+
+    Terms are hashed into n_features columns, so memory does not grow with
+    the corpus vocabulary, and document frequencies are accumulated chunk by
+    chunk with partial_fit, so fitting never needs the whole corpus at once.
+    Tokenization, smoothed idf weights and L2 normalization match
+    TfidfVectorizer; columns no fitted document uses get no weight, like
+    out-of-vocabulary terms. Unrelated terms sharing a column is the only
+    difference, and rare at the default width.
+    """
+
+    def __init__(self, n_features=HASHING_FEATURES):
+        self.n_features = n_features
+        self.hasher = HashingVectorizer(
+            n_features=n_features, stop_words='english', alternate_sign=False, norm=None
+        )
+        self.n_documents = 0
+        self.document_counts = np.zeros(n_features, dtype=np.int64)
+        self.idf_ = None
+
+    def counts(self, texts):
+        """Raw term counts of texts, one sparse row per text"""
+        return self.hasher.transform(texts).tocsr()
+
+    def partial_fit(self, counts):
+        """Add the documents in a counts() matrix to the document frequencies"""
+        self.n_documents += counts.shape[0]
+        self.document_counts += np.bincount(counts.indices, minlength=self.n_features)
+        seen = self.document_counts > 0
+        self.idf_ = np.zeros(self.n_features)
+        self.idf_[seen] = np.log((1 + self.n_documents) / (1 + self.document_counts[seen])) + 1
+        return self
+
+    def weigh(self, counts, copy=True):
+        """TF-IDF rows for a counts() matrix, L2-normalized
+
+        With copy=False the counts matrix is overwritten instead of copied.
+        """
+        weighted = counts.copy() if copy else counts
+        weighted.data *= self.idf_[weighted.indices]
+        return normalize(weighted, copy=False)
+
+    def fit_transform(self, texts):
+        counts = self.counts(texts)
+        return self.partial_fit(counts).weigh(counts, copy=False)
+
+    def transform(self, texts):
+        return self.weigh(self.counts(texts), copy=False)
+
+
+class TfidfIndex:
+    """Fitted TF-IDF vectorizer together with the sparse matrix of its corpus
+
+    The vectorizer L2-normalizes every row, so cosine similarity against the
+    whole corpus is a single sparse matrix-vector product at query time.
+    Nothing is mutated after construction, so one instance can be shared by
+    every request thread.
+
+    Documents added later go into a delta matrix, vectorized with the fitted
+    vocabulary and idf weights, and deleted rows are masked out of every
+    score. Both return a new index; terms the fitted vocabulary lacks only
+    count once the index is refitted.
+
+    The featurizer is either 'vocabulary' (TfidfVectorizer) or 'hashing'
+    (HashingTfidfVectorizer); both produce interchangeable indexes.
+
+    search() and query() walk an inverted index of the fitted rows, so they
+    only touch documents sharing a term with the query; scores() still
+    scores every row, for callers that need them all.
+    """
+
+    def __init__(self, texts, featurizer='vocabulary', n_features=HASHING_FEATURES):
+        if featurizer == 'hashing':
+            self.vectorizer = HashingTfidfVectorizer(n_features)
+        else:
+            self.vectorizer = TfidfVectorizer(stop_words='english')
+        self.featurizer = featurizer
+        self.matrix = self.vectorizer.fit_transform(texts).tocsr()
+        self.postings = InvertedIndex(self.matrix)
+        self.delta = None
+        self.deleted = None
+
+    @classmethod
+    def from_texts(cls, texts, featurizer='vocabulary', n_features=HASHING_FEATURES):
+        """Fit an index of this class on texts, which may be any iterable read once"""
+        index = cls.__new__(cls)
+        TfidfIndex.__init__(index, texts, featurizer, n_features)
+        return index
+
+    @classmethod
+    def from_text_chunks(cls, chunks, n_features=HASHING_FEATURES):
+        """Fit a hashing index over an iterable of text chunks in one pass
+
+        Only one chunk of text is held at a time: each is reduced to sparse
+        term counts, which are weighted once all document frequencies are in.
+        """
+        index = cls.__new__(cls)
+        index.vectorizer = HashingTfidfVectorizer(n_features)
+        index.featurizer = 'hashing'
+        counts = []
+        for texts in chunks:
+            counts.append(index.vectorizer.counts(texts))
+            index.vectorizer.partial_fit(counts[-1])
+        index.matrix = index.vectorizer.weigh(stack_rows(counts, index.vectorizer.n_features), copy=False)
+        index.postings = InvertedIndex(index.matrix)
+        index.delta = None
+        index.deleted = None
+        return index
+
+    @classmethod
+    def from_arrays(cls, vocabulary, idf, matrix, postings=None):
+        """Rebuild a fitted index from its saved vocabulary, idf weights, matrix and postings
+
+        A hashing index has no vocabulary (None); its width is that of idf.
+        Without saved postings the inverted index is rebuilt from the matrix.
+        """
+        index = cls.__new__(cls)
+        if vocabulary is None:
+            index.vectorizer = HashingTfidfVectorizer(len(idf))
+            index.featurizer = 'hashing'
+        else:
+            index.vectorizer = TfidfVectorizer(
+                stop_words='english',
+                vocabulary={term: i for i, term in enumerate(vocabulary)}
+            )
+            index.featurizer = 'vocabulary'
+        index.vectorizer.idf_ = idf
+        index.matrix = matrix
+        index.postings = postings if postings is not None else InvertedIndex(matrix)
+        index.delta = None
+        index.deleted = None
+        return index
+
+    def appended(self, texts):
+        """A copy of the index with texts added as rows after the existing ones"""
+        index = copy.copy(self)
+        rows = self.vectorizer.transform(texts).tocsr()
+        index.delta = rows if self.delta is None else vstack([self.delta, rows]).tocsr()
+        if self.deleted is not None:
+            index.deleted = np.concatenate([self.deleted, np.zeros(len(texts), dtype=bool)])
+        return index
+
+    def without(self, rows):
+        """A copy of the index with rows masked out of every score"""
+        index = copy.copy(self)
+        index.deleted = np.zeros(len(self), dtype=bool) if self.deleted is None else self.deleted.copy()
+        index.deleted[rows] = True
+        return index
+
+    def vocabulary(self):
+        """Indexed terms in column order, None for a hashing index"""
+        if self.featurizer == 'hashing':
+            return None
+        return self.vectorizer.get_feature_names_out()
+
+    def __len__(self):
+        return self.matrix.shape[0] + (self.delta.shape[0] if self.delta is not None else 0)
+
+    def scores(self, text, ids=None):
+        """Cosine similarity of text against every indexed document
+
+        With ids, a sorted array of row ids, only those rows are scored and
+        the result follows their order.
+        """
+        query = self._vectorize([text]).toarray().ravel()
+        with timed('similarity'):
+            return self._scores(query, ids)
+
+    def _vectorize(self, texts):
+        with timed('transform'):
+            return self.vectorizer.transform(texts)
+
+    def _scores(self, query, ids):
+        if ids is not None:
+            n_base = self.matrix.shape[0]
+            split = np.searchsorted(ids, n_base)
+            scores = self.matrix[ids[:split]] @ query
+            if split < len(ids):
+                scores = np.concatenate([scores, self.delta[ids[split:] - n_base] @ query])
+            if self.deleted is not None:
+                scores[self.deleted[ids]] = -np.inf
+            return scores
+        scores = self.matrix @ query
+        if self.delta is not None:
+            scores = np.concatenate([scores, self.delta @ query])
+        if self.deleted is not None:
+            scores[self.deleted] = -np.inf
+        return scores
+
+    def scores_many(self, texts):
+        """Cosine similarities of many texts at once, one row per text
+
+        All texts are transformed into a single sparse matrix and scored
+        with one sparse matrix product.
+        """
+        queries = self._vectorize(texts)
+        with timed('similarity'):
+            scores = (queries @ self.matrix.T).toarray()
+            if self.delta is not None:
+                scores = np.hstack([scores, (queries @ self.delta.T).toarray()])
+            if self.deleted is not None:
+                scores[:, self.deleted] = -np.inf
+        return scores
+
+    def search(self, text, k):
+        """(row ids, scores) of the k best matching documents, best first
+
+        Ranks like top_k over scores(text), ties going to the lower row id,
+        but only the postings of the query's terms are read. Added rows are
+        scored exactly and their k-th best score seeds the pruning. When
+        fewer than k documents share a term, the lowest zero-score rows pad
+        the result, as they would in a full ranking.
+        """
+        query = self._vectorize([text]).tocsr()
+        n_base = self.matrix.shape[0]
+        base_deleted = self.deleted[:n_base] if self.deleted is not None else None
+
+        # pruned scoring selects the top k itself, so it counts as similarity
+        with timed('similarity'):
+            delta_ids = np.empty(0, dtype=np.int64)
+            delta_scores = np.empty(0)
+            threshold = -np.inf
+            if self.delta is not None:
+                all_delta_scores = (self.delta @ query.T).toarray().ravel()
+                if self.deleted is not None:
+                    all_delta_scores[self.deleted[n_base:]] = 0
+                delta_ids = top_k(all_delta_scores, k)
+                delta_ids = delta_ids[all_delta_scores[delta_ids] > 0]
+                delta_scores = all_delta_scores[delta_ids]
+                if len(delta_ids) == k:
+                    threshold = delta_scores[-1]
+                delta_ids = delta_ids + n_base
+            ids, scores = self.postings.search(query.indices, query.data, k, base_deleted, threshold)
+
+        with timed('top_k'):
+            ids = np.concatenate([ids.astype(np.int64), delta_ids])
+            scores = np.concatenate([scores, delta_scores])
+            order = np.lexsort((ids, -scores))[:k]
+            ids, scores = ids[order], scores[order]
+            if len(ids) < k:
+                padding, padding_scores = self._padding(ids, k - len(ids))
+                ids = np.concatenate([ids, padding])
+                scores = np.concatenate([scores, padding_scores])
+        return ids, scores
+
+    def _padding(self, taken, count):
+        """The count lowest rows outside taken, scored 0, then deleted ones, scored -inf"""
+        taken = set(taken.tolist())
+        live = []
+        deleted = []
+        for row in range(len(self)):
+            if row in taken:
+                continue
+            if self.deleted is not None and self.deleted[row]:
+                deleted.append(row)
+            else:
+                live.append(row)
+                if len(live) == count:
+                    break
+        rows = (live + deleted)[:count]
+        scores = [0.0] * min(len(live), count) + [-np.inf] * (len(rows) - len(live))
+        return np.array(rows, dtype=np.int64), np.array(scores)
+
+    def query(self, text):
+        """Return (row index, similarity) of the best matching document"""
+        ids, scores = self.search(text, 1)
+        return int(ids[0]), float(scores[0])
+
+
+class FoodIndex(TfidfIndex):
+    """Index over the food descriptions"""
+
+    def __init__(self, food_df, featurizer='vocabulary', n_features=HASHING_FEATURES):
+        super().__init__(food_df['description'].fillna(''), featurizer, n_features)
+
+
+class ArtIndex(TfidfIndex):
+    """Index over the artwork titles"""
+
+    def __init__(self, art_df):
+        super().__init__(art_df['Title'].fillna(''))
@@ -0,0 +1,116 @@
+"""Pluggable nearest-neighbour indexes over dense unit vectors
+
+Both backends rank by inner product, which is cosine similarity for the
+L2-normalized rows stored by EmotionIndex, and share one interface:
+search(query, k) returns (row ids, scores), best first.
+"""
+import numpy as np
+
+from ranking import top_k
+
+# arrays of a trained IVFIndex, as written by IVFIndex.save
+IVF_ARRAYS = ('centroids', 'ids', 'vectors', 'offsets')
+
+
+class ExactIndex:
+    """Brute-force search over every row"""
+
+    def __init__(self, vectors):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query, k):
+        scores = self.vectors @ query
+        ids = top_k(scores, k)
+        return ids, scores[ids]
+
+
+class IVFIndex:
+    """Inverted-file index: rows are bucketed under k-means centroids
+
+    A query scores the centroids, then only the rows in the n_probe closest
+    buckets. Raising n_probe trades latency for recall; n_probe == n_lists is
+    an exact search.
+    """
+
+    def __init__(self, vectors, n_lists=None, n_probe=8, n_iter=10, sample_size=50000, seed=0):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        self.n_probe = n_probe
+        self.centroids = self._train(vectors, min(n_lists, len(vectors)), n_iter, sample_size, seed)
+
+        # store rows grouped by bucket so each probe reads one contiguous slice
+        assignments = self._assign(vectors, self.centroids)
+        self.ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        self.vectors = vectors[self.ids]
+        self.offsets = np.searchsorted(assignments[self.ids], np.arange(len(self.centroids) + 1))
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=65536):
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignments[start:start + chunk_size] = (chunk @ centroids.T).argmax(axis=1)
+        return assignments
+
+    @classmethod
+    def _train(cls, vectors, n_lists, n_iter, sample_size, seed):
+        """Spherical k-means on a sample of the rows"""
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = cls._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # keep the old centroid for buckets that ended up empty
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+        return centroids
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query, k, n_probe=None):
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        lists = top_k(self.centroids @ query, n_probe)
+        slices = [np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists]
+        positions = np.concatenate(slices)
+        scores = self.vectors[positions] @ query
+        best = top_k(scores, k)
+        return self.ids[positions[best]], scores[best]
+
+    def save(self, prefix):
+        """Write the trained arrays as one .npy file each, named after prefix"""
+        for name in IVF_ARRAYS:
+            np.save(f'{prefix}.{name}.npy', getattr(self, name))
+
+    @classmethod
+    def load(cls, prefix, mmap_mode=None, n_probe=8, **training_params):
+        """Rebuild an index written by save, without training it again
+
+        With mmap_mode the arrays stay memory-mapped, so processes loading
+        the same files share them. training_params are accepted so the
+        constructor's keyword arguments can be passed as they are; the saved
+        arrays already fix them.
+        """
+        index = cls.__new__(cls)
+        for name in IVF_ARRAYS:
+            setattr(index, name, np.load(f'{prefix}.{name}.npy', mmap_mode=mmap_mode))
+        index.n_probe = n_probe
+        return index
+
+
+VECTOR_INDEXES = {
+    'exact': ExactIndex,
+    'ivf': IVFIndex,
+}
+
+
+def build_vector_index(vectors, kind='exact', **params):
+    """Build the named backend over vectors"""
+    return VECTOR_INDEXES[kind](vectors, **params)